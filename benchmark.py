@@ -0,0 +1,363 @@
+"""This file implements benchmarks that write machine-readable results.
+
+Usage: python benchmark.py {prediction,ingestion} [--output FILE]
+"""
+from typing import Any, Callable, Dict, List
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+import argparse
+import json
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+from data import Database, StringPool, TreeBuilder
+from cache import SnapshotCache
+from stream import read_events
+import predictor
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows, RSS is not measured there.
+    resource = None
+
+
+def commit_hash() -> str | None:
+    """Returns the commit the working tree is at, if it is a git repository.
+
+    Returns:
+        str | None: The commit hash.
+    """
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"],
+                              capture_output=True,
+                              text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def traced_peak(function: Callable[[], Any]) -> int:
+    """Runs a function and measures the most memory it allocated at once.
+
+    Args:
+        function (Callable[[], Any]): The function.
+
+    Returns:
+        int: The peak in bytes, as seen by tracemalloc.
+    """
+    tracemalloc.start()
+    try:
+        function()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def load_database(paths: List[Path], cache: SnapshotCache | None) -> Database:
+    """Loads sources into a new database.
+
+    Args:
+        paths (List[Path]): The sources.
+        cache (SnapshotCache | None): The cache of parsed sources.
+
+    Returns:
+        Database: The database.
+    """
+    db = Database(cache)
+    db.add_sources(paths)
+    return db
+
+
+def model_round_trip(k_tree: predictor.Vertex, table: predictor.LTable,
+                     names: List[str], parents: List[int],
+                     predicted: List[str]) -> Dict[str, Any]:
+    """Saves a model to a file, loads it back and predicts with it.
+
+    Args:
+        k_tree (predictor.Vertex): The merged tree.
+        table (predictor.LTable): The table.
+        names (List[str]): The names of the instances to predict.
+        parents (List[int]): The parent row of every instance.
+        predicted (List[str]): The predictions of the model before saving.
+
+    Raises:
+        RuntimeError: The loaded model predicts differently.
+
+    Returns:
+        Dict[str, Any]: The size of the file and the save and load times.
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        path = Path(directory) / "model.npz"
+        start = time.perf_counter()
+        predictor.save_model(path, k_tree, table)
+        save_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        loaded_tree, loaded_table = predictor.load_model(path)
+        load_seconds = time.perf_counter() - start
+        size = path.stat().st_size
+    if predictor.predict(loaded_tree, loaded_table, names,
+                         parents) != predicted:
+        raise RuntimeError("The loaded model predicts differently.")
+    return {
+        "model_bytes": size,
+        "model_save_seconds": save_seconds,
+        "model_load_seconds": load_seconds,
+    }
+
+
+def prediction_fold(train: List[Path], held_out: Path,
+                    cache: SnapshotCache | None, memory: bool,
+                    model: bool) -> Dict[str, Any]:
+    """Trains on some sources and predicts every instance of another one.
+
+    Args:
+        train (List[Path]): The sources to train on.
+        held_out (Path): The source to predict, with its class names hidden.
+        cache (SnapshotCache | None): The cache of parsed sources.
+        memory (bool): Whether to measure the peak memory of the build.
+        model (bool): Whether to also predict with the model saved to a
+            file and loaded back.
+
+    Returns:
+        Dict[str, Any]: The results of the fold.
+    """
+    train_db = load_database(train, cache)
+    start = time.perf_counter()
+    k_tree, table = predictor.initialize(train_db)
+    build_seconds = time.perf_counter() - start
+    build_peak = (traced_peak(lambda: predictor.initialize(train_db))
+                  if memory else None)
+    source = load_database([held_out], cache).sources[0]
+    names = [source.name_pool[name_id] for name_id in source.name_ids.tolist()]
+    parents = source.parents.tolist()
+    actual = [
+        source.class_pool[class_id]
+        for class_id in source.class_ids.tolist()
+    ]
+    # The whole source at once, as an import would.
+    start = time.perf_counter()
+    predicted = predictor.predict(k_tree, table, names, parents)
+    batch_seconds = time.perf_counter() - start
+    # One instance at a time, as the tree tab does, with a fresh fuzzy memo.
+    fresh_table = predictor.LTable(table.table, index=table.index)
+    tree_predictor = predictor.TreePredictor(k_tree, fresh_table)
+    latencies = np.zeros(len(names), dtype=np.int64)
+    for row, (name, parent) in enumerate(zip(names, parents)):
+        start = time.perf_counter_ns()
+        tree_predictor.add(row, parent, name)
+        latencies[row] = time.perf_counter_ns() - start
+    # The root of a source is the DataModel, which is never predicted.
+    hits = sum(guess == truth
+               for guess, truth in zip(predicted[1:], actual[1:]))
+    exact = sum(name.lower() in table.table for name in names[1:])
+    nodes = len(names) - 1
+    p50, p99 = ((np.percentile(latencies[1:], (50, 99)) / 1000).tolist()
+                if nodes else (None, None))
+    results = {
+        "held_out": held_out.name,
+        "train_sources": [path.name for path in train],
+        "nodes": nodes,
+        "accuracy": hits / nodes if nodes else None,
+        "fuzzy_lookups": nodes - exact,
+        "build_seconds": build_seconds,
+        "build_peak_bytes": build_peak,
+        "predict_seconds": batch_seconds,
+        "nodes_per_second": nodes / batch_seconds if batch_seconds else None,
+        "latency_p50_us": p50,
+        "latency_p99_us": p99,
+    }
+    if model:
+        results.update(
+            model_round_trip(k_tree, table, names, parents, predicted))
+    return results
+
+
+def benchmark_prediction(paths: List[Path], cache: SnapshotCache | None,
+                         memory: bool, model: bool) -> Dict[str, Any]:
+    """Leave-one-source-out evaluation of the predictor.
+
+    Args:
+        paths (List[Path]): The sources.
+        cache (SnapshotCache | None): The cache of parsed sources.
+        memory (bool): Whether to measure peak memory.
+        model (bool): Whether to check predicting with a saved model.
+
+    Returns:
+        Dict[str, Any]: The results of every fold and their totals.
+    """
+    folds = []
+    for held_out in paths:
+        train = [path for path in paths if path != held_out]
+        fold = prediction_fold(train, held_out, cache, memory, model)
+        print(f"{fold['held_out']}: accuracy {fold['accuracy']:.4f}, "
+              f"{fold['nodes_per_second']:.0f} nodes/s")
+        folds.append(fold)
+    nodes = sum(fold["nodes"] for fold in folds)
+    hits = sum(fold["accuracy"] * fold["nodes"] for fold in folds
+               if fold["nodes"])
+    seconds = sum(fold["predict_seconds"] for fold in folds)
+    return {
+        "folds": folds,
+        "total": {
+            "nodes": nodes,
+            "accuracy": hits / nodes if nodes else None,
+            "nodes_per_second": nodes / seconds if seconds else None,
+            "build_seconds": sum(fold["build_seconds"] for fold in folds),
+        }
+    }
+
+
+def peak_rss() -> int | None:
+    """Returns the peak resident set size of this process.
+
+    Returns:
+        int | None: The peak in bytes, None if it cannot be measured.
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS reports bytes, Linux reports KiB.
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def ingestion_file(path: Path) -> Dict[str, Any]:
+    """Measures loading a single source, run in a fresh process so the peak
+    RSS belongs to this file alone.
+
+    Args:
+        path (Path): The source.
+
+    Returns:
+        Dict[str, Any]: The results of the file.
+    """
+    size = path.stat().st_size
+    rss_before = peak_rss()
+    start = time.perf_counter()
+    db = Database()
+    db.add_source(path)
+    load_seconds = time.perf_counter() - start
+    rss_after = peak_rss()
+    rss_growth = (None if rss_before is None or rss_after is None else
+                  rss_after - rss_before)
+    nodes = len(db.sources[0])
+    del db
+    # Decoding alone, then building the tree from the decoded events.
+    start = time.perf_counter()
+    events = list(read_events(path))
+    decode_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    builder = TreeBuilder(StringPool(), StringPool())
+    builder.add_events(events)
+    builder.build(path)
+    build_seconds = time.perf_counter() - start
+    del events, builder
+    tracemalloc.start()
+    try:
+        db = Database()
+        db.add_source(path)
+        retained, traced_peak_bytes = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {
+        "file": path.name,
+        "bytes": size,
+        "nodes": nodes,
+        "load_seconds": load_seconds,
+        "decode_seconds": decode_seconds,
+        "build_seconds": build_seconds,
+        "bytes_per_second": size / load_seconds,
+        "nodes_per_second": nodes / load_seconds,
+        "traced_peak_bytes": traced_peak_bytes,
+        "peak_rss_bytes": rss_after,
+        "peak_rss_growth_bytes": rss_growth,
+        "retained_bytes": retained,
+        "retained_bytes_per_node": retained / nodes if nodes else None,
+    }
+
+
+def benchmark_ingestion(paths: List[Path]) -> Dict[str, Any]:
+    """Measures parsing and building the tree of every source.
+
+    Args:
+        paths (List[Path]): The sources.
+
+    Returns:
+        Dict[str, Any]: The results of every file and their totals.
+    """
+    files = []
+    for path in paths:
+        with ProcessPoolExecutor(1) as executor:
+            result = executor.submit(ingestion_file, path).result()
+        print(f"{result['file']}: {result['load_seconds']:.3f}s, "
+              f"{result['bytes_per_second'] / 2**20:.1f} MiB/s, "
+              f"{result['retained_bytes_per_node']:.0f} bytes/node")
+        files.append(result)
+    size = sum(result["bytes"] for result in files)
+    nodes = sum(result["nodes"] for result in files)
+    seconds = sum(result["load_seconds"] for result in files)
+    retained = sum(result["retained_bytes"] for result in files)
+    return {
+        "files": files,
+        "total": {
+            "bytes": size,
+            "nodes": nodes,
+            "load_seconds": seconds,
+            "decode_seconds": sum(result["decode_seconds"]
+                                  for result in files),
+            "build_seconds": sum(result["build_seconds"] for result in files),
+            "bytes_per_second": size / seconds if seconds else None,
+            "nodes_per_second": nodes / seconds if seconds else None,
+            "retained_bytes_per_node": retained / nodes if nodes else None,
+        }
+    }
+
+
+def main() -> None:
+    """Runs a benchmark from the command line."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("benchmark", choices=["prediction", "ingestion"])
+    parser.add_argument("--dataset",
+                        type=Path,
+                        default=Path("./dataset/"),
+                        help="the directory of the sources")
+    parser.add_argument("--output", type=Path, help="where to write results")
+    parser.add_argument("--no-cache",
+                        action="store_true",
+                        help="parse every source instead of using the cache, "
+                        "ingestion never uses it")
+    parser.add_argument("--no-memory",
+                        action="store_true",
+                        help="skip the slower peak memory measurements")
+    parser.add_argument("--model",
+                        action="store_true",
+                        help="also predict with the model saved to a file "
+                        "and loaded back, and time the save and load")
+    args = parser.parse_args()
+    paths = sorted(file for file in args.dataset.iterdir() if file.is_file())
+    cache = None if args.no_cache else SnapshotCache()
+    results = {
+        "benchmark": args.benchmark,
+        "commit": commit_hash(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+    }
+    if args.benchmark == "prediction":
+        results.update(
+            benchmark_prediction(paths, cache, not args.no_memory,
+                                 args.model))
+    else:
+        results.update(benchmark_ingestion(paths))
+    output = args.output or Path(f"./benchmark-{args.benchmark}.json")
+    with open(output, "w", encoding="UTF-8") as file:
+        json.dump(results, file, indent=4)
+    print(f"Results written to {output}.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""This file implements an on-disk cache of parsed data."""
+from typing import Dict, Iterable, List, Tuple
+from pathlib import Path
+from hashlib import sha1
+import json
+import os
+import numpy as np
+
+FORMAT_VERSION = 3
+
+
+def pack_strings(strings: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+    """Packs strings into arrays.
+
+    Args:
+        strings (List[str]): The strings.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]:
+            The UTF-8 bytes of every string joined and the character offset
+            where each string ends.
+    """
+    blob = np.frombuffer("".join(strings).encode("UTF-8"), dtype=np.uint8)
+    ends = np.cumsum(np.fromiter(map(len, strings),
+                                 dtype=np.int64,
+                                 count=len(strings)),
+                     dtype=np.int64)
+    return blob, ends
+
+
+def unpack_strings(blob: np.ndarray, ends: np.ndarray) -> List[str]:
+    """Reverses `pack_strings`.
+
+    Args:
+        blob (np.ndarray): The UTF-8 bytes.
+        ends (np.ndarray): The character offsets.
+
+    Returns:
+        List[str]: The strings.
+    """
+    text = blob.tobytes().decode("UTF-8")
+    strings: List[str] = []
+    start = 0
+    for end in ends.tolist():
+        strings.append(text[start:end])
+        start = end
+    return strings
+
+
+class SnapshotCache:
+    """Stores arrays on disk, keyed by the files they were computed from.
+
+    An entry is thrown away as soon as any of its files changes size or
+    modification time.
+    """
+    directory: Path
+
+    def __init__(self, directory: Path = Path("./.cache/")) -> None:
+        self.directory = directory
+
+    def __entry(self, kind: str, paths: List[Path]) -> Tuple[Path, np.ndarray]:
+        """Returns the file of an entry and the stamp that validates it."""
+        resolved = [str(path.resolve()) for path in paths]
+        digest = sha1("\n".join(resolved).encode("UTF-8")).hexdigest()[:20]
+        stats = [path.stat() for path in paths]
+        stamp = json.dumps([
+            FORMAT_VERSION,
+            [[name, stat.st_size, stat.st_mtime_ns]
+             for name, stat in zip(resolved, stats)]
+        ])
+        return (self.directory / f"{kind}-{digest}.npz",
+                np.frombuffer(stamp.encode("UTF-8"), dtype=np.uint8))
+
+    def load(self, kind: str,
+             paths: Iterable[Path]) -> Dict[str, np.ndarray] | None:
+        """Loads an entry.
+
+        Args:
+            kind (str): What the entry holds.
+            paths (Iterable[Path]): The files the entry was computed from.
+
+        Returns:
+            Dict[str, np.ndarray] | None: The arrays, None if there is no
+                valid entry.
+        """
+        file, stamp = self.__entry(kind, list(paths))
+        try:
+            with np.load(file) as entry:
+                if not np.array_equal(entry["stamp"], stamp):
+                    return None
+                return {key: entry[key] for key in entry.files}
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def save(self, kind: str, paths: Iterable[Path],
+             arrays: Dict[str, np.ndarray]) -> None:
+        """Saves an entry, replacing the old one.
+
+        Args:
+            kind (str): What the entry holds.
+            paths (Iterable[Path]): The files the entry was computed from.
+            arrays (Dict[str, np.ndarray]): The arrays to store.
+        """
+        file, stamp = self.__entry(kind, list(paths))
+        self.directory.mkdir(parents=True, exist_ok=True)
+        temp = file.with_name(f"{file.name}.{os.getpid()}.tmp")
+        try:
+            with open(temp, "wb") as out:
+                np.savez(out, stamp=stamp, **arrays)
+            os.replace(temp, file)
+        except OSError:
+            temp.unlink(missing_ok=True)
@@ -6,7 +6,9 @@ from functools import cache
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
 from matplotlib.figure import Figure
 from matplotlib.axes import Axes
-from data import CompiledData
+from matplotlib.artist import Artist
+from data import CompiledData, ColumnKey, DataSource
+from sketch import QuantileSketch
 
 class StringEnum(Enum):
     """Extends Enum."""
@@ -37,14 +39,32 @@ class StringEnum(Enum):
             dict_map[enum.name.replace("_", " ").title()] = enum
         return dict_map
 
+def _sketch_box(sketch: QuantileSketch) -> Dict[str, Any]:
+    """Returns box plot statistics from a sketch, for `Axes.bxp`. Whiskers
+    reach 1.5 IQR past the quartiles, within the range of the values, and
+    outliers are not drawn."""
+    first, median, third = sketch.quantiles((0.25, 0.5, 0.75))
+    spread = 1.5 * (third - first)
+    return {
+        "med": median,
+        "q1": first,
+        "q3": third,
+        "whislo": max(sketch.min, first - spread),
+        "whishi": min(sketch.max, third + spread),
+        "fliers": [],
+    }
+
+
 class ChartKey(StringEnum):
     """Different types of chart keys."""
-    NAME = member(lambda val: val.name)
-    CLASSNAME = member(lambda val: val.class_name)
-    NAME_LENGTH = member(lambda val: len(val.name))
-    CLASSNAME_LENGTH = member(lambda val: len(val.class_name))
-    NUMBER_OF_CHILDREN = member(lambda val: len(val.children) if val.children is not None else 0)
-    DEPTH = member(lambda val: sum(1 for _ in val.ancestors()))
+    NAME = member(ColumnKey(lambda source: source.name_ids,
+                            lambda source: source.name_pool))
+    CLASSNAME = member(ColumnKey(lambda source: source.class_ids,
+                                 lambda source: source.class_pool))
+    NAME_LENGTH = member(ColumnKey(DataSource.name_lengths))
+    CLASSNAME_LENGTH = member(ColumnKey(DataSource.class_name_lengths))
+    NUMBER_OF_CHILDREN = member(ColumnKey(lambda source: source.child_counts))
+    DEPTH = member(ColumnKey(lambda source: source.depths))
 
 
 class ChartType(StringEnum):
@@ -65,10 +85,18 @@ class SimpleChartWidgetOptions:
 
 
 class SimpleChartWidget(FigureCanvasTkAgg):
-    """A simple chart widget."""
+    """A simple chart widget.
+
+    The axes and artists are kept between renders, only the parts of the
+    chart whose options or data changed are rebuilt.
+    """
     figure: Figure
     compiled_data: CompiledData
     options: SimpleChartWidgetOptions
+    __axes: Axes | None
+    __chart_type: ChartType | None
+    __shown: Tuple[Any, ...] | None
+    __artists: List[Artist]
 
     def __init__(self, parent, compiled_data: CompiledData):
         figure = Figure((6, 6))
@@ -76,36 +104,97 @@ class SimpleChartWidget(FigureCanvasTkAgg):
         self.figure = figure
         self.compiled_data = compiled_data
         self.options = SimpleChartWidgetOptions()
+        self.__axes = None
+        self.__chart_type = None
+        self.__shown = None
+        self.__artists = []
 
     def render(self) -> None:
-        """Renders the chart."""
-        fig = self.figure
-        fig.clear()
-        plt = fig.add_subplot(111)
-        self.render_internal(plt)
-        self.draw()
+        """Renders the chart, the axes are only rebuilt when the chart type
+        changes."""
+        if self.__axes is None or self.options.chart_type != self.__chart_type:
+            self.figure.clear()
+            self.__axes = self.figure.add_subplot(111)
+            self.__chart_type = self.options.chart_type
+            self.__shown = None
+            self.__artists = []
+        self.render_internal(self.__axes)
+        self.draw_idle()
 
-    def render_internal(self, plt: Axes) -> None:
-        """Internal method used to render the chart."""
+    def render_titles(self) -> None:
+        """Updates only the titles, cheap enough to run on every keystroke.
+        """
+        if self.__axes is None:
+            return
+        self.__set_titles(self.__axes)
+        self.draw_idle()
+
+    def __set_titles(self, plt: Axes) -> None:
+        """Sets the chart and axis titles."""
+        plt.set_title(self.options.chart_title)
+        plt.set_xlabel(self.options.chart_x_axis_title)
+        plt.set_ylabel(self.options.chart_y_axis_title)
+
+    def __frequency_data(self) -> Tuple[List[Any], List[int]]:
+        """Returns the most common keys and their counts."""
         counter = self.compiled_data.frequency
         bucket = list(counter.most_common(self.options.show_common_amount))
         if self.options.show_others:
             bucket.append(("Other", counter.total() - sum(v[1] for v in bucket)))
             bucket.sort(key=lambda v: v[1], reverse=True)
-        frequency_data = ([val[0]
-                           for val in bucket], [val[1] for val in bucket])
+        return [val[0] for val in bucket], [val[1] for val in bucket]
+
+    def render_internal(self, plt: Axes) -> None:
+        """Internal method used to render the chart."""
+        self.__set_titles(plt)
         chart_type = self.options.chart_type
-        plt.set_title(self.options.chart_title)
-        plt.set_xlabel(self.options.chart_x_axis_title)
-        plt.set_ylabel(self.options.chart_y_axis_title)
+        shown = (self.compiled_data, ) if chart_type == ChartType.BOX_PLOT else (
+            self.compiled_data, self.options.show_common_amount,
+            self.options.show_others)
+        # The data is compared by identity, compiling makes a new object.
+        if (self.__shown is not None and self.__shown[0] is shown[0]
+                and self.__shown[1:] == shown[1:]):
+            return
+        self.__shown = shown
         if chart_type == ChartType.HISTOGRAM:
-            ticks = range(len(frequency_data[0]))
-            plt.barh(ticks, frequency_data[1])
-            plt.set_yticks(ticks, frequency_data[0])
+            labels, counts = self.__frequency_data()
+            ticks = range(len(counts))
+            if len(self.__artists) == len(counts):
+                for bar, count in zip(self.__artists, counts):
+                    bar.set_width(count)
+            else:
+                self.__remove_artists()
+                self.__artists = list(plt.barh(ticks, counts, color="C0"))
+            plt.set_yticks(ticks, labels)
+            plt.relim()
+            plt.autoscale_view()
             return
+        self.__remove_artists()
         if chart_type == ChartType.PIE_CHART:
-            plt.pie(frequency_data[1], labels=frequency_data[0])
+            labels, counts = self.__frequency_data()
+            # Fixed colors, the color cycle of reused axes moves on.
+            wedges, texts = plt.pie(
+                counts,
+                labels=labels,
+                colors=[f"C{index}" for index in range(len(counts))])
+            self.__artists = wedges + texts
             return
         if chart_type == ChartType.BOX_PLOT:
-            plt.boxplot(self.compiled_data.num_data)
+            # Forget the limits and ticks of the removed boxes.
+            plt.relim()
+            plt.set_xticks([])
+            sketch = self.compiled_data.sketch
+            if sketch is not None and len(sketch):
+                lines = plt.bxp([_sketch_box(sketch)])
+            else:
+                lines = plt.boxplot(self.compiled_data.num_data)
+            self.__artists = [
+                artist for artists in lines.values() for artist in artists
+            ]
             return
+
+    def __remove_artists(self) -> None:
+        """Removes the artists of the last render from the axes."""
+        for artist in self.__artists:
+            artist.remove()
+        self.__artists = []
@@ -1,26 +1,117 @@
 """This file implements data loading, compiling, and transformation."""
-from typing import List, Tuple, Any, TypedDict, Self, cast, Generator, Iterable, Callable
+from typing import List, Tuple, Any, Dict, cast, Generator, Iterable, Callable, Hashable
 from pathlib import Path
-from itertools import chain
-from collections import Counter
-from json import load as load_json
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+import os
+import sys
+import multiprocessing
+from array import array
+from collections import Counter, OrderedDict
 from dataclasses import dataclass
-from statistics import quantiles, mean, stdev
+from queue import Empty
+import numpy as np
+from stream import Event, InstanceEvent, read_events
+from cache import SnapshotCache, pack_strings, unpack_strings
+from sketch import QuantileSketch
 
-RawInstance = TypedDict("RawInstance", {
-    "name": str | None,
-    "class": str | None,
-    "children": Any | None
-})
+class StringPool:
+    """Maps strings to small integer ids so columns can store them as numbers."""
+    __strings: List[str]
+    __ids: Dict[str, int]
+    __lengths: np.ndarray
+
+    def __init__(self) -> None:
+        self.__strings = []
+        self.__ids = {}
+        self.__lengths = np.zeros(0, dtype=np.int32)
+
+    def intern(self, string: str) -> int:
+        """Returns the id of a string, adding it to the pool if needed.
+
+        Args:
+            string (str): The string to intern.
+
+        Returns:
+            int: The id of the string.
+        """
+        index = self.__ids.get(string)
+        if index is None:
+            index = len(self.__strings)
+            self.__ids[string] = index
+            self.__strings.append(string)
+        return index
+
+    def find(self, string: str) -> int | None:
+        """Returns the id of a string without adding it.
+
+        Args:
+            string (str): The string to look up.
+
+        Returns:
+            int | None: The id of the string, None if it is not in the pool.
+        """
+        return self.__ids.get(string)
+
+    def lengths(self) -> np.ndarray:
+        """Returns the length of every string indexed by id.
+
+        Returns:
+            np.ndarray: The lengths.
+        """
+        if len(self.__lengths) != len(self.__strings):
+            self.__lengths = np.fromiter(map(len, self.__strings),
+                                         dtype=np.int32,
+                                         count=len(self.__strings))
+        return self.__lengths
+
+    def __getitem__(self, index: int) -> str:
+        return self.__strings[index]
+
+    def __len__(self) -> int:
+        return len(self.__strings)
+
+    def __iter__(self) -> Generator[str, None, None]:
+        yield from self.__strings
 
 
-@dataclass
 class Instance:
-    """An `instance` in Roblox terms or an `object`."""
-    name: str
-    class_name: str
-    parent: Self | None
-    children: List[Self] | None
+    """An `instance` in Roblox terms or an `object`.
+
+    This is a thin view over one row of a `DataSource`.
+    """
+    __slots__ = ("source", "index")
+    source: "DataSource"
+    index: int
+
+    def __init__(self, source: "DataSource", index: int) -> None:
+        self.source = source
+        self.index = index
+
+    @property
+    def name(self) -> str:
+        """The name of the instance."""
+        source = self.source
+        return source.name_pool[int(source.name_ids[self.index])]
+
+    @property
+    def class_name(self) -> str:
+        """The class name of the instance."""
+        source = self.source
+        return source.class_pool[int(source.class_ids[self.index])]
+
+    @property
+    def parent(self) -> "Instance | None":
+        """The parent of the instance, None for the root."""
+        parent = int(self.source.parents[self.index])
+        return Instance(self.source, parent) if parent >= 0 else None
+
+    @property
+    def children(self) -> "List[Instance] | None":
+        """The children of the instance, None if it has no children."""
+        indices = self.source.child_indices_of(self.index)
+        if len(indices) == 0:
+            return None
+        return [Instance(self.source, index) for index in indices.tolist()]
 
     def depth(self) -> int:
         """Returns the depth of the instance.
@@ -28,83 +119,411 @@ class Instance:
         Returns:
             int: The depth of the instance.
         """
-        depth = 0
-        parent: Self | None = self.parent
-        while parent is not None:
-            depth += 1
-            parent = parent.parent
-        return depth
+        return int(self.source.depths[self.index])
+
+    @property
+    def child_count(self) -> int:
+        """The number of children."""
+        return int(self.source.child_counts[self.index])
+
+    @property
+    def subtree_size(self) -> int:
+        """The number of instances in the subtree, including itself."""
+        return int(self.source.subtree_sizes[self.index])
 
-    def ancestors(self) -> Generator[Self, None, None]:
+    @property
+    def sibling_index(self) -> int:
+        """The position of the instance among its siblings."""
+        return int(self.source.sibling_indices[self.index])
+
+    def ancestors(self) -> "Generator[Instance, None, None]":
         """Returns a generator that goes through the instance parents iteratively.
 
         Yields:
-            Generator[Self, None, None]: The generator.
+            Generator[Instance, None, None]: The generator.
         """
-        parent: Self | None = self.parent
-        while parent is not None:
-            yield parent
-            parent = parent.parent
+        parents = self.source.parents
+        parent = int(parents[self.index])
+        while parent >= 0:
+            yield Instance(self.source, parent)
+            parent = int(parents[parent])
 
-    def descendants(self) -> Generator[Self, None, None]:
+    def descendants(self) -> "Generator[Instance, None, None]":
         """Returns a generator that goes through the instance's descendants.
 
         Yields:
-            Generator[Self, None, None]: The generator.
+            Generator[Instance, None, None]: The generator.
         """
-        if not self.children:
-            return
-        stack: List[List[Self]] = []
-        stack.append(self.children)
-        while stack:
-            top = stack.pop()
-            for child in top:
-                yield child
-                if child.children:
-                    stack.append(child.children)
-
-    def everything(self) -> Generator[Self, None, None]:
+        source = self.source
+        for index in range(self.index + 1, self.index + self.subtree_size):
+            yield Instance(source, index)
+
+    def everything(self) -> "Generator[Instance, None, None]":
         """Returns a generator that goes through the instance recursively.
 
         Yields:
-            Generator[Self, None, None]: The generator.
+            Generator[Instance, None, None]: The generator.
         """
         yield self
         yield from self.descendants()
 
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, Instance):
+            return NotImplemented
+        return self.source is other.source and self.index == other.index
+
+    def __hash__(self) -> int:
+        return hash((id(self.source), self.index))
+
+    def __repr__(self) -> str:
+        return f"Instance(name={self.name!r}, class_name={self.class_name!r})"
+
 
-@dataclass
 class DataSource:
-    """Stores the entire parsed tree, and the origin of the tree.
+    """Stores the entire parsed tree as columns, and the origin of the tree.
+
+    Instances are stored in pre-order, row 0 being the root, so the subtree
+    of row `i` is rows `i` to `i + subtree_sizes[i]`. Children are stored in
+    CSR form: the children of row `i` are
+    `child_indices[child_offsets[i]:child_offsets[i + 1]]`.
     """
     source_path: Path
-    root: Instance
+    name_pool: StringPool
+    class_pool: StringPool
+    parents: np.ndarray
+    name_ids: np.ndarray
+    class_ids: np.ndarray
+    child_offsets: np.ndarray
+    child_indices: np.ndarray
+    child_counts: np.ndarray
+    sibling_indices: np.ndarray
+    depths: np.ndarray
+    subtree_sizes: np.ndarray
+
+    def __init__(self, source_path: Path, name_pool: StringPool,
+                 class_pool: StringPool, parents: np.ndarray,
+                 name_ids: np.ndarray, class_ids: np.ndarray) -> None:
+        self.source_path = source_path
+        self.name_pool = name_pool
+        self.class_pool = class_pool
+        self.parents = parents
+        self.name_ids = name_ids
+        self.class_ids = class_ids
+        self.__compute_structure()
+
+    def __compute_structure(self) -> None:
+        """Computes the children, depth and subtree size of every row."""
+        parents = self.parents
+        size = len(parents)
+        # Rows are in pre-order so a stable sort by parent keeps siblings in
+        # their original order.
+        child_parents = parents[1:]
+        self.child_counts = np.bincount(child_parents,
+                                        minlength=size).astype(np.int32)
+        self.child_offsets = np.zeros(size + 1, dtype=np.int64)
+        np.cumsum(self.child_counts, out=self.child_offsets[1:])
+        self.child_indices = (np.argsort(child_parents, kind="stable") +
+                              1).astype(np.int32)
+        self.sibling_indices = np.zeros(size, dtype=np.int32)
+        self.sibling_indices[self.child_indices] = (
+            np.arange(size - 1) -
+            self.child_offsets[parents[self.child_indices]])
+        # Walk up one level at a time, every row at once.
+        self.depths = np.zeros(size, dtype=np.int32)
+        rows = np.arange(1, size)
+        ancestors = child_parents.copy()
+        while len(rows):
+            self.depths[rows] += 1
+            has_parent = ancestors > 0
+            rows = rows[has_parent]
+            ancestors = parents[ancestors[has_parent]]
+        # Then fold subtree sizes into parents, deepest level first.
+        self.subtree_sizes = np.ones(size, dtype=np.int32)
+        by_depth = np.argsort(self.depths, kind="stable")
+        level_starts = np.searchsorted(self.depths[by_depth],
+                                       np.arange(self.depths.max() + 2))
+        for depth in range(len(level_starts) - 2, 0, -1):
+            level = by_depth[level_starts[depth]:level_starts[depth + 1]]
+            self.subtree_sizes += np.bincount(
+                parents[level],
+                weights=self.subtree_sizes[level],
+                minlength=size).astype(np.int32)
+
+    @property
+    def root(self) -> Instance:
+        """The root instance."""
+        return Instance(self, 0)
+
+    def child_indices_of(self, index: int) -> np.ndarray:
+        """Returns the rows of the children of a row.
+
+        Args:
+            index (int): The row.
+
+        Returns:
+            np.ndarray: The rows of the children.
+        """
+        offsets = self.child_offsets
+        return self.child_indices[offsets[index]:offsets[index + 1]]
+
+    def name_lengths(self) -> np.ndarray:
+        """Returns the name length of every instance."""
+        return self.name_pool.lengths()[self.name_ids]
+
+    def class_name_lengths(self) -> np.ndarray:
+        """Returns the class name length of every instance."""
+        return self.class_pool.lengths()[self.class_ids]
+
+    def same_names(self) -> np.ndarray:
+        """Returns whether each instance is named after its class."""
+        class_to_name = np.fromiter(
+            (-1 if index is None else index
+             for index in map(self.name_pool.find, self.class_pool)),
+            dtype=np.int64,
+            count=len(self.class_pool))
+        return class_to_name[self.class_ids] == self.name_ids
 
     def everything(self) -> Generator[Instance, None, None]:
-        """Calls root.everything()"""
+        """Goes through every instance in row order."""
         yield from self
 
+    def __len__(self) -> int:
+        return len(self.parents)
+
     def __iter__(self) -> Generator[Instance, None, None]:
-        yield from self.root.everything()
+        for index in range(len(self)):
+            yield Instance(self, index)
+
+
+class TreeBuilder:
+    """Builds the columns of a `DataSource` one instance at a time.
+
+    Instances must be added in pre-order, a parent before its children.
+    """
+    name_pool: StringPool
+    class_pool: StringPool
+    parents: array
+    name_ids: array
+    class_ids: array
+
+    def __init__(self, name_pool: StringPool, class_pool: StringPool) -> None:
+        self.name_pool = name_pool
+        self.class_pool = class_pool
+        self.parents = array("i")
+        self.name_ids = array("i")
+        self.class_ids = array("i")
+
+    def add(self, name: str, class_name: str, parent: int) -> int:
+        """Adds an instance.
+
+        Args:
+            name (str): The name of the instance.
+            class_name (str): The class name of the instance.
+            parent (int): The row of the parent, -1 for the root.
+
+        Returns:
+            int: The row of the new instance.
+        """
+        index = len(self.parents)
+        self.parents.append(parent)
+        self.name_ids.append(self.name_pool.intern(name))
+        self.class_ids.append(self.class_pool.intern(class_name))
+        return index
+
+    def add_events(self, events: Iterable[InstanceEvent]) -> None:
+        """Adds the instances described by a stream of reader events.
+
+        Args:
+            events (Iterable[InstanceEvent]): The events, see `stream.iter_events`.
+        """
+        stack: List[int] = []
+        for event, name, class_name in events:
+            if event is Event.START:
+                stack.append(
+                    self.add(name or "", class_name or "",
+                             stack[-1] if stack else -1))
+            elif event is Event.END:
+                stack.pop()
+            elif event is Event.NAME:
+                self.name_ids[stack[-1]] = self.name_pool.intern(name or "")
+            else:
+                self.class_ids[stack[-1]] = self.class_pool.intern(
+                    class_name or "")
+
+    def build(self, path: Path) -> DataSource:
+        """Creates the data source from the added instances.
+
+        Args:
+            path (Path): The origin of the tree.
+
+        Returns:
+            DataSource: The data source.
+        """
+        return DataSource(path, self.name_pool, self.class_pool,
+                          np.frombuffer(self.parents, dtype=np.int32),
+                          np.frombuffer(self.name_ids, dtype=np.int32),
+                          np.frombuffer(self.class_ids, dtype=np.int32))
+
+
+# (parents, name ids, class ids, names, class names), ids index the two lists.
+ParsedSource = Tuple[np.ndarray, np.ndarray, np.ndarray, List[str], List[str]]
+
+
+def parse_source(path: Path,
+                 cache: SnapshotCache | None = None,
+                 progress: Callable[[int], None] | None = None) -> ParsedSource:
+    """Parses a source using its own string pools.
+
+    This is what worker processes run, the result is plain arrays and two
+    short string lists so it is cheap to send back.
+
+    Args:
+        path (Path): The path of the source.
+        cache (SnapshotCache | None, optional):
+            Where to look for and store the parsed source.
+        progress (Callable[[int], None] | None, optional):
+            Called with the number of bytes read so far.
+
+    Raises:
+        ValueError: Failed to load source.
+
+    Returns:
+        ParsedSource: The parsed source.
+    """
+    if cache is not None:
+        cached = load_cached_source(path, cache)
+        if cached is not None:
+            return cached
+    builder = TreeBuilder(StringPool(), StringPool())
+    builder.add_events(read_events(path, progress))
+    if not builder.parents:
+        raise ValueError("Failed to load source.")
+    parsed = (np.frombuffer(builder.parents, dtype=np.int32),
+              np.frombuffer(builder.name_ids, dtype=np.int32),
+              np.frombuffer(builder.class_ids, dtype=np.int32),
+              list(builder.name_pool), list(builder.class_pool))
+    if cache is not None:
+        names, name_ends = pack_strings(parsed[3])
+        class_names, class_name_ends = pack_strings(parsed[4])
+        cache.save(
+            "source", (path, ), {
+                "parents": parsed[0],
+                "name_ids": parsed[1],
+                "class_ids": parsed[2],
+                "names": names,
+                "name_ends": name_ends,
+                "class_names": class_names,
+                "class_name_ends": class_name_ends
+            })
+    return parsed
+
+
+def load_cached_source(path: Path, cache: SnapshotCache) -> ParsedSource | None:
+    """Loads a parsed source from the cache.
+
+    Args:
+        path (Path): The path of the source.
+        cache (SnapshotCache): The cache.
+
+    Returns:
+        ParsedSource | None: The parsed source, None if it is not cached or
+            the file changed.
+    """
+    entry = cache.load("source", (path, ))
+    if entry is None:
+        return None
+    return (entry["parents"], entry["name_ids"], entry["class_ids"],
+            unpack_strings(entry["names"], entry["name_ends"]),
+            unpack_strings(entry["class_names"], entry["class_name_ends"]))
+
+
+@dataclass(frozen=True)
+class ColumnKey:
+    """Extracts a column of values from a data source.
+
+    If `labels` is set, the column holds ids into the returned string pool.
+    """
+    values: Callable[[DataSource], np.ndarray]
+    labels: Callable[[DataSource], StringPool] | None = None
+
+
+# In a worker process, where the bytes read of every source are reported.
+_worker_reads: Any = None
+
+
+def _init_worker(reads: Any) -> None:
+    """Runs when a worker process starts.
+
+    Args:
+        reads (multiprocessing.Queue): Receives (index, bytes read) pairs.
+    """
+    global _worker_reads  # pylint: disable=global-statement
+    _worker_reads = reads
+
+
+def _parse_in_worker(index: int, path: Path,
+                     cache: SnapshotCache | None) -> ParsedSource:
+    """Runs `parse_source` in a worker process, reporting the bytes read
+    with the index of the source."""
+    reads = _worker_reads
+    return parse_source(
+        path, cache, None if reads is None else
+        lambda read: reads.put((index, read)))
 
 
 class Database:
     """Stores a list of data sources and precomputed data."""
     __sources: List[DataSource]
+    __name_pool: StringPool
+    __class_pool: StringPool
+    __cache: SnapshotCache | None
+    __generation: int
 
-    def __init__(self) -> None:
+    def __init__(self, cache: SnapshotCache | None = None) -> None:
         self.__sources = []
+        self.__name_pool = StringPool()
+        self.__class_pool = StringPool()
+        self.__cache = cache
+        self.__generation = 0
 
     @property
     def sources(self) -> List[DataSource]:
         """The sources."""
         return self.__sources
 
-    def add_source(self, path: Path) -> None:
+    @property
+    def cache(self) -> SnapshotCache | None:
+        """The cache of parsed data, if any."""
+        return self.__cache
+
+    @property
+    def name_pool(self) -> StringPool:
+        """The names shared by every source."""
+        return self.__name_pool
+
+    @property
+    def class_pool(self) -> StringPool:
+        """The class names shared by every source."""
+        return self.__class_pool
+
+    @property
+    def generation(self) -> int:
+        """Increases every time a source is added or reloaded."""
+        return self.__generation
+
+    def add_source(self,
+                   path: Path,
+                   progress: Callable[[int], None] | None = None) -> None:
         """Add a source.
 
+        The file is read incrementally, so the raw JSON tree is never fully
+        held in memory. If the database has a cache, an unchanged file is not
+        parsed at all.
+
         Args:
             path (Path): The path of the source.
+            progress (Callable[[int], None] | None, optional):
+                Called with the number of bytes read so far.
 
         Raises:
             ValueError: Path doesn't exist.
@@ -112,29 +531,108 @@ class Database:
         """
         if not path.exists():
             raise ValueError("Path doesn't exist.")
-        data: RawInstance | None = None
-        with open(path, encoding="UTF-8") as file:
-            data = load_json(file)
-        if data is None:
-            raise ValueError("Failed to load source.")
-        root: Instance | None = None
-        stack: List[Tuple[RawInstance, Instance | None]] = [(data, None)]
-        while stack:
-            raw, parent = stack.pop()
-            children = cast(List[RawInstance], raw.get("children"))
-            new_child = Instance(name=raw.get("name") or "",
-                                 class_name=raw.get("class") or "",
-                                 parent=parent,
-                                 children=[] if children else None)
-            if parent is None:
-                root = new_child
-            else:
-                cast(List[Instance], parent.children).append(new_child)
-            if children is None:
-                continue
-            for child in children:
-                stack.append((child, new_child))
-        self.__sources.append(DataSource(path, cast(Instance, root)))
+        self.__merge(path, parse_source(path, self.__cache, progress))
+
+    def add_sources(self,
+                    paths: Iterable[Path],
+                    workers: int | None = None,
+                    progress: Callable[[int], None] | None = None) -> None:
+        """Add several sources, parsing them in worker processes.
+
+        Sources are added in the order of `paths`.
+
+        Args:
+            paths (Iterable[Path]): The paths of the sources.
+            workers (int | None, optional):
+                The number of processes, defaults to the number of CPUs.
+            progress (Callable[[int], None] | None, optional):
+                Called with the number of bytes loaded so far.
+
+        Raises:
+            ValueError: Path doesn't exist.
+            ValueError: Failed to load source.
+        """
+        paths = list(paths)
+        for path in paths:
+            if not path.exists():
+                raise ValueError("Path doesn't exist.")
+        sizes = [path.stat().st_size for path in paths]
+        results: List[ParsedSource | None] = [None] * len(paths)
+        loaded = 0
+        if self.__cache is not None:
+            for index, path in enumerate(paths):
+                results[index] = load_cached_source(path, self.__cache)
+                if results[index] is not None:
+                    loaded += sizes[index]
+        missing = [
+            index for index, result in enumerate(results) if result is None
+        ]
+        workers = min(workers or os.cpu_count() or 1, len(missing))
+        if workers <= 1:
+            for index in missing:
+                results[index] = parse_source(
+                    paths[index], self.__cache, None if progress is None else
+                    lambda read, loaded=loaded: progress(loaded + read))
+                loaded += sizes[index]
+        else:
+            self.__parse_in_workers(paths, sizes, results, workers, progress)
+        for path, result in zip(paths, results):
+            self.__merge(path, cast(ParsedSource, result))
+
+    def __parse_in_workers(self, paths: List[Path], sizes: List[int],
+                           results: List[ParsedSource | None], workers: int,
+                           progress: Callable[[int], None] | None) -> None:
+        """Fills the missing results using a process pool."""
+        loaded = sum(size for size, result in zip(sizes, results)
+                     if result is not None)
+        # Forking copies the Tk and task threads' locks in whatever state
+        # they are in, so the workers are started fresh instead. main.py
+        # only imports the UI when run, so a fresh worker starts quickly.
+        context = multiprocessing.get_context("spawn")
+        reads = context.Queue()
+        reading: Dict[int, int] = {}
+        with ProcessPoolExecutor(workers,
+                                 mp_context=context,
+                                 initializer=_init_worker,
+                                 initargs=(reads, )) as executor:
+            futures = {
+                executor.submit(_parse_in_worker, index, path, self.__cache):
+                index
+                for index, path in enumerate(paths) if results[index] is None
+            }
+            pending = set(futures)
+            while pending:
+                finished, pending = wait(pending,
+                                         timeout=0.05,
+                                         return_when=FIRST_COMPLETED)
+                while True:
+                    try:
+                        index, read = reads.get_nowait()
+                    except Empty:
+                        break
+                    if results[index] is None:
+                        reading[index] = read
+                for future in finished:
+                    index = futures[future]
+                    results[index] = future.result()
+                    reading.pop(index, None)
+                    loaded += sizes[index]
+                if progress is not None:
+                    progress(loaded + sum(reading.values()))
+
+    def __merge(self, path: Path, parsed: ParsedSource) -> None:
+        """Adds a source parsed with its own string pools."""
+        parents, name_ids, class_ids, names, class_names = parsed
+        name_map = np.fromiter(map(self.__name_pool.intern, names),
+                               dtype=np.int32,
+                               count=len(names))
+        class_map = np.fromiter(map(self.__class_pool.intern, class_names),
+                                dtype=np.int32,
+                                count=len(class_names))
+        self.__sources.append(
+            DataSource(path, self.__name_pool, self.__class_pool, parents,
+                       name_map[name_ids], class_map[class_ids]))
+        self.__generation += 1
 
     def __iter__(self) -> Generator[DataSource, None, None]:
         yield from self.__sources
@@ -157,9 +655,15 @@ class CompiledData:
     stdev: float | int
     mean: float | int
     frequency: Counter
-    num_data: List[int | float]
+    num_data: np.ndarray
+    # Set instead of num_data when compiled with an accuracy.
+    sketch: QuantileSketch | None
 
     def __init__(self):
+        self.clear()
+
+    def clear(self) -> None:
+        """Resets every field."""
         self.range = 0
         self.first_quadrant = 0
         self.median = 0
@@ -167,29 +671,220 @@ class CompiledData:
         self.stdev = 0
         self.mean = 0
         self.frequency = Counter()
-        self.num_data = []
-
-    def compile(self, data_sources: Iterable[DataSource],
-                 key: Callable[[Instance], Any],
-                 test: Callable[[Instance], bool]) -> None:
-        """Compiles the data."""
-        data: List[Any] = list(
-            map(
-                key,
-                filter(
-                    test,
-                    chain(*map(lambda source: source.everything(),
-                               data_sources)))))
-        self.frequency = Counter(data)
-        if not data:
+        self.num_data = np.zeros(0)
+        self.sketch = None
+
+    def compile(self,
+                data_sources: Iterable[DataSource],
+                key: ColumnKey,
+                mask: Callable[[DataSource], np.ndarray] | None = None,
+                progress: Callable[[float], None] | None = None,
+                accuracy: float | None = None) -> None:
+        """Compiles the data.
+
+        Numeric keys are summarised directly. For keys with labels the
+        statistics are over how often each label occurs.
+
+        Args:
+            data_sources (Iterable[DataSource]): The sources.
+            key (ColumnKey): The column to compile.
+            mask (Callable[[DataSource], np.ndarray] | None, optional):
+                Returns which instances of a source to include.
+            progress (Callable[[float], None] | None, optional):
+                Called with the fraction of sources read so far.
+            accuracy (float | None, optional): If given, the quartiles are
+                approximated by a `QuantileSketch` with this rank error,
+                which is merged source by source instead of keeping every
+                value in `num_data`.
+        """
+        self.clear()
+        data_sources = list(data_sources)
+        columns: List[np.ndarray] = []
+        pools: List[StringPool] = []
+        for index, source in enumerate(data_sources):
+            if progress is not None:
+                progress(index / len(data_sources))
+            values = key.values(source)
+            if mask is not None:
+                values = values[mask(source)]
+            if key.labels is not None:
+                columns.append(values)
+                pools.append(key.labels(source))
+            elif accuracy is not None:
+                self.frequency.update(count_values(values))
+                if self.sketch is None:
+                    self.sketch = QuantileSketch.with_accuracy(accuracy)
+                source_sketch = QuantileSketch.with_accuracy(accuracy)
+                source_sketch.update(values)
+                self.sketch.merge(source_sketch)
+            else:
+                columns.append(values)
+        if key.labels is None and accuracy is not None:
+            self.__summarize_sketch()
+            return
+        if key.labels is None:
+            data = np.concatenate(columns) if columns else np.zeros(0)
+            self.frequency = count_values(data)
+        else:
+            self.frequency = count_labels(columns, pools)
+            data = np.fromiter(self.frequency.values(),
+                               dtype=np.int64,
+                               count=len(self.frequency))
+        if len(data) == 0:
+            return
+        if accuracy is not None:
+            self.sketch = QuantileSketch.with_accuracy(accuracy)
+            self.sketch.update(data)
+            self.__summarize_sketch()
             return
-        if not isinstance(data[0], int | float):
-            data = cast(List[Any], self.frequency.values())
         self.num_data = data
-        self.mean = mean(data)
-        self.stdev = stdev(data) if len(data) >= 2 else float('nan')
-        self.range = Range(low=min(data), high=max(data))
+        self.mean = float(data.mean())
+        self.stdev = float(
+            data.std(ddof=1)) if len(data) >= 2 else float('nan')
+        self.range = Range(low=data.min().item(), high=data.max().item())
         if len(data) > 2:
-            quatiles: List[float] = quantiles(data)
-            # pylint: disable=unbalanced-tuple-unpacking
-            self.first_quadrant, self.median, self.third_quadrant = quatiles
+            # Weibull is the (n + 1) method used by statistics.quantiles.
+            self.first_quadrant, self.median, self.third_quadrant = (
+                np.percentile(data, (25, 50, 75), method="weibull").tolist())
+
+    def __summarize_sketch(self) -> None:
+        """Sets the statistics from the sketch."""
+        sketch = self.sketch
+        if sketch is None or len(sketch) == 0:
+            return
+        self.mean = sketch.mean
+        self.stdev = sketch.stdev
+        self.range = Range(low=sketch.min, high=sketch.max)
+        if len(sketch) > 2:
+            self.first_quadrant, self.median, self.third_quadrant = (
+                sketch.quantiles((0.25, 0.5, 0.75)))
+
+    def nbytes(self) -> int:
+        """Estimates the memory held by the compiled data.
+
+        Returns:
+            int: The estimate in bytes.
+        """
+        sketch_bytes = 0 if self.sketch is None else self.sketch.nbytes()
+        return (self.num_data.nbytes + sketch_bytes +
+                sys.getsizeof(self.frequency) +
+                sum(map(sys.getsizeof, self.frequency)) +
+                sum(map(sys.getsizeof, self.frequency.values())))
+
+
+class CompiledDataCache:
+    """A least recently used cache of compiled data, bounded by memory.
+
+    Everything is dropped as soon as a source is added to the database, so a
+    query never returns data compiled from an older set of sources.
+    """
+    max_bytes: int
+    __database: Database
+    __generation: int
+    __entries: OrderedDict[Hashable, Tuple[CompiledData, int]]
+    __size: int
+
+    def __init__(self, database: Database, max_bytes: int = 256 << 20) -> None:
+        """Creates an empty cache.
+
+        Args:
+            database (Database): The database the data is compiled from.
+            max_bytes (int, optional): The memory bound. Defaults to 256 MiB.
+        """
+        self.max_bytes = max_bytes
+        self.__database = database
+        self.__generation = database.generation
+        self.__entries = OrderedDict()
+        self.__size = 0
+
+    def __validate(self) -> None:
+        """Drops every entry if the database has changed."""
+        if self.__generation != self.__database.generation:
+            self.clear()
+            self.__generation = self.__database.generation
+
+    def clear(self) -> None:
+        """Drops every entry."""
+        self.__entries.clear()
+        self.__size = 0
+
+    def get(self, query: Hashable) -> CompiledData | None:
+        """Looks up compiled data.
+
+        Args:
+            query (Hashable): What the data was compiled from.
+
+        Returns:
+            CompiledData | None: The data, None if it is not cached.
+        """
+        self.__validate()
+        entry = self.__entries.get(query)
+        if entry is None:
+            return None
+        self.__entries.move_to_end(query)
+        return entry[0]
+
+    def put(self, query: Hashable, compiled_data: CompiledData) -> None:
+        """Stores compiled data, evicting the least recently used entries
+        until the cache fits within its bound.
+
+        Args:
+            query (Hashable): The query.
+            compiled_data (CompiledData): The data.
+        """
+        self.__validate()
+        if query in self.__entries:
+            self.__size -= self.__entries.pop(query)[1]
+        size = compiled_data.nbytes()
+        if size > self.max_bytes:
+            return
+        self.__entries[query] = (compiled_data, size)
+        self.__size += size
+        while self.__size > self.max_bytes:
+            self.__size -= self.__entries.popitem(last=False)[1][1]
+
+    def __len__(self) -> int:
+        return len(self.__entries)
+
+
+def count_values(data: np.ndarray) -> Counter:
+    """Counts how often each value occurs.
+
+    Args:
+        data (np.ndarray): The values.
+
+    Returns:
+        Counter: The counts, in order of first occurrence.
+    """
+    values, first, counts = np.unique(data,
+                                      return_index=True,
+                                      return_counts=True)
+    order = np.argsort(first, kind="stable")
+    return Counter(dict(zip(values[order].tolist(), counts[order].tolist())))
+
+
+def count_labels(columns: Iterable[np.ndarray],
+                 pools: Iterable[StringPool]) -> Counter:
+    """Counts how often each label occurs in columns of string pool ids.
+
+    Args:
+        columns (Iterable[np.ndarray]): The ids.
+        pools (Iterable[StringPool]): The pool of each column.
+
+    Returns:
+        Counter: The counts keyed by label, in pool order.
+    """
+    totals: Dict[int, Tuple[StringPool, np.ndarray]] = {}
+    for ids, pool in zip(columns, pools):
+        counts = np.bincount(ids, minlength=len(pool))
+        if id(pool) in totals:
+            counts = counts + totals[id(pool)][1]
+        totals[id(pool)] = (pool, counts)
+    frequency: Counter = Counter()
+    for pool, counts in totals.values():
+        present = np.flatnonzero(counts)
+        frequency.update(
+            dict(
+                zip(map(pool.__getitem__, present.tolist()),
+                    counts[present].tolist())))
+    return frequency
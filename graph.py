@@ -1,26 +1,282 @@
 """This file implements helper methods for graphs."""
-from typing import Iterable, Callable, Iterator
+from typing import Callable, Dict, Iterable, List, Self, Tuple
+from dataclasses import dataclass, field
+import numpy as np
 import networkx as nwx
-from data import DataSource, Instance
+from scipy import sparse
+from data import DataSource
+from cache import pack_strings, unpack_strings
 
+# Maps every instance of a source to the integer key of its node. Keys are
+# shared by every source, usually they are ids in a database string pool.
+KeyFunction = Callable[[DataSource], np.ndarray]
 
-def make_edges(graph: nwx.DiGraph, sources: Iterable[DataSource],
-               edge_creation_strategy: Callable) -> None:
-    """Creates edges."""
-    stack: list[tuple[Instance, Iterator[Instance]]] = [
-        (source.root, iter(source.root.children or ())) for source in sources
+
+@dataclass
+class SparseGraph:
+    """A directed graph whose nodes are numbered from 0.
+
+    Edges are unique and sorted by tail, then by head. Nodes may belong to
+    groups, -1 is no group.
+    """
+    labels: List[str]
+    counts: np.ndarray
+    tails: np.ndarray
+    heads: np.ndarray
+    weights: np.ndarray | None = None
+    groups: np.ndarray | None = None
+    group_labels: List[str] = field(default_factory=list)
+
+    def __len__(self) -> int:
+        return len(self.labels)
+
+    def adjacency(self) -> sparse.csr_array:
+        """Returns the adjacency matrix.
+
+        Returns:
+            sparse.csr_array: The weight of every edge from row to column,
+                one if the edges have no weights.
+        """
+        weights = (np.ones(len(self.tails), dtype=np.float64)
+                   if self.weights is None else self.weights)
+        return sparse.csr_array((weights, (self.tails, self.heads)),
+                                shape=(len(self), len(self)))
+
+    def degrees(self) -> np.ndarray:
+        """Returns the number of edges of every node, in either direction.
+
+        Returns:
+            np.ndarray: The degrees.
+        """
+        return (np.bincount(self.tails, minlength=len(self)) +
+                np.bincount(self.heads, minlength=len(self)))
+
+    def to_arrays(self) -> Dict[str, np.ndarray]:
+        """Flattens the graph into arrays, for the snapshot cache.
+
+        Returns:
+            Dict[str, np.ndarray]: The arrays.
+        """
+        labels, label_ends = pack_strings(self.labels)
+        group_labels, group_label_ends = pack_strings(self.group_labels)
+        arrays = {
+            "labels": labels,
+            "label_ends": label_ends,
+            "counts": self.counts,
+            "tails": self.tails,
+            "heads": self.heads,
+            "group_labels": group_labels,
+            "group_label_ends": group_label_ends,
+        }
+        if self.weights is not None:
+            arrays["weights"] = self.weights
+        if self.groups is not None:
+            arrays["groups"] = self.groups
+        return arrays
+
+    @classmethod
+    def from_arrays(cls, arrays: Dict[str, np.ndarray]) -> Self:
+        """Reverses `to_arrays`.
+
+        Args:
+            arrays (Dict[str, np.ndarray]): The arrays.
+
+        Returns:
+            Self: The graph.
+        """
+        return cls(labels=unpack_strings(arrays["labels"],
+                                         arrays["label_ends"]),
+                   counts=arrays["counts"],
+                   tails=arrays["tails"],
+                   heads=arrays["heads"],
+                   weights=arrays.get("weights"),
+                   groups=arrays.get("groups"),
+                   group_labels=unpack_strings(arrays["group_labels"],
+                                               arrays["group_label_ends"]))
+
+    def to_networkx(self) -> nwx.DiGraph:
+        """Converts the graph to networkx, nodes are named by their labels.
+
+        Returns:
+            nwx.DiGraph: The graph.
+        """
+        graph = nwx.DiGraph()
+        graph.add_nodes_from(self.labels)
+        labels = np.array(self.labels, dtype=object)
+        graph.add_edges_from(
+            zip(labels[self.tails].tolist(), labels[self.heads].tolist()))
+        return graph
+
+
+def build_graph(sources: Iterable[DataSource],
+                edges: Iterable[Tuple[KeyFunction, KeyFunction]],
+                label: Callable[[int], str],
+                group: KeyFunction | None = None,
+                group_label: Callable[[int], str] | None = None) -> SparseGraph:
+    """Builds a graph with an edge from the node of every parent to the node
+    of each of its children.
+
+    Every instance is a node, instances with the same key share one.
+
+    Args:
+        sources (Iterable[DataSource]): The sources.
+        edges (Iterable[Tuple[KeyFunction, KeyFunction]]):
+            For every kind of edge, the key of the parent and of the child.
+        label (Callable[[int], str]): Returns the label of a key.
+        group (KeyFunction | None, optional): The group key of every
+            instance, a node is in the group most of its instances are in.
+        group_label (Callable[[int], str] | None, optional): Returns the
+            label of a group key, the key itself if not given.
+
+    Returns:
+        SparseGraph: The graph.
+    """
+    edges = list(edges)
+    node_keys: List[np.ndarray] = []
+    head_keys: List[np.ndarray] = []
+    head_groups: List[np.ndarray] = []
+    edge_tails: List[np.ndarray] = []
+    edge_heads: List[np.ndarray] = []
+    for source in sources:
+        child_rows = np.flatnonzero(source.parents >= 0)
+        parent_rows = source.parents[child_rows]
+        groups = None if group is None else group(source).astype(np.int64)
+        for tail_key, head_key in edges:
+            tails = tail_key(source).astype(np.int64)
+            heads = head_key(source).astype(np.int64)
+            node_keys += [tails, heads]
+            head_keys.append(heads)
+            if groups is not None:
+                head_groups.append(groups)
+            edge_tails.append(tails[parent_rows])
+            edge_heads.append(heads[child_rows])
+    if not node_keys:
+        empty = np.zeros(0, dtype=np.int64)
+        return SparseGraph([], empty, empty, empty)
+    nodes = np.unique(np.concatenate(node_keys))
+    size = len(nodes)
+    codes = np.unique(
+        np.searchsorted(nodes, np.concatenate(edge_tails)) * size +
+        np.searchsorted(nodes, np.concatenate(edge_heads)))
+    head_nodes = np.searchsorted(nodes, np.concatenate(head_keys))
+    counts = np.bincount(head_nodes, minlength=size)
+    graph = SparseGraph(labels=[label(key) for key in nodes.tolist()],
+                        counts=counts,
+                        tails=codes // size,
+                        heads=codes % size)
+    if group is None:
+        return graph
+    group_keys, group_ids = np.unique(np.concatenate(head_groups),
+                                      return_inverse=True)
+    pairs, pair_counts = np.unique(head_nodes * len(group_keys) + group_ids,
+                                   return_counts=True)
+    pair_nodes = pairs // len(group_keys)
+    # The most common group of every node, ties go to the smaller key.
+    order = np.lexsort((-pair_counts, pair_nodes))
+    first = order[np.r_[True, np.diff(pair_nodes[order]) != 0]]
+    graph.groups = np.full(size, -1, dtype=np.int64)
+    graph.groups[pair_nodes[first]] = pairs[first] % len(group_keys)
+    group_label = group_label or str
+    graph.group_labels = [group_label(key) for key in group_keys.tolist()]
+    return graph
+
+
+@dataclass
+class Detail:
+    """A graph reduced for drawing."""
+    graph: SparseGraph
+    positions: np.ndarray
+    # Whether every node stands for a group of collapsed nodes.
+    collapsed: np.ndarray
+
+
+def level_of_detail(graph: SparseGraph,
+                    positions: np.ndarray,
+                    rank: np.ndarray,
+                    limit: int = 500,
+                    group_limit: int = 100,
+                    edge_limit: int = 20000,
+                    view: Tuple[float, float, float, float] | None = None
+                    ) -> Detail:
+    """Keeps the highest ranked nodes of a graph and collapses the others
+    into a node per group, so the result has a bounded size.
+
+    Args:
+        graph (SparseGraph): The graph.
+        positions (np.ndarray): The position of every node.
+        rank (np.ndarray): The rank of every node, higher is kept first.
+        limit (int, optional): The most nodes to keep.
+        group_limit (int, optional): The most collapsed nodes, the smallest
+            groups share one.
+        edge_limit (int, optional): The most edges, the heaviest are kept.
+        view (Tuple[float, float, float, float] | None, optional):
+            Only nodes within (left, right, bottom, top) are kept or
+            collapsed, so zooming in shows more nodes.
+
+    Returns:
+        Detail: The reduced graph, its edges are weighted by the number of
+            edges they stand for.
+    """
+    size = len(graph)
+    visible = np.ones(size, dtype=bool)
+    if view is not None:
+        left, right, bottom, top = view
+        visible = ((positions[:, 0] >= left) & (positions[:, 0] <= right) &
+                   (positions[:, 1] >= bottom) & (positions[:, 1] <= top))
+    candidates = np.flatnonzero(visible)
+    kept = candidates[np.argsort(-rank[candidates], kind="stable")[:limit]]
+    node_map = np.full(size, -1, dtype=np.int64)
+    node_map[kept] = np.arange(len(kept))
+    collapsed = np.flatnonzero(visible & (node_map < 0))
+    # Nodes without a group share the group after the last one.
+    groups = (np.zeros(size, dtype=np.int64)
+              if graph.groups is None else graph.groups.copy())
+    groups[groups < 0] = len(graph.group_labels)
+    group_keys, group_ids = np.unique(groups[collapsed], return_inverse=True)
+    group_counts = np.bincount(group_ids, graph.counts[collapsed])
+    if len(group_keys) > group_limit:
+        order = np.argsort(-group_counts, kind="stable")
+        position = np.empty_like(order)
+        position[order] = np.arange(len(order))
+        group_ids = np.minimum(position[group_ids], group_limit - 1)
+        group_keys = np.append(group_keys[order[:group_limit - 1]],
+                               len(graph.group_labels))
+    node_map[collapsed] = len(kept) + group_ids
+    total = len(kept) + len(group_keys)
+    labels = [graph.labels[node] for node in kept.tolist()]
+    labels += [
+        f"Other {graph.group_labels[key]}"
+        if key < len(graph.group_labels) else "Other"
+        for key in group_keys.tolist()
     ]
-    dup = set()
-    while stack:
-        cur = stack[-1]
-        child = next(cur[1], None)
-        if child is None:
-            stack.pop()
-            continue
-        u, v = edge_creation_strategy(cur[0], child)
-        dup_check = (u, v)
-        if dup_check not in dup:
-            dup.add(dup_check)
-            graph.add_edge(u, v)
-        if child.children:
-            stack.append((child, iter(child.children)))
+    mapped = np.flatnonzero(node_map >= 0)
+    counts = np.bincount(node_map[mapped],
+                         graph.counts[mapped],
+                         minlength=total)
+    # A collapsed node sits at the centre of its nodes, weighted by count.
+    weight = graph.counts[collapsed] + 1.0
+    sums = np.bincount(group_ids, weight, minlength=len(group_keys))
+    centres = np.column_stack([
+        np.bincount(group_ids,
+                    weight * positions[collapsed, axis],
+                    minlength=len(group_keys)) for axis in range(2)
+    ]) / np.maximum(sums, 1e-9)[:, np.newaxis]
+    tails, heads = node_map[graph.tails], node_map[graph.heads]
+    # Only loops made by collapsing an edge into one node are dropped, the
+    # loops of kept nodes are real edges.
+    keep = ((tails >= 0) & (heads >= 0) &
+            ((tails != heads) |
+             ((graph.tails == graph.heads) & (tails < len(kept)))))
+    codes, weights = np.unique(tails[keep] * total + heads[keep],
+                               return_counts=True)
+    if len(codes) > edge_limit:
+        heaviest = np.sort(
+            np.argsort(-weights, kind="stable")[:edge_limit])
+        codes, weights = codes[heaviest], weights[heaviest]
+    return Detail(graph=SparseGraph(labels=labels,
+                                    counts=counts,
+                                    tails=codes // total,
+                                    heads=codes % total,
+                                    weights=weights),
+                  positions=np.concatenate([positions[kept], centres]),
+                  collapsed=np.arange(total) >= len(kept))
@@ -0,0 +1,391 @@
+"""This file implements graph layouts that scale to large sparse graphs.
+
+Every layout takes a symmetric scipy.sparse adjacency matrix and returns an
+(n, 2) array of positions. The iterative layouts stop early once their time
+budget is spent and return the best positions so far.
+"""
+from typing import Callable, List
+from enum import Enum
+import time
+import numpy as np
+import networkx as nwx
+from scipy import sparse
+from scipy.sparse import csgraph
+from scipy.sparse import linalg
+
+# Called with the fraction of the layout done.
+Progress = Callable[[float], None]
+
+
+def _part(progress: Progress | None, start: float,
+          end: float) -> Progress | None:
+    """Maps the progress of one part of the work into its share."""
+    if progress is None:
+        return None
+    return lambda fraction: progress(start + (end - start) * fraction)
+
+
+class LayoutEngine(Enum):
+    """The available layouts."""
+    AUTOMATIC = "Automatic"
+    MULTILEVEL = "Multilevel"
+    FORCE = "Force-directed"
+    SPECTRAL = "Spectral"
+    KAMADA_KAWAI = "Kamada-Kawai"
+
+
+# Kamada-Kawai stores every pairwise distance, so it is only chosen
+# automatically for graphs this small.
+KAMADA_KAWAI_LIMIT = 1000
+
+
+def undirected(adjacency: sparse.sparray) -> sparse.csr_array:
+    """Makes an adjacency matrix symmetric, with no self loops or weights.
+
+    Args:
+        adjacency (sparse.sparray): The adjacency matrix.
+
+    Returns:
+        sparse.csr_array: The undirected adjacency matrix.
+    """
+    matrix = sparse.csr_array(adjacency, dtype=np.float64)
+    matrix = (matrix + matrix.T).tocoo()
+    keep = matrix.row != matrix.col
+    return sparse.csr_array(
+        (np.ones(np.count_nonzero(keep)),
+         (matrix.row[keep], matrix.col[keep])),
+        shape=matrix.shape)
+
+
+def spectral_layout(adjacency: sparse.csr_array, seed: int = 0) -> np.ndarray:
+    """Places nodes by the two leading nontrivial eigenvectors of the
+    normalized adjacency matrix, found with a sparse eigensolver.
+
+    Args:
+        adjacency (sparse.csr_array): A connected undirected graph.
+        seed (int, optional): Seeds the eigensolver's start vector.
+
+    Returns:
+        np.ndarray: The positions.
+    """
+    size = adjacency.shape[0]
+    if size <= 2:
+        return np.column_stack([np.arange(size, dtype=np.float64),
+                                np.zeros(size)])
+    degrees = np.asarray(adjacency.sum(axis=1)).ravel()
+    scale = 1 / np.sqrt(np.maximum(degrees, 1))
+    # Shifting by the identity makes every eigenvalue nonnegative, so the
+    # wanted ones are the largest, which Lanczos finds quickly.
+    normalized = sparse.diags_array(scale) @ adjacency @ sparse.diags_array(
+        scale) + sparse.eye_array(size)
+    if size < 100:
+        _, vectors = np.linalg.eigh(normalized.toarray())
+        vectors = vectors[:, ::-1]
+    else:
+        start = np.random.default_rng(seed).random(size)
+        # A layout needs little precision, and the eigenvalues of trees are
+        # so close together that a tight tolerance takes very long.
+        try:
+            values, vectors = linalg.eigsh(normalized,
+                                           k=3,
+                                           which="LA",
+                                           v0=start,
+                                           tol=1e-2,
+                                           maxiter=size * 10)
+        except linalg.ArpackNoConvergence as error:
+            values, vectors = error.eigenvalues, error.eigenvectors
+            if vectors.shape[1] < 3:
+                return np.random.default_rng(seed).random((size, 2))
+        vectors = vectors[:, np.argsort(-values)]
+    # The largest eigenvector is known, remove what is left of it in the
+    # loosely converged others.
+    trivial = np.sqrt(np.maximum(degrees, 1))
+    trivial /= np.linalg.norm(trivial)
+    vectors = vectors[:, 1:3]
+    vectors = vectors - np.outer(trivial, trivial @ vectors)
+    return vectors * scale[:, np.newaxis]
+
+
+def _repulsion(positions: np.ndarray, k: float, grid: int) -> np.ndarray:
+    """Approximates the repulsion between every pair of nodes by putting
+    nodes in grid cells and pushing every node away from the centre of mass
+    of every cell."""
+    low = positions.min(axis=0)
+    extent = np.maximum(positions.max(axis=0) - low, 1e-9)
+    cells = np.minimum((positions - low) / extent * grid,
+                       grid - 1).astype(np.int64)
+    cell = cells[:, 0] * grid + cells[:, 1]
+    mass = np.bincount(cell, minlength=grid * grid).astype(np.float64)
+    sums = np.column_stack([
+        np.bincount(cell, positions[:, axis], minlength=grid * grid)
+        for axis in range(2)
+    ])
+    occupied = np.flatnonzero(mass)
+    mass, sums = mass[occupied], sums[occupied]
+    centres = sums / mass[:, np.newaxis]
+    own = np.searchsorted(occupied, cell)
+    minimum = (k * 0.01)**2
+    # Every node is pushed by its own cell without itself in it.
+    own_mass = mass[own] - 1
+    delta = positions - (sums[own] - positions) / np.maximum(own_mass,
+                                                            1)[:, np.newaxis]
+    distance = np.maximum((delta**2).sum(axis=1), minimum)
+    force = delta * (own_mass * k * k / distance)[:, np.newaxis]
+    for start in range(0, len(positions), 4096):
+        rows = slice(start, start + 4096)
+        delta = positions[rows, np.newaxis, :] - centres[np.newaxis, :, :]
+        weight = mass * k * k / np.maximum((delta**2).sum(axis=2), minimum)
+        weight[np.arange(len(weight)), own[rows]] = 0
+        force[rows] += (delta * weight[:, :, np.newaxis]).sum(axis=1)
+    return force
+
+
+def force_layout(adjacency: sparse.csr_array,
+                 positions: np.ndarray | None = None,
+                 iterations: int = 100,
+                 temperature: float = 0.1,
+                 budget: float | None = None,
+                 progress: Progress | None = None,
+                 seed: int = 0,
+                 grid: int = 16) -> np.ndarray:
+    """Fruchterman-Reingold layout, with the repulsion approximated on a
+    grid so an iteration is linear in the number of nodes and edges.
+
+    Args:
+        adjacency (sparse.csr_array): An undirected graph.
+        positions (np.ndarray | None, optional): Where to start, random
+            positions if not given.
+        iterations (int, optional): The number of iterations.
+        temperature (float, optional): The largest first move, relative to
+            the size of the layout.
+        budget (float | None, optional): Seconds after which to stop.
+        progress (Progress | None, optional): Reports the fraction of the
+            iterations or of the budget done, whichever is larger.
+        seed (int, optional): Seeds the random start.
+        grid (int, optional): The number of grid cells along each axis.
+
+    Returns:
+        np.ndarray: The positions.
+    """
+    deadline = None if budget is None else time.perf_counter() + budget
+    size = adjacency.shape[0]
+    if positions is None:
+        positions = np.random.default_rng(seed).random((size, 2))
+    positions = positions.astype(np.float64)
+    if size <= 1:
+        return positions
+    edges = sparse.triu(adjacency, k=1).tocoo()
+    tails, heads = edges.row, edges.col
+    extent = max(float(np.ptp(positions, axis=0).max()), 1e-9)
+    k = extent / np.sqrt(size)
+    took = 0.0
+    for iteration in range(iterations):
+        start = time.perf_counter()
+        # Stop before an iteration that would run past the deadline.
+        if deadline is not None and start + took > deadline:
+            break
+        move = _repulsion(positions, k, grid)
+        delta = positions[tails] - positions[heads]
+        distance = np.maximum(np.sqrt((delta**2).sum(axis=1)), 1e-9)
+        pull = delta * (distance / k)[:, np.newaxis]
+        for axis in range(2):
+            move[:, axis] -= np.bincount(tails, pull[:, axis], minlength=size)
+            move[:, axis] += np.bincount(heads, pull[:, axis], minlength=size)
+        step = temperature * extent * (1 - iteration / iterations)
+        length = np.maximum(np.sqrt((move**2).sum(axis=1)), 1e-9)
+        positions += move * (np.minimum(length, step) / length)[:, np.newaxis]
+        took = time.perf_counter() - start
+        if progress is not None:
+            done = (iteration + 1) / iterations
+            if deadline is not None and budget:
+                done = max(done,
+                           1 - (deadline - time.perf_counter()) / budget)
+            progress(min(done, 1.0))
+    return positions
+
+
+def _coarsen(adjacency: sparse.csr_array,
+             rng: np.random.Generator) -> np.ndarray:
+    """Groups every node with a neighbour. Nodes whose neighbours are all
+    taken join the group of one of them, so stars collapse at once.
+
+    Returns:
+        np.ndarray: The group of every node.
+    """
+    size = adjacency.shape[0]
+    indptr, indices = adjacency.indptr, adjacency.indices
+    group = np.full(size, -1, dtype=np.int64)
+    groups = 0
+    for node in rng.permutation(size).tolist():
+        if group[node] >= 0:
+            continue
+        neighbours = indices[indptr[node]:indptr[node + 1]]
+        free = neighbours[group[neighbours] < 0]
+        if len(free) == 0:
+            continue
+        group[node] = group[free[0]] = groups
+        groups += 1
+    for node in np.flatnonzero(group < 0).tolist():
+        neighbours = indices[indptr[node]:indptr[node + 1]]
+        if len(neighbours) and group[neighbours[0]] >= 0:
+            group[node] = group[neighbours[0]]
+        else:
+            group[node] = groups
+            groups += 1
+    return group
+
+
+def multilevel_layout(adjacency: sparse.csr_array,
+                      budget: float | None = None,
+                      progress: Progress | None = None,
+                      seed: int = 0,
+                      coarsest: int = 500) -> np.ndarray:
+    """Coarsens the graph until it is small, lays the coarsest graph out
+    and refines the layout back up one level at a time.
+
+    Args:
+        adjacency (sparse.csr_array): An undirected graph.
+        budget (float | None, optional): Seconds for the whole layout.
+        progress (Progress | None, optional): Reports the fraction done.
+        seed (int, optional): Seeds the random choices.
+        coarsest (int, optional): Stop coarsening at this many nodes.
+
+    Returns:
+        np.ndarray: The positions.
+    """
+    start = time.perf_counter()
+    rng = np.random.default_rng(seed)
+    levels = [adjacency]
+    groups: List[np.ndarray] = []
+    while levels[-1].shape[0] > coarsest:
+        group = _coarsen(levels[-1], rng)
+        count = int(group.max()) + 1
+        if count > 0.9 * levels[-1].shape[0]:
+            break
+        projection = sparse.csr_array(
+            (np.ones(len(group)), (np.arange(len(group)), group)),
+            shape=(len(group), count))
+        levels.append(undirected(projection.T @ levels[-1] @ projection))
+        groups.append(group)
+
+    # An iteration takes time linear in the nodes and edges, so each level
+    # gets a share of the budget and of the progress in proportion.
+    costs = np.array([matrix.shape[0] + matrix.nnz for matrix in levels],
+                     dtype=np.float64)
+    before = np.concatenate([[0], np.cumsum(costs)])
+
+    def remaining(level: int) -> float | None:
+        if budget is None:
+            return None
+        left = max(budget - (time.perf_counter() - start), 0)
+        return left * costs[level] / before[level + 1]
+
+    def share(level: int) -> Progress | None:
+        total = before[-1]
+        return _part(progress, 1 - before[level + 1] / total,
+                     1 - before[level] / total)
+
+    level = len(levels) - 1
+    positions = force_layout(levels[-1],
+                             spectral_layout(levels[-1], seed),
+                             budget=remaining(level),
+                             progress=share(level),
+                             seed=seed)
+    for level in range(len(levels) - 2, -1, -1):
+        positions = positions[groups[level]]
+        extent = max(float(np.ptp(positions, axis=0).max()), 1e-9)
+        # Nodes of one group start close together, then spread out.
+        positions = positions + rng.normal(
+            scale=extent / np.sqrt(len(positions)), size=positions.shape)
+        positions = force_layout(levels[level],
+                                 positions,
+                                 iterations=30,
+                                 temperature=0.02,
+                                 budget=remaining(level),
+                                 progress=share(level),
+                                 seed=seed)
+    return positions
+
+
+def _layout_component(engine: LayoutEngine, adjacency: sparse.csr_array,
+                      budget: float | None, progress: Progress | None,
+                      seed: int) -> np.ndarray:
+    """Lays out a connected graph."""
+    size = adjacency.shape[0]
+    if size <= 2:
+        return spectral_layout(adjacency, seed)
+    if engine == LayoutEngine.AUTOMATIC:
+        engine = (LayoutEngine.KAMADA_KAWAI
+                  if size <= KAMADA_KAWAI_LIMIT else LayoutEngine.MULTILEVEL)
+    if engine == LayoutEngine.SPECTRAL:
+        return spectral_layout(adjacency, seed)
+    if engine == LayoutEngine.FORCE:
+        return force_layout(adjacency,
+                            spectral_layout(adjacency, seed),
+                            budget=budget,
+                            progress=progress,
+                            seed=seed)
+    if engine == LayoutEngine.MULTILEVEL:
+        return multilevel_layout(adjacency, budget, progress, seed=seed)
+    layout = nwx.kamada_kawai_layout(nwx.from_scipy_sparse_array(adjacency))
+    return np.array([layout[node] for node in range(size)])
+
+
+def compute_layout(engine: LayoutEngine,
+                   adjacency: sparse.sparray,
+                   budget: float | None = 10.0,
+                   progress: Progress | None = None,
+                   scale: float = 2.0,
+                   seed: int = 0) -> np.ndarray:
+    """Lays a graph out. Connected components are laid out on their own and
+    packed into rows, largest first.
+
+    Args:
+        engine (LayoutEngine): The layout to use.
+        adjacency (sparse.sparray): The adjacency matrix, the direction of
+            edges is ignored.
+        budget (float | None, optional): Seconds for the whole layout,
+            shared by the components by their size.
+        progress (Progress | None, optional): Reports the fraction done.
+        scale (float, optional): Positions are within [-scale, scale].
+        seed (int, optional): Seeds the random choices.
+
+    Returns:
+        np.ndarray: The positions.
+    """
+    adjacency = undirected(adjacency)
+    size = adjacency.shape[0]
+    positions = np.zeros((size, 2))
+    if size == 0:
+        return positions
+    count, labels = csgraph.connected_components(adjacency, directed=False)
+    sizes = np.bincount(labels, minlength=count)
+    order = np.argsort(-sizes, kind="stable")
+    members = np.argsort(labels, kind="stable")
+    starts = np.concatenate([[0], np.cumsum(sizes)])
+    done = 0
+    row_width = np.sqrt(sizes[order[0]])
+    x = y = row_height = 0.0
+    for component in order.tolist():
+        nodes = members[starts[component]:starts[component + 1]]
+        sub = adjacency[nodes][:, nodes]
+        component_budget = None if budget is None else budget * len(
+            nodes) / size
+        local = _layout_component(
+            engine, sub, component_budget,
+            _part(progress, done / size, (done + len(nodes)) / size), seed)
+        # Components get room in proportion to the square root of their size.
+        local = local - local.min(axis=0)
+        extent = max(float(local.max()), 1e-9)
+        width = np.sqrt(len(nodes))
+        if x > 0 and x + width > row_width:
+            x, y, row_height = 0.0, y + row_height, 0.0
+        positions[nodes] = local / extent * width * 0.9 + (x, y)
+        x += width
+        row_height = max(row_height, width)
+        done += len(nodes)
+        if progress is not None:
+            progress(done / size)
+    positions -= (positions.max(axis=0) + positions.min(axis=0)) / 2
+    extent = max(float(np.abs(positions).max()), 1e-9)
+    return positions / extent * scale
@@ -15,8 +15,9 @@ GNU General Public License for more details.
 You should have received a copy of the GNU General Public License
 along with this program.  If not, see <https://www.gnu.org/licenses/>.
 """
-from ui import MainForm
 
 if __name__ == "__main__":
+    # Dataset workers import this file again, they do not need the UI.
+    from ui import MainForm  # pylint: disable=import-outside-toplevel
     form = MainForm()
     form.show()
@@ -1,33 +1,293 @@
 """The implementation."""
-import json
-from typing import Self, Iterator
+import gc
+import os
+from typing import TYPE_CHECKING, Hashable, Self, Iterable, Sequence, cast
 from pathlib import Path
 from dataclasses import dataclass
-from functools import cache
-from tkinter.ttk import Treeview
+from functools import lru_cache
+import numpy as np
 from rapidfuzz import fuzz, process
-from data import Database, Instance
+from data import Database, StringPool
+from cache import pack_strings, unpack_strings
 
+if TYPE_CHECKING:
+    from tkinter.ttk import Treeview
 
-@dataclass
+# The version of the files written by `save_model`.
+MODEL_VERSION = 1
+
+
+@dataclass(slots=True)
 class Vertex:
-    """The vertex."""
+    """The vertex of the merged tree.
+
+    Children with the same name and class name are merged into one vertex,
+    which counts how many instances it stands for. They are kept by name,
+    then by class name, most common first once sorted.
+    """
     name: str
     classname: str
-    children: list[Self] | None
+    children: dict[str, dict[str, Self]] | None = None
+    count: int = 1
+
+    def add_child(self, name: str, classname: str, count: int = 1) -> Self:
+        """Adds instances as a child, merging them into an existing child
+        with the same name and class name.
+
+        Args:
+            name (str): The name.
+            classname (str): The class name.
+            count (int, optional): How many instances are added.
+
+        Returns:
+            Self: The child.
+        """
+        if self.children is None:
+            self.children = {}
+        named = self.children.get(name)
+        if named is None:
+            named = self.children[name] = {}
+        child = named.get(classname)
+        if child is None:
+            child = named[classname] = type(self)(name, classname, None, count)
+        else:
+            child.count += count
+        return child
+
+    def child_list(self) -> list[Self]:
+        """Returns every child."""
+        if self.children is None:
+            return []
+        return [
+            child for named in self.children.values()
+            for child in named.values()
+        ]
+
+    def merge_rows(self, names: Sequence[str], classnames: Sequence[str],
+                   parents: Sequence[int]) -> None:
+        """Merges a tree given as rows in pre-order, where row 0 stands for
+        this vertex and is not counted.
+
+        Args:
+            names (Sequence[str]): The name of every row.
+            classnames (Sequence[str]): The class name of every row.
+            parents (Sequence[int]): The parent row of every row.
+        """
+        vertices = [self]
+        for row in range(1, len(parents)):
+            vertices.append(vertices[parents[row]].add_child(
+                names[row], classnames[row]))
+
+    def sort(self) -> None:
+        """Orders the children of every vertex with the same name from the
+        most to the least common."""
+        stack: list[Vertex] = [self]
+        while stack:
+            vertex = stack.pop()
+            if vertex.children is None:
+                continue
+            for name, named in vertex.children.items():
+                if len(named) > 1:
+                    vertex.children[name] = dict(
+                        sorted(named.items(),
+                               key=lambda item: item[1].count,
+                               reverse=True))
+            stack.extend(vertex.child_list())
+
+
+class FuzzyIndex:
+    """Finds the string closest to a query by `fuzz.ratio`, giving the same
+    result as `process.extractOne` without scoring every string.
+
+    `fuzz.ratio` is 200 * LCS / (len(a) + len(b)), and the longest common
+    subsequence is at most the number of characters both strings share. The
+    strings are bucketed by length and each one keeps a count of its
+    characters, so the bound of a whole bucket is computed at once and only
+    strings that could beat the best score so far are scored.
+    """
+    __strings: np.ndarray
+    __alphabet: dict[str, int]
+    __common: np.ndarray
+    __table: np.ndarray
+    __buckets: list[tuple[int, np.ndarray, np.ndarray]]
+
+    def __init__(self, strings: Iterable[str], alphabet_size: int = 64) -> None:
+        """Builds the index.
+
+        Args:
+            strings (Iterable[str]): The strings.
+            alphabet_size (int, optional): How many of the most common
+                characters are counted separately, the rest share a count.
+        """
+        self.__strings = np.array(list(strings), dtype=object)
+        text = "".join(self.__strings.tolist())
+        codes = np.frombuffer(text.encode("UTF-32-LE", "surrogatepass"),
+                              dtype=np.uint32)
+        unique, counts = np.unique(codes, return_counts=True)
+        order = np.argsort(-counts, kind="stable")
+        common = unique[order[:alphabet_size - 1]]
+        # Characters outside of the alphabet all map to the last column.
+        lookup = np.full(len(unique), len(common), dtype=np.int64)
+        lookup[np.searchsorted(unique, common)] = np.arange(len(common))
+        columns = lookup[np.searchsorted(unique, codes)]
+        lengths = self.__lengths()
+        rows = np.repeat(np.arange(len(lengths)), lengths)
+        table = np.bincount(rows * alphabet_size + columns,
+                            minlength=len(lengths) * alphabet_size).reshape(
+                                len(lengths), alphabet_size)
+        # A count is never more than the length of its string.
+        self.__set_table(
+            common, table.astype(np.min_scalar_type(lengths.max(initial=0))))
+
+    @classmethod
+    def from_arrays(cls, strings: Iterable[str],
+                    arrays: dict[str, np.ndarray]) -> Self:
+        """Restores an index saved with `to_arrays`.
+
+        Args:
+            strings (Iterable[str]): The same strings the index was built
+                from, in the same order.
+            arrays (dict[str, np.ndarray]): The arrays.
+
+        Returns:
+            Self: The index.
+        """
+        index = cls.__new__(cls)
+        index.__strings = np.array(list(strings), dtype=object)
+        index.__set_table(arrays["alphabet"], arrays["counts"])
+        return index
+
+    def to_arrays(self) -> dict[str, np.ndarray]:
+        """Returns the character counts, so the index can be restored
+        without counting again.
+
+        Returns:
+            dict[str, np.ndarray]: The arrays.
+        """
+        return {"alphabet": self.__common, "counts": self.__table}
+
+    def __lengths(self) -> np.ndarray:
+        """Returns the length of every string."""
+        return np.fromiter(map(len, self.__strings),
+                           dtype=np.int64,
+                           count=len(self.__strings))
+
+    def __set_table(self, common: np.ndarray, table: np.ndarray) -> None:
+        """Buckets the character counts of every string by length."""
+        self.__common = common
+        self.__table = table
+        self.__alphabet = {
+            chr(code): index
+            for index, code in enumerate(common.tolist())
+        }
+        lengths = self.__lengths()
+        self.__buckets = []
+        for length in np.unique(lengths).tolist():
+            indices = np.flatnonzero(lengths == length)
+            self.__buckets.append((length, indices, table[indices]))
+
+    def __counts(self, string: str) -> np.ndarray:
+        """Counts the characters of a string per alphabet column."""
+        table = self.__buckets[0][2]
+        counts = np.zeros(table.shape[1], dtype=np.int64)
+        for char in string:
+            counts[self.__alphabet.get(char, len(counts) - 1)] += 1
+        # Keeps the comparison in the narrow type of the table.
+        return np.minimum(counts, np.iinfo(table.dtype).max).astype(
+            table.dtype)
+
+    def find(self, query: str) -> str | None:
+        """Finds the closest string.
+
+        Args:
+            query (str): The query.
+
+        Returns:
+            str | None: The closest string, the first one if several are
+                equally close. None if the index is empty.
+        """
+        if len(self.__strings) == 0:
+            return None
+        counts = self.__counts(query)
+        size = len(query)
+
+        def length_bound(length: int) -> float:
+            total = size + length
+            return 200 * min(size, length) / total if total else 100.0
+
+        buckets = sorted(self.__buckets,
+                         key=lambda bucket: length_bound(bucket[0]),
+                         reverse=True)
+        best_score = -1.0
+        best_index = len(self.__strings)
+        # Guards the bound against rounding in the scores.
+        epsilon = 1e-6
+        for length, indices, table in buckets:
+            if length_bound(length) + epsilon < best_score:
+                break
+            total = size + length
+            bounds = (200 * np.minimum(table, counts).sum(axis=1) /
+                      total if total else np.full(len(indices), 100.0))
+            candidates = indices[bounds + epsilon >= best_score]
+            if len(candidates) == 0:
+                continue
+            # Candidates are in index order, so ties go to the first one.
+            found = process.extractOne(
+                query, self.__strings[candidates].tolist(),
+                scorer=fuzz.ratio,
+                score_cutoff=max(best_score, 0))
+            if found is None:
+                continue
+            index = int(candidates[found[2]])
+            if found[1] > best_score or (found[1] == best_score
+                                         and index < best_index):
+                best_score, best_index = found[1], index
+        return self.__strings[best_index]
 
 
 class LTable:
     """The levenshtein distance table
     """
     __table: dict[str, str]
+    __index: FuzzyIndex | None
+
+    def __init__(self,
+                 input_table: dict[str, str],
+                 memo_size: int = 4096,
+                 index: FuzzyIndex | None = None) -> None:
+        """Creates the table.
 
-    def __init__(self, input_table: dict[str, str]) -> None:
+        Args:
+            input_table (dict[str, str]): The lowercase name to class name
+                table.
+            memo_size (int, optional): How many fuzzy lookups are remembered.
+            index (FuzzyIndex | None, optional): The index of the names in
+                the table, built on the first fuzzy lookup if not given.
+        """
         self.__table = input_table
+        self.__index = index
+        self.__find_closest = lru_cache(maxsize=memo_size)(
+            self.__find_closest)
+
+    @property
+    def table(self) -> dict[str, str]:
+        """The lowercase name to class name table."""
+        return self.__table
+
+    @property
+    def index(self) -> FuzzyIndex:
+        """The index of the names in the table."""
+        if self.__index is None:
+            self.__index = FuzzyIndex(self.__table.keys())
+        return self.__index
+
+    def __find_closest(self, name: str) -> str:
+        """Finds the class name of the closest name in the table."""
+        return self.__table[self.index.find(name)]
 
-    @cache
     def find(self, string: str) -> str:
-        """Find string. O(n)
+        """Find string. Names not in the table are matched to the closest
+        name through a `FuzzyIndex`.
 
         Args:
             string (str): The string to find.
@@ -39,172 +299,418 @@ class LTable:
         result = self.__table.get(name)
         if result is not None:
             return result
-        best_name = process.extractOne(name,
-                                       self.__table.keys(),
-                                       scorer=fuzz.ratio)[0]
-        return self.__table[best_name]
+        return self.__find_closest(name)
+
+    def find_many(self,
+                  strings: Iterable[str],
+                  chunk_bytes: int = 64 << 20) -> list[str]:
+        """Same as `find` for many strings at once.
+
+        Every distinct name that is not in the table is scored against every
+        key in bulk with `process.cdist`, using all cores.
+
+        Args:
+            strings (Iterable[str]): The strings to find.
+            chunk_bytes (int, optional): The memory used for scores at once.
+
+        Returns:
+            list[str]: The mapped strings, in the same order.
+        """
+        names = [string.lower() for string in strings]
+        missing = list(dict.fromkeys(
+            name for name in names if name not in self.__table))
+        closest: dict[str, str] = {}
+        keys = list(self.__table.keys())
+        rows = max(1, chunk_bytes // (8 * max(len(keys), 1)))
+        for start in range(0, len(missing), rows):
+            chunk = missing[start:start + rows]
+            # float64 scores, so ties are broken exactly like `find`.
+            scores = process.cdist(chunk,
+                                   keys,
+                                   scorer=fuzz.ratio,
+                                   dtype=np.float64,
+                                   workers=-1)
+            for name, best in zip(chunk, np.argmax(scores, axis=1).tolist()):
+                closest[name] = self.__table[keys[best]]
+        return [
+            self.__table[name] if name in self.__table else closest[name]
+            for name in names
+        ]
 
 
-def load_single_data(file_path: Path) -> dict:
-    """Load a single file as a dictionary.
+def initialize(db: Database) -> tuple[Vertex, LTable]:
+    """Merges every source into one tree and builds the table of the most
+    common class name of every name.
 
     Args:
-        file_path (Path): The path of the file to load
+        db (Database): The database.
 
     Returns:
-        dict: The file data.
+        tuple[Vertex, LTable]: The merged tree and the table.
     """
-    data = None
-    with open(file_path, 'r', encoding="UTF-8") as file:
-        data = json.load(file)
-    return data
-
-
-def to_graph(dictionary: dict) -> Vertex:
-    """Convert dictionary to graph."""
-    children = dictionary.get("children")
-    if children is None:
-        return Vertex(name=dictionary["name"],
-                      classname=dictionary["class"],
-                      children=None)
-    new_children: list[Vertex] = []
-    stack = [(new_children, children)]
-    while stack:
-        cur_children, data_children = stack.pop()
-        for child in data_children:
-            child_children = child.get("children")
-            new_child_children: list[
-                Vertex] | None = [] if child_children else None
-            if child_children:
-                new_child_children = []
-                stack.append((new_child_children, child_children))
-            cur_children.append(
-                Vertex(name=child.get("name"),
-                       classname=child.get("class"),
-                       children=new_child_children))
-    return Vertex(name=dictionary["name"],
-                  classname=dictionary["class"],
-                  children=new_children)
+    # Names are matched without case, so map every name to its lowercase.
+    lowered: dict[str, int] = {}
+    lower_ids = np.fromiter(
+        (lowered.setdefault(name.lower(), len(lowered))
+         for name in db.name_pool),
+        dtype=np.int64,
+        count=len(db.name_pool))
+    lower_names = np.array(list(lowered), dtype=object)
+    classnames = np.array(list(db.class_pool), dtype=object)
+    root_vert = Vertex(name="Game", classname="DataModel")
+    pairs: list[np.ndarray] = []
+    for source in db.sources:
+        name_ids = lower_ids[source.name_ids]
+        root_vert.merge_rows(lower_names[name_ids].tolist(),
+                             classnames[source.class_ids].tolist(),
+                             source.parents.tolist())
+        # The root instance of a source is the DataModel itself.
+        pairs.append(name_ids[1:] * len(classnames) + source.class_ids[1:])
+    root_vert.sort()
+    # The table maps each name to its most common class name, ties going to
+    # the pair seen first.
+    keys, first, counts = np.unique(np.concatenate(pairs)
+                                    if pairs else np.zeros(0, dtype=np.int64),
+                                    return_index=True,
+                                    return_counts=True)
+    keys = keys[np.lexsort((first, -counts))]
+    names, best = np.unique(keys // len(classnames), return_index=True)
+    order = np.argsort(best, kind="stable")
+    index_table = dict(
+        zip(lower_names[names[order]].tolist(),
+            classnames[keys[best[order]] % len(classnames)].tolist()))
+    return root_vert, LTable(index_table)
 
 
-def initialize(db: Database) -> tuple[Vertex, LTable]:
-    """Initialize"""
-    freq_table: dict[tuple, int] = {}
-    count: dict[int, int] = {}
-    root_children: list[Vertex] = []
-    # load and do the merging and filling the table.
-    stack: list[tuple[Iterator, list[Vertex], set]] = []
-    for source in db.sources:
-        child: list[Instance] | None = source.root.children
-        if child is None:
-            continue
-        stack.append((iter(child), root_children, set()))
+def load_or_initialize(db: Database) -> tuple[Vertex, LTable]:
+    """Same as `initialize`, but reuses the result cached for the same
+    source files if the database has a cache.
+
+    Args:
+        db (Database): The database.
+
+    Returns:
+        tuple[Vertex, LTable]: The merged tree and the table.
+    """
+    snapshots = db.cache
+    if snapshots is None:
+        return initialize(db)
+    paths = [source.source_path for source in db.sources]
+    entry = snapshots.load("prediction", paths)
+    if entry is not None:
+        return from_arrays(entry)
+    k_tree, table = initialize(db)
+    snapshots.save("prediction", paths, to_arrays(k_tree, table))
+    return k_tree, table
+
+
+def to_arrays(k_tree: Vertex, table: LTable) -> dict[str, np.ndarray]:
+    """Flattens the merged tree and the table into arrays.
+
+    Args:
+        k_tree (Vertex): The merged tree.
+        table (LTable): The table.
+
+    Returns:
+        dict[str, np.ndarray]: The arrays.
+    """
+    strings = StringPool()
+    parents: list[int] = []
+    name_ids: list[int] = []
+    class_ids: list[int] = []
+    counts: list[int] = []
+    stack: list[tuple[Vertex, int]] = [(k_tree, -1)]
     while stack:
-        left, right, dup = stack[-1]
-        child: Instance = next(left, None)
-        if child is None:
-            stack.pop()
-            continue
-        children = child.children
-        name, class_name = child.name.lower(), child.class_name
-        dup_check = (class_name, name)
-        freq_table[dup_check] = freq_table.get(dup_check, 0) + 1
-        if children is None:
-            if dup_check not in dup:
-                dup.add(dup_check)
-                new_vertex = Vertex(name=name,
-                                    classname=class_name,
-                                    children=None)
-                right.append(new_vertex)
-                count[id(new_vertex)] = 1
-            else:
-                old_vert = next(
-                    (vert for vert in right
-                     if vert.name == name and vert.classname == class_name))
-                count[id(old_vert)] += 1
-            continue
-        new_children: list[Vertex] = []
-        if dup_check not in dup:
-            dup.add(dup_check)
-            new_vertex = Vertex(name=name,
-                                classname=class_name,
-                                children=new_children)
-            count[id(new_vertex)] = 1
-            right.append(new_vertex)
-        else:
-            old_vert = next(
-                (vert for vert in right
-                 if vert.name == name and vert.classname == class_name))
-            count[id(old_vert)] += 1
-            if old_vert.children is not None:
-                new_children = old_vert.children
-            else:
-                old_vert.children = new_children
-        stack.append((iter(children), new_children, set()))
-    # Now do the sorting thing.
-    root_children.sort(key=lambda vertex: count[id(vertex)], reverse=True)
-    sort_stack: list[Iterator[Vertex]] = [iter(root_children)]
-    while sort_stack:
-        it = sort_stack[-1]
-        child: Vertex = next(it, None)
-        if child is None:
-            sort_stack.pop()
-            continue
-        if child.children is None:
-            continue
-        child.children.sort(key=lambda vertex: count[id(vertex)], reverse=True)
-        sort_stack.append(iter(child.children))
-    root_vert: Vertex = Vertex(name="Game",
-                               classname="DataModel",
-                               children=root_children)
-    freq_arr = [(*k, v) for k, v in freq_table.items()]
-    freq_arr.sort(key=lambda val: val[2], reverse=True)
-    index_table: dict = {}
-    for entry in freq_arr:
-        if index_table.get(entry[1]) is None:
-            index_table[entry[1]] = entry[0]
-    return root_vert, LTable(index_table)
+        vertex, parent = stack.pop()
+        parents.append(parent)
+        name_ids.append(strings.intern(vertex.name))
+        class_ids.append(strings.intern(vertex.classname))
+        counts.append(vertex.count)
+        index = len(parents) - 1
+        stack.extend(
+            (child, index) for child in reversed(vertex.child_list()))
+    index = table.index.to_arrays()
+    table_keys = [strings.intern(key) for key in table.table.keys()]
+    table_values = [strings.intern(value) for value in table.table.values()]
+    blob, ends = pack_strings(list(strings))
+    return {
+        "parents": np.array(parents, dtype=np.int32),
+        "name_ids": np.array(name_ids, dtype=np.int32),
+        "class_ids": np.array(class_ids, dtype=np.int32),
+        "counts": np.array(counts, dtype=np.int64),
+        "table_keys": np.array(table_keys, dtype=np.int32),
+        "table_values": np.array(table_values, dtype=np.int32),
+        "strings": blob,
+        "string_ends": ends,
+        "index_alphabet": index["alphabet"],
+        "index_counts": index["counts"]
+    }
 
 
-def predict_tree(k_tree, table, tree_view: Treeview):
-    """Predicts the tree."""
-    test_children = tree_view.get_children(tree_view.get_children()[0])
-    predicted_name: dict[str, str | bool] = {}
-    add_stack: list[Iterator[str]] = [iter(test_children)]
-    while add_stack:
-        it = add_stack[-1]
-        cur = next(it, None)
-        if cur is None:
-            add_stack.pop()
+def _link_vertices(names: list[str], classnames: list[str], counts: list[int],
+                   parents: list[int]) -> list[Vertex]:
+    """Creates the vertices of a merged tree stored as rows in pre-order."""
+    vertices = [
+        Vertex(name, classname, None, count)
+        for name, classname, count in zip(names, classnames, counts)
+    ]
+    # Rows are unique children, so no merging is needed.
+    for vertex, parent in zip(vertices, parents):
+        if parent < 0:
             continue
-        predicted_name[cur] = True
-        children = tree_view.get_children(cur)
-        if children is not None:
-            add_stack.append(iter(children))
-    # Restricted DFS
-    stack: list[tuple[list[Vertex], Iterator[str]]] = [(k_tree.children,
-                                                        iter(test_children))]
-    while stack:
-        cur_k, cur_test = stack[-1]
-        cur = next(cur_test, None)
-        if cur is None:
-            stack.pop()
+        siblings = vertices[parent].children
+        if siblings is None:
+            siblings = vertices[parent].children = {}
+        named = siblings.get(vertex.name)
+        if named is None:
+            named = siblings[vertex.name] = {}
+        named[vertex.classname] = vertex
+    return vertices
+
+
+def from_arrays(arrays: dict[str, np.ndarray]) -> tuple[Vertex, LTable]:
+    """Reverses `to_arrays`.
+
+    Args:
+        arrays (dict[str, np.ndarray]): The arrays.
+
+    Returns:
+        tuple[Vertex, LTable]: The merged tree and the table.
+    """
+    strings = unpack_strings(arrays["strings"], arrays["string_ends"])
+    # Only new objects are made here, so collecting garbage is wasted time.
+    collecting = gc.isenabled()
+    gc.disable()
+    try:
+        vertices = _link_vertices(
+            [strings[name_id] for name_id in arrays["name_ids"].tolist()],
+            [strings[class_id] for class_id in arrays["class_ids"].tolist()],
+            arrays["counts"].tolist(), arrays["parents"].tolist())
+    finally:
+        if collecting:
+            gc.enable()
+    table = {
+        strings[key]: strings[value]
+        for key, value in zip(arrays["table_keys"].tolist(),
+                              arrays["table_values"].tolist())
+    }
+    index = FuzzyIndex.from_arrays(
+        table.keys(), {
+            "alphabet": arrays["index_alphabet"],
+            "counts": arrays["index_counts"]
+        })
+    return vertices[0], LTable(table, index=index)
+
+
+def save_model(path: Path, k_tree: Vertex, table: LTable) -> None:
+    """Saves a trained model, so predictions can be made without loading
+    the data sets.
+
+    The file holds the arrays of `to_arrays`, compressed, and the model
+    version.
+
+    Args:
+        path (Path): The path of the model file.
+        k_tree (Vertex): The merged tree.
+        table (LTable): The table.
+    """
+    temp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    try:
+        with open(temp, "wb") as out:
+            np.savez_compressed(out,
+                                version=np.array(MODEL_VERSION),
+                                **to_arrays(k_tree, table))
+        os.replace(temp, path)
+    finally:
+        temp.unlink(missing_ok=True)
+
+
+def load_model(path: Path) -> tuple[Vertex, LTable]:
+    """Loads a model saved with `save_model`.
+
+    Args:
+        path (Path): The path of the model file.
+
+    Raises:
+        ValueError: The file is not a model of this version.
+
+    Returns:
+        tuple[Vertex, LTable]: The merged tree and the table.
+    """
+    with np.load(path) as model:
+        if "version" not in model.files or int(
+                model["version"]) != MODEL_VERSION:
+            raise ValueError(f"{path} is not a version {MODEL_VERSION} model.")
+        return from_arrays({key: model[key] for key in model.files})
+
+
+# The children of the merged tree vertices an item matched, in the order
+# they are searched for the children of the item.
+Contexts = list[dict[str, dict[str, Vertex]]]
+
+
+def _match(contexts: Contexts, name: str) -> tuple[str | None, Contexts]:
+    """Looks up an item in the contexts of its parent.
+
+    Args:
+        contexts (Contexts): The contexts of the parent.
+        name (str): The lowercase name of the item.
+
+    Returns:
+        tuple[str | None, Contexts]: The predicted class name, None if the
+            name is not found, and the contexts of the item.
+    """
+    prediction: str | None = None
+    child_contexts: Contexts = []
+    for context in contexts:
+        matches = context.get(name)
+        if matches is None:
             continue
-        is_found = predicted_name.get(cur) is not True
-        for k_child in cur_k:
-            cur_name = tree_view.item(cur)['text'].lower()
-            if k_child.name != cur_name:
-                continue
-            if not is_found:
-                is_found = True
-                predicted_name[cur] = k_child.classname
-            cur_children = tree_view.get_children(cur)
-            if k_child.children is not None and cur_children is not None:
-                stack.append((k_child.children, iter(cur_children)))
-    # Fallback to levienstein if not found.
-    for k, v in predicted_name.items():
-        if v is True:
-            predicted_name[k] = table.find(tree_view.item(k)['text'].lower())
-    # Apply the results
-    for k, v in predicted_name.items():
-        tree_view.set(k, "class", v)
+        # The most common class name with the same name wins, and its
+        # children are searched first.
+        for k_child in matches.values():
+            if prediction is None:
+                prediction = k_child.classname
+            if k_child.children is not None:
+                child_contexts.append(k_child.children)
+    return prediction, child_contexts
+
+
+def predict(k_tree: Vertex, table: LTable, names: Sequence[str],
+            parents: Sequence[int]) -> list[str]:
+    """Predicts the class name of every instance of a tree, without any UI.
+
+    The tree is given as rows in pre-order, the same layout as
+    `data.DataSource`, so `predict(k_tree, table, names, source.parents)`
+    predicts a whole source. Rows without a parent stand for the DataModel.
+
+    Args:
+        k_tree (Vertex): The merged tree.
+        table (LTable): The table used for names not found in the tree.
+        names (Sequence[str]): The name of every row.
+        parents (Sequence[int]): The parent row of every row, -1 for roots.
+
+    Returns:
+        list[str]: The predicted class name of every row.
+    """
+    predictor = TreePredictor(k_tree, table)
+    return predictor.add_many(range(len(names)), parents, names)
+
+
+class TreePredictor:
+    """Predicts a tree that is built and edited one item at a time.
+
+    Every item keeps where it matched in the merged tree, so adding an item
+    only looks at its parent, and removing one changes nothing else.
+    """
+    __k_tree: Vertex
+    __table: LTable
+    __contexts: dict[Hashable, Contexts]
+
+    def __init__(self, k_tree: Vertex, table: LTable) -> None:
+        """Creates a predictor with no items.
+
+        Args:
+            k_tree (Vertex): The merged tree.
+            table (LTable): The table used for names not found in the tree.
+        """
+        self.__k_tree = k_tree
+        self.__table = table
+        self.__contexts = {}
+
+    def __contains__(self, item: Hashable) -> bool:
+        return item in self.__contexts
+
+    def __add(self, item: Hashable, parent: Hashable | None,
+              name: str) -> str | None:
+        """Adds an item, returns None if it needs the fuzzy table."""
+        if parent is None or parent == -1:
+            self.__contexts[item] = (
+                [self.__k_tree.children]
+                if self.__k_tree.children is not None else [])
+            return self.__k_tree.classname
+        prediction, self.__contexts[item] = _match(self.__contexts[parent],
+                                                   name.lower())
+        return prediction
+
+    def add(self, item: Hashable, parent: Hashable | None, name: str) -> str:
+        """Adds an item and predicts it.
+
+        Args:
+            item (Hashable): The item.
+            parent (Hashable | None): Its parent, which must already be
+                added. None or -1 for the DataModel.
+            name (str): Its name.
+
+        Returns:
+            str: The predicted class name.
+        """
+        prediction = self.__add(item, parent, name)
+        if prediction is None:
+            return self.__table.find(name)
+        return prediction
+
+    def add_many(self, items: Iterable[Hashable],
+                 parents: Iterable[Hashable | None],
+                 names: Iterable[str]) -> list[str]:
+        """Adds many items, parents before their children, and predicts them
+        with a single batch for the fuzzy table.
+
+        Args:
+            items (Iterable[Hashable]): The items.
+            parents (Iterable[Hashable | None]): The parent of every item.
+            names (Iterable[str]): The name of every item.
+
+        Returns:
+            list[str]: The predicted class name of every item.
+        """
+        names = list(names)
+        predicted = [
+            self.__add(item, parent, name)
+            for item, parent, name in zip(items, parents, names)
+        ]
+        unresolved = [
+            row for row, prediction in enumerate(predicted)
+            if prediction is None
+        ]
+        for row, prediction in zip(
+                unresolved,
+                self.__table.find_many(names[row] for row in unresolved)):
+            predicted[row] = prediction
+        return cast(list[str], predicted)
+
+    def remove(self, items: Iterable[Hashable]) -> None:
+        """Forgets items. Their children must be removed as well.
+
+        Args:
+            items (Iterable[Hashable]): The items.
+        """
+        for item in items:
+            self.__contexts.pop(item, None)
+
+
+def predict_tree(k_tree: Vertex, table: LTable, tree_view: "Treeview") -> None:
+    """Predicts every item under the first root of a Treeview and writes the
+    results to its "class" column.
+
+    Args:
+        k_tree (Vertex): The merged tree.
+        table (LTable): The table.
+        tree_view (Treeview): The Treeview.
+    """
+    items: list[str] = []
+    names: list[str] = []
+    parents: list[int] = []
+    walk: list[tuple[str, int]] = [(tree_view.get_children()[0], -1)]
+    while walk:
+        item, parent = walk.pop()
+        parents.append(parent)
+        items.append(item)
+        names.append(str(tree_view.item(item, "text")))
+        row = len(items) - 1
+        walk.extend((child, row)
+                    for child in reversed(tree_view.get_children(item)))
+    predictions = predict(k_tree, table, names, parents)
+    # The root is the DataModel itself.
+    for item, prediction in zip(items[1:], predictions[1:]):
+        tree_view.set(item, "class", prediction)
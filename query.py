@@ -0,0 +1,637 @@
+"""This file implements filters and aggregates evaluated over whole columns."""
+import ast
+import operator
+from collections import Counter
+from dataclasses import dataclass
+from functools import reduce
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Tuple
+import numpy as np
+from data import DataSource, StringPool, count_values
+from sketch import QuantileSketch
+
+_COMPARISONS: Dict[type, Callable[[Any, Any], Any]] = {
+    ast.Eq: operator.eq,
+    ast.NotEq: operator.ne,
+    ast.Lt: operator.lt,
+    ast.LtE: operator.le,
+    ast.Gt: operator.gt,
+    ast.GtE: operator.ge,
+}
+_ARITHMETIC: Dict[type, Callable[[Any, Any], Any]] = {
+    ast.Add: operator.add,
+    ast.Sub: operator.sub,
+    ast.Mult: operator.mul,
+    ast.Div: operator.truediv,
+    ast.FloorDiv: operator.floordiv,
+    ast.Mod: operator.mod,
+}
+_DIVISIONS = (ast.Div, ast.FloorDiv, ast.Mod)
+_STRING_PREDICATES = ("startswith", "endswith", "isdigit", "isalpha",
+                      "isalnum", "isupper", "islower", "isspace")
+_STRING_TRANSFORMS = ("lower", "upper", "strip", "title")
+_NUMERIC_FIELDS = {
+    "depth": lambda source: source.depths,
+    "child_count": lambda source: source.child_counts,
+    "subtree_size": lambda source: source.subtree_sizes,
+    "sibling_index": lambda source: source.sibling_indices,
+}
+
+
+class _Strings:
+    """A string column: ids into a list of distinct strings.
+
+    Every string operation is done once per distinct string and then
+    broadcast to the rows through the ids.
+    """
+    ids: np.ndarray
+    strings: List[str]
+
+    def __init__(self, ids: np.ndarray, strings: List[str]) -> None:
+        self.ids = ids
+        self.strings = strings
+
+    def map(self, function: Callable[[str], Any], dtype=None) -> np.ndarray:
+        """Applies a function to every distinct string and returns the
+        result of every row."""
+        table = np.array([function(string) for string in self.strings],
+                         dtype=dtype)
+        if len(table) == 0:
+            return np.zeros(len(self.ids), dtype=dtype or bool)
+        return table[self.ids]
+
+    def transform(self, function: Callable[[str], str]) -> "_Strings":
+        """Returns a string column with every string transformed."""
+        return _Strings(self.ids,
+                        [function(string) for string in self.strings])
+
+    def objects(self) -> np.ndarray:
+        """Returns the strings of every row."""
+        return self.map(lambda string: string, dtype=object)
+
+
+class Filter:
+    """A filter expression, for example `val.class_name == "Part"`.
+
+    The expression is parsed once and evaluated as a boolean mask over the
+    columns of a data source. Only a restricted set of Python is accepted:
+    the fields `val.name`, `val.class_name`, `val.depth()`,
+    `val.child_count`, `val.subtree_size` and `val.sibling_index`, constants,
+    `len()`, string methods, arithmetic, comparisons, `in` and boolean
+    operators.
+    """
+    text: str
+    __tree: ast.expr
+
+    def __init__(self, text: str) -> None:
+        """Parses and checks the expression.
+
+        Args:
+            text (str): The expression.
+
+        Raises:
+            ValueError: The expression is invalid or not supported.
+        """
+        self.text = text
+        try:
+            self.__tree = ast.parse(text.strip() or "True", mode="eval").body
+        except SyntaxError as error:
+            raise ValueError(
+                f"Invalid filter {text!r}: {error.msg}") from error
+        self.mask(_EXAMPLE_SOURCE)
+
+    @property
+    def key(self) -> str:
+        """The parsed expression, equal for filters that differ only in
+        formatting."""
+        return ast.dump(self.__tree)
+
+    def mask(self, source: DataSource) -> np.ndarray:
+        """Evaluates the filter for every instance of a source.
+
+        Args:
+            source (DataSource): The source.
+
+        Raises:
+            ValueError: The expression is not supported.
+
+        Returns:
+            np.ndarray: True for every instance that passes the filter.
+        """
+        try:
+            result = _Evaluator(source, self.text).evaluate(self.__tree)
+        except (ArithmeticError, TypeError) as error:
+            # Overflow and calls with the wrong arguments only show when
+            # evaluated.
+            raise ValueError(
+                f"Unsupported filter {self.text!r}: {error}") from error
+        if isinstance(result, _Strings):
+            result = result.map(bool, dtype=bool)
+        result = np.asarray(result)
+        if result.dtype != bool:
+            raise ValueError(
+                f"Filter {self.text!r} does not evaluate to True or False.")
+        return np.broadcast_to(result, len(source))
+
+
+def filters_key(filters: Iterable[Filter]) -> Tuple[str, ...]:
+    """Returns a key that is equal for equivalent lists of filters.
+
+    The order of the filters, duplicates and filters that are just `True`
+    do not change the key.
+
+    Args:
+        filters (Iterable[Filter]): The filters.
+
+    Returns:
+        Tuple[str, ...]: The key.
+    """
+    always = ast.dump(ast.Constant(True))
+    return tuple(sorted({fil.key for fil in filters} - {always}))
+
+
+def combine_filters(
+        filters: List[Filter]) -> Callable[[DataSource], np.ndarray]:
+    """Returns a mask function that requires every filter to pass.
+
+    Args:
+        filters (List[Filter]): The filters.
+
+    Returns:
+        Callable[[DataSource], np.ndarray]: The mask function.
+    """
+
+    def mask(source: DataSource) -> np.ndarray:
+        result = np.ones(len(source), dtype=bool)
+        for fil in filters:
+            result &= fil.mask(source)
+        return result
+
+    return mask
+
+
+class _Evaluator:
+    """Evaluates a parsed filter expression against one source."""
+    source: DataSource
+    text: str
+
+    def __init__(self, source: DataSource, text: str) -> None:
+        self.source = source
+        self.text = text
+
+    def fail(self, node: ast.AST) -> ValueError:
+        """Returns the error for an unsupported part of the expression."""
+        return ValueError(f"Unsupported filter expression "
+                          f"{ast.unparse(node)!r} in {self.text!r}.")
+
+    def evaluate(self, node: ast.AST) -> Any:
+        """Evaluates a node to a constant, a column or a string column."""
+        if isinstance(node, ast.Constant):
+            if isinstance(node.value, (str, int, float, bool)):
+                return node.value
+            raise self.fail(node)
+        if isinstance(node, (ast.Tuple, ast.List, ast.Set)):
+            values = [self.evaluate(element) for element in node.elts]
+            if any(isinstance(value, (np.ndarray, _Strings))
+                   for value in values):
+                raise self.fail(node)
+            return tuple(values)
+        if isinstance(node, ast.BoolOp):
+            masks = [self.boolean(value) for value in node.values]
+            if isinstance(node.op, ast.And):
+                return reduce(np.logical_and, masks)
+            return reduce(np.logical_or, masks)
+        if isinstance(node, ast.UnaryOp):
+            if isinstance(node.op, ast.Not):
+                return np.logical_not(self.boolean(node.operand))
+            operand = self.numeric(node.operand)
+            if isinstance(node.op, ast.USub):
+                return -operand
+            if isinstance(node.op, ast.UAdd):
+                return operand
+            raise self.fail(node)
+        if isinstance(node, ast.BinOp):
+            function = _ARITHMETIC.get(type(node.op))
+            if function is None:
+                raise self.fail(node)
+            left, right = self.numeric(node.left), self.numeric(node.right)
+            # NumPy only warns when a column is divided by zero.
+            if (isinstance(node.op, _DIVISIONS)
+                    and not isinstance(right, np.ndarray) and right == 0):
+                raise self.fail(node)
+            # Instances dividing by a zero column become inf or nan, which
+            # fail every comparison.
+            with np.errstate(divide="ignore", invalid="ignore"):
+                return function(left, right)
+        if isinstance(node, ast.Compare):
+            return self.compare(node)
+        if isinstance(node, ast.Attribute):
+            return self.attribute(node)
+        if isinstance(node, ast.Call):
+            return self.call(node)
+        raise self.fail(node)
+
+    def boolean(self, node: ast.AST) -> Any:
+        """Evaluates a node that must be True or False."""
+        value = self.evaluate(node)
+        if isinstance(value, _Strings):
+            return value.map(bool, dtype=bool)
+        if isinstance(value, np.ndarray):
+            return value.astype(bool)
+        return bool(value)
+
+    def numeric(self, node: ast.AST) -> Any:
+        """Evaluates a node that must be a number."""
+        value = self.evaluate(node)
+        if isinstance(value, (_Strings, str, tuple)):
+            raise self.fail(node)
+        return value
+
+    def attribute(self, node: ast.Attribute) -> Any:
+        """Evaluates `val.<field>`."""
+        if not isinstance(node.value, ast.Name) or node.value.id != "val":
+            raise self.fail(node)
+        source = self.source
+        if node.attr == "name":
+            return _Strings(source.name_ids, list(source.name_pool))
+        if node.attr == "class_name":
+            return _Strings(source.class_ids, list(source.class_pool))
+        field = _NUMERIC_FIELDS.get(node.attr)
+        if field is None:
+            raise self.fail(node)
+        return field(source)
+
+    def call(self, node: ast.Call) -> Any:
+        """Evaluates `len(...)`, `val.depth()` and string methods."""
+        if node.keywords:
+            raise self.fail(node)
+        func = node.func
+        if (isinstance(func, ast.Name) and func.id == "len"
+                and len(node.args) == 1):
+            value = self.evaluate(node.args[0])
+            if isinstance(value, _Strings):
+                return value.map(len, dtype=np.int32)
+            if isinstance(value, (str, tuple)):
+                return len(value)
+            raise self.fail(node)
+        if not isinstance(func, ast.Attribute):
+            raise self.fail(node)
+        if (isinstance(func.value, ast.Name) and func.value.id == "val"
+                and func.attr == "depth" and not node.args):
+            return self.source.depths
+        target = self.evaluate(func.value)
+        if not isinstance(target, _Strings):
+            raise self.fail(node)
+        args = [self.evaluate(arg) for arg in node.args]
+        if not all(isinstance(arg, (str, tuple)) for arg in args):
+            raise self.fail(node)
+        if func.attr in _STRING_PREDICATES:
+            method = getattr(str, func.attr)
+            return target.map(lambda string: method(string, *args), dtype=bool)
+        if func.attr in _STRING_TRANSFORMS and not args:
+            return target.transform(getattr(str, func.attr))
+        raise self.fail(node)
+
+    def compare(self, node: ast.Compare) -> Any:
+        """Evaluates a (possibly chained) comparison."""
+        result: Any = True
+        left = self.evaluate(node.left)
+        for op, right_node in zip(node.ops, node.comparators):
+            right = self.evaluate(right_node)
+            result = np.logical_and(
+                result, self.compare_pair(node, op, left, right))
+            left = right
+        return result
+
+    def compare_pair(self, node: ast.Compare, op: ast.cmpop, left: Any,
+                     right: Any) -> Any:
+        """Evaluates a single comparison."""
+        if isinstance(op, (ast.In, ast.NotIn)):
+            result = self.contains(node, left, right)
+            if isinstance(op, ast.NotIn):
+                return np.logical_not(result)
+            return result
+        function = _COMPARISONS.get(type(op))
+        if function is None:
+            raise self.fail(node)
+        if isinstance(left, _Strings) and isinstance(right, _Strings):
+            return function(left.objects(), right.objects()).astype(bool)
+        if isinstance(left, _Strings):
+            if not isinstance(right, str):
+                raise self.fail(node)
+            return left.map(lambda string: function(string, right), dtype=bool)
+        if isinstance(right, _Strings):
+            if not isinstance(left, str):
+                raise self.fail(node)
+            return right.map(lambda string: function(left, string), dtype=bool)
+        if isinstance(left, tuple) or isinstance(right, tuple):
+            raise self.fail(node)
+        if isinstance(left, str) != isinstance(right, str):
+            raise self.fail(node)
+        return function(left, right)
+
+    def contains(self, node: ast.Compare, item: Any, container: Any) -> Any:
+        """Evaluates `item in container`."""
+        if isinstance(container, tuple):
+            if isinstance(item, _Strings):
+                members = set(container)
+                return item.map(lambda string: string in members, dtype=bool)
+            if isinstance(item, np.ndarray):
+                return np.isin(item, container)
+            return item in container
+        if isinstance(container, _Strings):
+            if isinstance(item, str):
+                return container.map(lambda string: item in string,
+                                     dtype=bool)
+            if isinstance(item, _Strings):
+                pairs = zip(item.objects().tolist(),
+                            container.objects().tolist())
+                return np.fromiter((needle in haystack
+                                    for needle, haystack in pairs),
+                                   dtype=bool,
+                                   count=len(item.ids))
+            raise self.fail(node)
+        if isinstance(container, str) and isinstance(item, _Strings):
+            return item.map(lambda string: string in container, dtype=bool)
+        if isinstance(container, str) and isinstance(item, str):
+            return item in container
+        raise self.fail(node)
+
+
+def _example_source() -> DataSource:
+    """A single instance source used to check expressions up front."""
+    name_pool = StringPool()
+    class_pool = StringPool()
+    return DataSource(Path(), name_pool, class_pool,
+                      np.array([-1], dtype=np.int32),
+                      np.array([name_pool.intern("")], dtype=np.int32),
+                      np.array([class_pool.intern("")], dtype=np.int32))
+
+
+_EXAMPLE_SOURCE = _example_source()
+
+
+@dataclass
+class Summary:
+    """Descriptive statistics of a column."""
+    mean: float
+    median: float
+    mode: Any
+    first_quartile: float
+    third_quartile: float
+    stdev: float
+
+
+def summarize(values: np.ndarray) -> Summary:
+    """Computes the descriptive statistics of a column.
+
+    Args:
+        values (np.ndarray): The column, with at least two values.
+
+    Returns:
+        Summary: The statistics.
+    """
+    # Weibull is the (n + 1) method used by statistics.quantiles.
+    first, median, third = np.percentile(values, (25, 50, 75),
+                                         method="weibull").tolist()
+    return Summary(mean=float(values.mean()),
+                   median=median,
+                   mode=count_values(values).most_common(1)[0][0],
+                   first_quartile=first,
+                   third_quartile=third,
+                   stdev=float(values.std(ddof=1)))
+
+
+def unique_rows(columns: List[np.ndarray]) -> Tuple[np.ndarray, np.ndarray]:
+    """Returns the unique combinations of values of the columns and how
+    often each occurs, the same as `np.unique` over the stacked rows.
+
+    Args:
+        columns (List[np.ndarray]): The columns, of equal length.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: A row per combination, sorted, and
+            their counts.
+    """
+    if all(np.issubdtype(column.dtype, np.integer) and len(column)
+           for column in columns):
+        lows = [column.min().item() for column in columns]
+        spans = [column.max().item() - low + 1
+                 for column, low in zip(columns, lows)]
+        # Small integer columns pack into a single integer per row, which
+        # sorts much faster than rows.
+        if np.prod(spans, dtype=float) < 2**62:
+            codes = np.zeros(len(columns[0]), dtype=np.int64)
+            for column, low, span in zip(columns, lows, spans):
+                codes = codes * span + (column - low)
+            codes, counts = np.unique(codes, return_counts=True)
+            rows = np.empty((len(codes), len(columns)), dtype=np.int64)
+            for index in range(len(columns) - 1, -1, -1):
+                codes, rows[:, index] = np.divmod(codes, spans[index])
+                rows[:, index] += lows[index]
+            return rows, counts
+    return np.unique(np.stack(columns, axis=1), axis=0, return_counts=True)
+
+
+def bin_edges(values: np.ndarray, max_bins: int) -> np.ndarray:
+    """Returns the bin edges of a column. Integer columns get a bin per
+    value, centred on it, when that takes at most `max_bins` bins.
+
+    Args:
+        values (np.ndarray): The column.
+        max_bins (int): The most bins.
+
+    Returns:
+        np.ndarray: The edges, one more than the bins.
+    """
+    if len(values) == 0:
+        return np.array([-0.5, 0.5])
+    low, high = values.min().item(), values.max().item()
+    if (np.issubdtype(values.dtype, np.integer)
+            and high - low + 1 <= max_bins):
+        return np.arange(low, high + 2) - 0.5
+    if low == high:
+        return np.array([low - 0.5, high + 0.5])
+    return np.linspace(low, high, max_bins + 1)
+
+
+def stratified_sample(columns: List[np.ndarray],
+                      size: int,
+                      max_bins: int = 64,
+                      seed: int = 0) -> np.ndarray:
+    """Samples rows so every grid cell of the columns keeps a share of the
+    sample in proportion to its rows, but at least one row, so sparse
+    regions and outliers stay visible.
+
+    Args:
+        columns (List[np.ndarray]): The columns, of equal length.
+        size (int): The size of the sample, exceeded by at most the number
+            of cells.
+        max_bins (int, optional): The most bins along each column.
+        seed (int, optional): Seeds the choice of rows.
+
+    Returns:
+        np.ndarray: The indices of the sampled rows, in order.
+    """
+    rows = len(columns[0]) if columns else 0
+    if rows <= size:
+        return np.arange(rows)
+    strata = np.zeros(rows, dtype=np.int64)
+    for column in columns:
+        edges = bin_edges(column, max_bins)
+        cells = np.clip(
+            np.searchsorted(edges, column, side="right") - 1, 0,
+            len(edges) - 2)
+        strata = strata * (len(edges) - 1) + cells
+    _, inverse, counts = np.unique(strata,
+                                   return_inverse=True,
+                                   return_counts=True)
+    quotas = np.minimum(np.maximum(counts * size // rows, 1), counts)
+    # The rows of every stratum in a random order, the first are kept.
+    order = np.lexsort((np.random.default_rng(seed).random(rows), inverse))
+    starts = np.cumsum(counts) - counts
+    ranks = np.empty(rows, dtype=np.int64)
+    ranks[order] = np.arange(rows) - np.repeat(starts, counts)
+    return np.flatnonzero(ranks < quotas[inverse])
+
+
+class Aggregation:
+    """Collects the aggregates a render needs and computes them together.
+
+    Columns are registered by name, then aggregates are requested over them.
+    `run` reads every needed column from each source once, however many
+    aggregates use it, and returns the results keyed by what the request
+    methods returned.
+    """
+    __sources: List[DataSource]
+    __extractors: Dict[str, Callable[[DataSource], np.ndarray]]
+    __requests: Dict[str, Tuple[str, Tuple[str, ...], Dict[str, Any]]]
+
+    def __init__(self, sources: Iterable[DataSource]) -> None:
+        self.__sources = list(sources)
+        self.__extractors = {}
+        self.__requests = {}
+
+    def column(self, name: str,
+               extractor: Callable[[DataSource], np.ndarray]) -> None:
+        """Registers a column.
+
+        Args:
+            name (str): The name of the column.
+            extractor (Callable[[DataSource], np.ndarray]):
+                Returns the column of a source.
+        """
+        self.__extractors[name] = extractor
+
+    def __request(self, kind: str, *names: str, **options: Any) -> str:
+        for name in names:
+            if name not in self.__extractors:
+                raise KeyError(f"Unknown column {name!r}.")
+        key = kind + ":" + ",".join(names)
+        if options:
+            key += ":" + ",".join(f"{option}={value!r}"
+                                  for option, value in sorted(options.items()))
+        self.__requests[key] = (kind, names, options)
+        return key
+
+    def values(self, name: str) -> str:
+        """Requests every value of a column."""
+        return self.__request("values", name)
+
+    def summary(self, name: str) -> str:
+        """Requests the `Summary` of a column."""
+        return self.__request("summary", name)
+
+    def correlation(self, left: str, right: str) -> str:
+        """Requests the Pearson correlation of two columns."""
+        return self.__request("correlation", left, right)
+
+    def group_counts(self, *names: str) -> str:
+        """Requests a Counter of how often each combination of values of the
+        columns occurs, keyed by tuples of values."""
+        return self.__request("group_counts", *names)
+
+    def sketch(self, name: str, accuracy: float) -> str:
+        """Requests a `QuantileSketch` of a column with a rank error, built
+        source by source without reading the whole column at once."""
+        return self.__request("sketch", name, accuracy=accuracy)
+
+    def weighted_values(self, *names: str) -> str:
+        """Requests the unique combinations of values of the columns, as a
+        row per combination, and how often each occurs."""
+        return self.__request("weighted_values", *names)
+
+    def histogram2d(self, left: str, right: str, max_bins: int = 200) -> str:
+        """Requests the counts of two columns on a grid of bins, with the
+        edges of the bins, see `bin_edges`."""
+        return self.__request("histogram2d", left, right, max_bins=max_bins)
+
+    def sample(self, *names: str, size: int = 20000) -> str:
+        """Requests the values of the columns at the rows of a stratified
+        sample, see `stratified_sample`."""
+        return self.__request("sample", *names, size=size)
+
+    def run(self,
+            progress: Callable[[float], None] | None = None) -> Dict[str, Any]:
+        """Computes every requested aggregate.
+
+        Args:
+            progress (Callable[[float], None] | None, optional):
+                Called with the fraction of the work done so far.
+
+        Returns:
+            Dict[str, Any]: The results, keyed by the request keys.
+        """
+        needed = {
+            name
+            for kind, names, _ in self.__requests.values()
+            if kind != "sketch" for name in names
+        }
+        steps = len(needed) + len(self.__requests)
+        columns: Dict[str, np.ndarray] = {}
+        for name in needed:
+            if progress is not None:
+                progress(len(columns) / steps)
+            columns[name] = np.concatenate([
+                self.__extractors[name](source) for source in self.__sources
+            ]) if self.__sources else np.zeros(0)
+        results: Dict[str, Any] = {}
+        for key, (kind, names, options) in self.__requests.items():
+            if progress is not None:
+                progress((len(columns) + len(results)) / steps)
+            if kind == "sketch":
+                results[key] = self.__sketch(names[0], options["accuracy"])
+                continue
+            data = [columns[name] for name in names]
+            if kind == "values":
+                results[key] = data[0]
+            elif kind == "summary":
+                results[key] = summarize(data[0])
+            elif kind == "correlation":
+                with np.errstate(divide="ignore", invalid="ignore"):
+                    results[key] = float(np.corrcoef(data[0], data[1])[0, 1])
+            elif kind == "weighted_values":
+                results[key] = unique_rows(data)
+            elif kind == "histogram2d":
+                results[key] = np.histogram2d(
+                    data[0],
+                    data[1],
+                    bins=[bin_edges(column, options["max_bins"])
+                          for column in data])
+            elif kind == "sample":
+                rows = stratified_sample(data, options["size"])
+                results[key] = tuple(column[rows] for column in data)
+            else:
+                groups, counts = unique_rows(data)
+                results[key] = Counter(
+                    dict(zip(map(tuple, groups.tolist()), counts.tolist())))
+        return results
+
+    def __sketch(self, name: str, accuracy: float) -> QuantileSketch:
+        """Sketches a column a source at a time, merging the sketches."""
+        sketch = QuantileSketch.with_accuracy(accuracy)
+        for source in self.__sources:
+            source_sketch = QuantileSketch.with_accuracy(accuracy)
+            source_sketch.update(self.__extractors[name](source))
+            sketch.merge(source_sketch)
+        return sketch
@@ -0,0 +1,223 @@
+"""This file implements a mergeable streaming quantile sketch."""
+from typing import Iterable, List, Self
+import math
+import numpy as np
+
+
+class QuantileSketch:
+    """A KLL quantile sketch with exact count, min, max, mean and standard
+    deviation.
+
+    Values are kept in levels, a value at level h stands for 2^h values.
+    When a level is full it is sorted and every other value moves up a
+    level. Each such compaction moves the rank of any value by at most the
+    weight of the level, the sum of those weights is reported as the error
+    bound, so the bound always holds. Which half moves up is random, so the
+    errors mostly cancel and a much tighter bound holds with high
+    probability. The memory is O(k log(n / k)).
+    """
+    k: int
+    __levels: List[np.ndarray]
+    __rng: np.random.Generator
+    __count: int
+    __min: float
+    __max: float
+    __mean: float
+    __m2: float
+    __error: int
+    __squares: int
+
+    def __init__(self, k: int = 200, seed: int = 0) -> None:
+        """Creates an empty sketch.
+
+        Args:
+            k (int, optional): The size of the top level, larger is more
+                accurate. Defaults to 200.
+            seed (int, optional): Seeds which half of a level moves up.
+        """
+        if k < 2:
+            raise ValueError("k must be at least 2.")
+        self.k = k
+        self.__levels = [np.zeros(0)]
+        self.__rng = np.random.default_rng(seed)
+        self.__count = 0
+        self.__min = math.inf
+        self.__max = -math.inf
+        self.__mean = 0.0
+        self.__m2 = 0.0
+        self.__error = 0
+        self.__squares = 0
+
+    @classmethod
+    def with_accuracy(cls, rank_error: float, seed: int = 0) -> Self:
+        """Creates a sketch whose rank error is typically within a bound.
+
+        Args:
+            rank_error (float): The error, as a fraction of the count.
+            seed (int, optional): Seeds which half of a level moves up.
+
+        Returns:
+            Self: The sketch.
+        """
+        if not 0 < rank_error < 1:
+            raise ValueError("The rank error must be between 0 and 1.")
+        # `probable_rank_error` is about 2 / k for a sketch of one stream
+        # and about 4 / k for one merged from many small sketches.
+        return cls(max(2, math.ceil(4 / rank_error)), seed)
+
+    def __len__(self) -> int:
+        return self.__count
+
+    @property
+    def min(self) -> float:
+        """The smallest value, exact."""
+        return self.__min
+
+    @property
+    def max(self) -> float:
+        """The largest value, exact."""
+        return self.__max
+
+    @property
+    def mean(self) -> float:
+        """The mean, exact."""
+        return self.__mean if self.__count else math.nan
+
+    @property
+    def stdev(self) -> float:
+        """The sample standard deviation, exact."""
+        if self.__count < 2:
+            return math.nan
+        return math.sqrt(self.__m2 / (self.__count - 1))
+
+    @property
+    def rank_error(self) -> float:
+        """The most the rank of a quantile can be off by, as a fraction of
+        the count."""
+        return self.__error / self.__count if self.__count else 0.0
+
+    def probable_rank_error(self, confidence: float = 0.99) -> float:
+        """A bound on the rank error that holds with a probability.
+
+        Every compaction moves a rank up or down by its weight with equal
+        odds, so by Hoeffding's inequality the total stays within the bound.
+
+        Args:
+            confidence (float, optional): The probability the bound holds.
+
+        Returns:
+            float: The bound, as a fraction of the count.
+        """
+        if self.__count == 0:
+            return 0.0
+        bound = math.sqrt(
+            2 * self.__squares * math.log(2 / (1 - confidence)))
+        return min(bound, self.__error) / self.__count
+
+    def __capacity(self, level: int) -> int:
+        """Returns how many values a level holds before it is compacted."""
+        depth = len(self.__levels) - level - 1
+        return max(2, int(self.k * (2 / 3)**depth))
+
+    def __add_moments(self, count: int, low: float, high: float, mean: float,
+                      m2: float) -> None:
+        """Merges the moments of other values, Chan's parallel update."""
+        total = self.__count + count
+        delta = mean - self.__mean
+        self.__m2 += m2 + delta * delta * self.__count * count / total
+        self.__mean += delta * count / total
+        self.__count = total
+        self.__min = min(self.__min, low)
+        self.__max = max(self.__max, high)
+
+    def update(self, values: np.ndarray) -> None:
+        """Adds values.
+
+        Args:
+            values (np.ndarray): The values.
+        """
+        values = np.asarray(values, dtype=np.float64).ravel()
+        if len(values) == 0:
+            return
+        mean = float(values.mean())
+        self.__add_moments(len(values), float(values.min()),
+                           float(values.max()), mean,
+                           float(((values - mean)**2).sum()))
+        self.__levels[0] = np.concatenate([self.__levels[0], values])
+        self.__compress()
+
+    def merge(self, other: "QuantileSketch") -> None:
+        """Adds every value of another sketch, as if they were added here.
+
+        Args:
+            other (QuantileSketch): The other sketch, left unchanged.
+        """
+        if other.__count == 0:
+            return
+        self.__add_moments(other.__count, other.__min, other.__max,
+                           other.__mean, other.__m2)
+        while len(self.__levels) < len(other.__levels):
+            self.__levels.append(np.zeros(0))
+        for level, values in enumerate(other.__levels):
+            self.__levels[level] = np.concatenate(
+                [self.__levels[level], values])
+        self.__error += other.__error
+        self.__squares += other.__squares
+        self.__compress()
+
+    def __compress(self) -> None:
+        """Compacts full levels until every level fits."""
+        level = 0
+        while level < len(self.__levels):
+            values = self.__levels[level]
+            if len(values) <= self.__capacity(level):
+                level += 1
+                continue
+            if level + 1 == len(self.__levels):
+                self.__levels.append(np.zeros(0))
+            values = np.sort(values)
+            # An odd value out stays behind.
+            kept, values = values[:len(values) % 2], values[len(values) % 2:]
+            offset = int(self.__rng.integers(2))
+            self.__levels[level] = kept
+            self.__levels[level + 1] = np.concatenate(
+                [self.__levels[level + 1], values[offset::2]])
+            self.__error += 1 << level
+            self.__squares += 1 << (2 * level)
+            # A new level shrinks the ones below, start over.
+            level = 0
+
+    def quantiles(self, fractions: Iterable[float]) -> List[float]:
+        """Returns approximate quantiles.
+
+        Args:
+            fractions (Iterable[float]): The quantiles, from 0 to 1.
+
+        Returns:
+            List[float]: The value at each quantile, its rank is within
+                `rank_error` of the exact one.
+        """
+        fractions = np.asarray(list(fractions), dtype=np.float64)
+        if self.__count == 0:
+            return [math.nan] * len(fractions)
+        values = np.concatenate(self.__levels)
+        weights = np.concatenate([
+            np.full(len(level), 1 << height, dtype=np.int64)
+            for height, level in enumerate(self.__levels)
+        ])
+        order = np.argsort(values, kind="stable")
+        values, ranks = values[order], np.cumsum(weights[order])
+        index = np.searchsorted(ranks, fractions * ranks[-1], side="left")
+        result = values[np.minimum(index, len(values) - 1)]
+        # The ends are known exactly.
+        result[fractions <= 0] = self.__min
+        result[fractions >= 1] = self.__max
+        return result.tolist()
+
+    def nbytes(self) -> int:
+        """Returns the memory held by the stored values.
+
+        Returns:
+            int: The size in bytes.
+        """
+        return sum(level.nbytes for level in self.__levels)
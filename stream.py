@@ -0,0 +1,213 @@
+"""This file implements an incremental reader for instance tree files.
+
+The reader never holds more than a chunk of the file plus the instance
+currently being parsed, so the whole JSON tree is never in memory at once.
+"""
+import re
+from codecs import getincrementaldecoder
+from enum import Enum, auto
+from json import loads as load_json_string
+from pathlib import Path
+from typing import BinaryIO, Callable, Generator, List, Tuple
+
+_STRING = r'"((?:[^"\\]|\\.)*)"'
+# The layout written by the dumper: {"name": .., "class": .., "children": [
+_INSTANCE = re.compile(r'\s*\{\s*"name"\s*:\s*' + _STRING +
+                       r'\s*,\s*"class"\s*:\s*' + _STRING +
+                       r'\s*(?:(\})|,\s*"children"\s*:\s*\[)\s*,?')
+_CLOSE = re.compile(r'\s*\]\s*\}\s*,?')
+_TOKEN = re.compile(r'\s*(?:([{}\[\],:])|' + _STRING +
+                    r'|(true|false|null|-?\d[\d.eE+-]*))')
+_LOOKAHEAD = 4096
+
+
+class Event(Enum):
+    """Events produced by `iter_events`."""
+    START = auto()
+    NAME = auto()
+    CLASS = auto()
+    END = auto()
+
+
+# (event, name, class name). START carries whatever name and class name are
+# already known, NAME and CLASS carry values that come after the children.
+InstanceEvent = Tuple[Event, str | None, str | None]
+
+
+def _unescape(string: str) -> str:
+    return load_json_string('"' + string + '"') if '\\' in string else string
+
+
+class _Buffer:
+    """A decoded window over a binary file that is refilled on demand."""
+    file: BinaryIO
+    chunk_size: int
+    text: str
+    pos: int
+    eof: bool
+    bytes_read: int
+
+    def __init__(self, file: BinaryIO, chunk_size: int) -> None:
+        self.file = file
+        self.chunk_size = chunk_size
+        self.decoder = getincrementaldecoder("utf-8")()
+        self.text = ""
+        self.pos = 0
+        self.eof = False
+        self.bytes_read = 0
+
+    def fill(self) -> None:
+        """Reads another chunk, dropping what has been consumed."""
+        data = self.file.read(self.chunk_size)
+        self.eof = not data
+        self.bytes_read += len(data)
+        self.text = self.text[self.pos:] + self.decoder.decode(data, self.eof)
+        self.pos = 0
+
+    def match(self,
+              pattern: re.Pattern,
+              required: bool = False) -> re.Match | None:
+        """Matches a pattern at the current position, reading more if the
+        match could continue past the end of the buffer.
+
+        Args:
+            pattern (re.Pattern): The pattern.
+            required (bool, optional): Keep reading until the pattern matches.
+
+        Returns:
+            re.Match | None: The match.
+        """
+        while True:
+            found = pattern.match(self.text, self.pos)
+            if self.eof or (found is None and not required):
+                return found
+            if found is not None and found.end() < len(self.text):
+                return found
+            self.fill()
+
+    def token(self) -> Tuple[str | None, str | None, str | None]:
+        """Reads a single JSON token.
+
+        Raises:
+            ValueError: The input is not valid JSON.
+
+        Returns:
+            Tuple[str | None, str | None, str | None]:
+                The punctuation, string and literal groups.
+        """
+        found = self.match(_TOKEN, True)
+        if found is None:
+            raise ValueError(f"Invalid JSON at character {self.pos}.")
+        self.pos = found.end()
+        return found.groups()
+
+    def skip_value(self, first: Tuple[str | None, str | None,
+                                      str | None]) -> None:
+        """Skips over a value whose first token has already been read."""
+        depth = 1 if first[0] in ("{", "[") else 0
+        while depth:
+            punctuation = self.token()[0]
+            if punctuation in ("{", "["):
+                depth += 1
+            elif punctuation in ("}", "]"):
+                depth -= 1
+
+
+def iter_events(
+        file: BinaryIO,
+        chunk_size: int = 1 << 16,
+        progress: Callable[[int], None] | None = None
+) -> Generator[InstanceEvent, None, None]:
+    """Reads an instance tree and yields an event for every instance, in
+    pre-order.
+
+    Args:
+        file (BinaryIO): The file, opened in binary mode.
+        chunk_size (int, optional): Bytes read at a time. Defaults to 64 KiB.
+        progress (Callable[[int], None] | None, optional):
+            Called with the number of bytes read so far after every chunk.
+
+    Raises:
+        ValueError: The file is not a valid instance tree.
+
+    Yields:
+        Generator[InstanceEvent, None, None]: The events.
+    """
+    buffer = _Buffer(file, chunk_size)
+    # True for a `children` array, False for the keys of an instance. The
+    # document itself behaves like an array holding only the root.
+    contexts: List[bool] = [True]
+    started = False
+    reported = 0
+    while not started or len(contexts) > 1:
+        if progress is not None and buffer.bytes_read != reported:
+            reported = buffer.bytes_read
+            progress(reported)
+        if not buffer.eof and len(buffer.text) - buffer.pos < _LOOKAHEAD:
+            buffer.fill()
+            continue
+        if contexts[-1]:
+            found = buffer.match(_INSTANCE)
+            if found is not None:
+                buffer.pos = found.end()
+                started = True
+                name, class_name, is_leaf = found.groups()
+                yield Event.START, _unescape(name), _unescape(class_name)
+                if is_leaf is None:
+                    contexts.append(False)
+                    contexts.append(True)
+                else:
+                    yield Event.END, None, None
+                continue
+            found = buffer.match(_CLOSE)
+            if found is not None and len(contexts) > 2:
+                buffer.pos = found.end()
+                del contexts[-2:]
+                yield Event.END, None, None
+                continue
+            punctuation = buffer.token()[0]
+            if punctuation == "{":
+                started = True
+                contexts.append(False)
+                yield Event.START, None, None
+            elif punctuation == "]" and len(contexts) > 1:
+                contexts.pop()
+            elif punctuation != ",":
+                raise ValueError(f"Expected an instance at {buffer.pos}.")
+            continue
+        punctuation, key, _ = buffer.token()
+        if punctuation == "}":
+            contexts.pop()
+            yield Event.END, None, None
+            continue
+        if punctuation == ",":
+            continue
+        if key is None or buffer.token()[0] != ":":
+            raise ValueError(f"Expected a key at {buffer.pos}.")
+        value = buffer.token()
+        if key == "children" and value[0] == "[":
+            contexts.append(True)
+        elif key == "name" and value[1] is not None:
+            yield Event.NAME, _unescape(value[1]), None
+        elif key == "class" and value[1] is not None:
+            yield Event.CLASS, None, _unescape(value[1])
+        else:
+            buffer.skip_value(value)
+
+
+def read_events(
+        path: Path,
+        progress: Callable[[int], None] | None = None
+) -> Generator[InstanceEvent, None, None]:
+    """Opens a file and yields its events, see `iter_events`.
+
+    Args:
+        path (Path): The path of the file.
+        progress (Callable[[int], None] | None, optional):
+            Called with the number of bytes read so far.
+
+    Yields:
+        Generator[InstanceEvent, None, None]: The events.
+    """
+    with open(path, "rb") as file:
+        yield from iter_events(file, progress=progress)
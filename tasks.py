@@ -0,0 +1,141 @@
+"""This file implements running work off the Tk thread."""
+from typing import Any, Callable
+from concurrent.futures import ThreadPoolExecutor
+from queue import Queue, Empty
+from tkinter import messagebox
+import tkinter as tk
+
+# Work receives a function to report its progress, from 0 to 1.
+Work = Callable[[Callable[[float], None]], Any]
+
+
+class Task:
+    """A handle to submitted work."""
+    on_done: Callable[[Any], None]
+    on_progress: Callable[[float], None] | None
+    on_error: Callable[[Exception], None] | None
+    cancelled: bool
+
+    def __init__(self, on_done: Callable[[Any], None],
+                 on_progress: Callable[[float], None] | None,
+                 on_error: Callable[[Exception], None] | None) -> None:
+        self.on_done = on_done
+        self.on_progress = on_progress
+        self.on_error = on_error
+        self.cancelled = False
+
+    def cancel(self) -> None:
+        """Drops the result. The work itself still runs to completion."""
+        self.cancelled = True
+
+
+class TaskRunner:
+    """Runs work on worker threads and delivers progress and results back on
+    the Tk thread by polling a queue with `after()`.
+
+    The heavy work is NumPy and networkx code, which releases the GIL for
+    most of its time, so the Tk event loop stays responsive.
+    """
+    __widget: tk.Misc
+    __executor: ThreadPoolExecutor
+    __queue: Queue
+    __interval: int
+    __pending: int
+    __polling: bool
+
+    def __init__(self,
+                 widget: tk.Misc,
+                 workers: int = 1,
+                 interval: int = 50) -> None:
+        """Creates the runner.
+
+        Args:
+            widget (tk.Misc): The widget used to schedule polling.
+            workers (int, optional): The number of worker threads.
+            interval (int, optional): Milliseconds between polls.
+        """
+        self.__widget = widget
+        self.__executor = ThreadPoolExecutor(workers)
+        self.__queue = Queue()
+        self.__interval = interval
+        self.__pending = 0
+        self.__polling = False
+
+    def submit(self,
+               work: Work,
+               on_done: Callable[[Any], None],
+               on_progress: Callable[[float], None] | None = None,
+               on_error: Callable[[Exception], None] | None = None) -> Task:
+        """Runs work on a worker thread.
+
+        Args:
+            work (Work): The work, it must not touch any widget.
+            on_done (Callable[[Any], None]): Called with the result.
+            on_progress (Callable[[float], None] | None, optional):
+                Called with the reported progress.
+            on_error (Callable[[Exception], None] | None, optional):
+                Called if the work raises, shows an error box by default.
+
+        Returns:
+            Task: The task.
+        """
+        task = Task(on_done, on_progress, on_error)
+        queue = self.__queue
+
+        def report(fraction: float) -> None:
+            queue.put((task, "progress", fraction))
+
+        def run() -> None:
+            try:
+                result = work(report)
+            except Exception as error:  # pylint: disable=broad-except
+                queue.put((task, "error", error))
+                return
+            queue.put((task, "done", result))
+
+        self.__executor.submit(run)
+        self.__pending += 1
+        if not self.__polling:
+            self.__polling = True
+            self.__widget.after(self.__interval, self.__poll)
+        return task
+
+    def __poll(self) -> None:
+        """Delivers everything the workers have queued."""
+        try:
+            while True:
+                try:
+                    task, kind, value = self.__queue.get_nowait()
+                except Empty:
+                    break
+                if kind != "progress":
+                    self.__pending -= 1
+                if task.cancelled:
+                    continue
+                if kind == "error":
+                    self.__fail(task, value)
+                    continue
+                try:
+                    if kind == "done":
+                        task.on_done(value)
+                    elif task.on_progress is not None:
+                        task.on_progress(value)
+                except Exception as error:  # pylint: disable=broad-except
+                    self.__fail(task, error)
+        finally:
+            # A raising callback must not stop the delivery of later tasks.
+            if self.__pending:
+                self.__widget.after(self.__interval, self.__poll)
+            else:
+                self.__polling = False
+
+    @staticmethod
+    def __fail(task: Task, error: Exception) -> None:
+        """Reports an error of the work or of its callbacks."""
+        if task.on_error is not None:
+            try:
+                task.on_error(error)
+                return
+            except Exception as handler_error:  # pylint: disable=broad-except
+                error = handler_error
+        messagebox.showerror("Error", str(error))
@@ -0,0 +1,88 @@
+"""Checks `FuzzyIndex` and `LTable` against `process.extractOne`."""
+from typing import List
+from pathlib import Path
+import random
+import unittest
+from rapidfuzz import fuzz, process
+from data import Database
+from predictor import FuzzyIndex, LTable
+
+DATASET = Path(__file__).resolve().parent.parent / "dataset"
+
+
+def closest(query: str, strings: List[str]) -> str:
+    """The string `process.extractOne` picks."""
+    return process.extractOne(query, strings, scorer=fuzz.ratio)[0]
+
+
+def random_strings(rng: random.Random, count: int) -> List[str]:
+    """Short strings over a small alphabet, so many scores tie."""
+    alphabet = "abcde_é😀"
+    return [
+        "".join(rng.choices(alphabet, k=rng.randint(0, 10)))
+        for _ in range(count)
+    ]
+
+
+class FuzzyIndexTest(unittest.TestCase):
+    """The index finds the same string as scoring every string."""
+
+    def assert_same(self, index: FuzzyIndex, strings: List[str],
+                    queries: List[str]) -> None:
+        for query in queries:
+            with self.subTest(query=query):
+                self.assertEqual(index.find(query), closest(query, strings))
+
+    def test_random_strings(self):
+        rng = random.Random(0)
+        strings = random_strings(rng, 500)
+        queries = random_strings(rng, 200) + ["", "x" * 40]
+        # A small alphabet puts most characters in the shared column.
+        for alphabet_size in (2, 4, 64):
+            with self.subTest(alphabet_size=alphabet_size):
+                self.assert_same(FuzzyIndex(strings, alphabet_size), strings,
+                                 queries)
+
+    def test_dataset_names(self):
+        paths = sorted(DATASET.glob("*.json"))
+        if len(paths) < 2:
+            self.skipTest("No data set.")
+        train, test = Database(), Database()
+        train.add_sources(paths[:1], workers=1)
+        test.add_sources(paths[1:2], workers=1)
+        strings = list(dict.fromkeys(name.lower()
+                                     for name in train.name_pool))
+        known = set(strings)
+        queries = sorted({name.lower()
+                          for name in test.name_pool} - known)
+        queries = random.Random(0).sample(queries, min(len(queries), 400))
+        self.assert_same(FuzzyIndex(strings), strings, queries)
+
+    def test_saved_index(self):
+        strings = random_strings(random.Random(1), 300)
+        index = FuzzyIndex(strings)
+        restored = FuzzyIndex.from_arrays(strings, index.to_arrays())
+        self.assert_same(restored, strings,
+                         random_strings(random.Random(2), 100))
+
+    def test_empty(self):
+        self.assertIsNone(FuzzyIndex([]).find("name"))
+
+    def test_table(self):
+        rng = random.Random(3)
+        strings = list(dict.fromkeys(random_strings(rng, 300)))
+        table = {string: f"Class{index}"
+                 for index, string in enumerate(strings)}
+        queries = random_strings(rng, 200) + [strings[0].upper()]
+        expected = [
+            table.get(query.lower()) or table[closest(query.lower(),
+                                                      strings)]
+            for query in queries
+        ]
+        self.assertEqual([LTable(table).find(query) for query in queries],
+                         expected)
+        self.assertEqual(LTable(table).find_many(queries), expected)
+
+
+if __name__ == "__main__":
+    unittest.main()
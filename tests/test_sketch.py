@@ -0,0 +1,104 @@
+"""Checks `QuantileSketch` against exact quantiles and moments."""
+import math
+import unittest
+import numpy as np
+from sketch import QuantileSketch
+
+FRACTIONS = np.linspace(0, 1, 41)
+
+
+def rank_errors(sketch: QuantileSketch, values: np.ndarray) -> np.ndarray:
+    """How far the rank of every sketched quantile is from the exact one,
+    as a fraction of the count."""
+    ordered = np.sort(values)
+    found = np.array(sketch.quantiles(FRACTIONS))
+    # With duplicates a value covers a range of ranks.
+    low = np.searchsorted(ordered, found, side="left")
+    high = np.searchsorted(ordered, found, side="right")
+    wanted = FRACTIONS * len(values)
+    return np.maximum(np.maximum(low - wanted, wanted - high), 0) / len(values)
+
+
+def datasets():
+    """Values with different shapes, including many duplicates."""
+    rng = np.random.default_rng(0)
+    yield "normal", rng.normal(size=200_000)
+    yield "skewed", rng.lognormal(sigma=2, size=200_000)
+    yield "sorted", np.arange(100_000, dtype=np.float64)
+    yield "integers", rng.integers(0, 20, size=100_000).astype(np.float64)
+
+
+class QuantileSketchTest(unittest.TestCase):
+    """The rank error stays within the reported bounds and the accuracy the
+    sketch was made for."""
+
+    def assert_within(self, sketch: QuantileSketch, values: np.ndarray,
+                      accuracy: float) -> None:
+        errors = rank_errors(sketch, values)
+        self.assertLessEqual(errors.max(), sketch.rank_error)
+        self.assertLessEqual(errors.max(), sketch.probable_rank_error())
+        self.assertLessEqual(errors.max(), accuracy)
+        self.assertEqual(len(sketch), len(values))
+
+    def test_stream(self):
+        for accuracy in (0.05, 0.01):
+            for name, values in datasets():
+                with self.subTest(accuracy=accuracy, data=name):
+                    sketch = QuantileSketch.with_accuracy(accuracy)
+                    for chunk in np.array_split(values, 37):
+                        sketch.update(chunk)
+                    self.assert_within(sketch, values, accuracy)
+
+    def test_merged(self):
+        for accuracy in (0.05, 0.01):
+            for name, values in datasets():
+                with self.subTest(accuracy=accuracy, data=name):
+                    sketch = QuantileSketch.with_accuracy(accuracy)
+                    for seed, chunk in enumerate(np.array_split(values, 50)):
+                        part = QuantileSketch.with_accuracy(accuracy, seed)
+                        part.update(chunk)
+                        sketch.merge(part)
+                    self.assert_within(sketch, values, accuracy)
+
+    def test_exact_statistics(self):
+        for name, values in datasets():
+            with self.subTest(data=name):
+                sketch = QuantileSketch.with_accuracy(0.01)
+                halves = np.array_split(values, 2)
+                sketch.update(halves[0])
+                other = QuantileSketch.with_accuracy(0.01, 1)
+                other.update(halves[1])
+                sketch.merge(other)
+                self.assertEqual(sketch.min, values.min())
+                self.assertEqual(sketch.max, values.max())
+                self.assertTrue(math.isclose(sketch.mean, values.mean(),
+                                             rel_tol=1e-9, abs_tol=1e-9))
+                self.assertTrue(math.isclose(sketch.stdev, values.std(ddof=1),
+                                             rel_tol=1e-9))
+                self.assertEqual(sketch.quantiles((0, 1)),
+                                 [values.min(), values.max()])
+
+    def test_small(self):
+        values = np.array([3.0, 1.0, 2.0])
+        sketch = QuantileSketch()
+        sketch.update(values)
+        self.assertEqual(sketch.rank_error, 0)
+        self.assertEqual(sketch.quantiles((0, 0.5, 1)), [1.0, 2.0, 3.0])
+
+    def test_empty(self):
+        sketch = QuantileSketch()
+        self.assertEqual(len(sketch), 0)
+        self.assertTrue(math.isnan(sketch.mean))
+        self.assertTrue(math.isnan(sketch.quantiles((0.5, ))[0]))
+        sketch.merge(QuantileSketch())
+        self.assertEqual(sketch.rank_error, 0)
+
+    def test_invalid(self):
+        with self.assertRaises(ValueError):
+            QuantileSketch(1)
+        with self.assertRaises(ValueError):
+            QuantileSketch.with_accuracy(0)
+
+
+if __name__ == "__main__":
+    unittest.main()
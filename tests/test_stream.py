@@ -0,0 +1,126 @@
+"""Checks the incremental reader against `json.load`."""
+from typing import Any, Dict, List
+from pathlib import Path
+import io
+import json
+import random
+import unittest
+from stream import Event, iter_events
+
+DATASET = Path(__file__).resolve().parent.parent / "dataset"
+# Escapes, multi-byte characters split across chunks and JSON punctuation.
+CHARACTERS = ['a', 'Z', '0', ' ', '"', '\\', '/', '\n', '\t', '{', '}', '[',
+              ']', ',', ':', 'é', 'ß', '中', '😀', ' ']
+
+
+def reference(instance: Dict[str, Any]) -> Dict[str, Any]:
+    """Keeps the fields of an instance the reader reports."""
+    return {
+        "name": instance.get("name"),
+        "class": instance.get("class"),
+        "children": [reference(child)
+                     for child in instance.get("children") or []]
+    }
+
+
+def read(data: bytes, chunk_size: int) -> Dict[str, Any]:
+    """Rebuilds the tree from the events of the reader."""
+    stack: List[Dict[str, Any]] = [{"children": []}]
+    for event, name, class_name in iter_events(io.BytesIO(data), chunk_size):
+        if event == Event.START:
+            stack.append({"name": name, "class": class_name, "children": []})
+        elif event == Event.NAME:
+            stack[-1]["name"] = name
+        elif event == Event.CLASS:
+            stack[-1]["class"] = class_name
+        else:
+            instance = stack.pop()
+            stack[-1]["children"].append(instance)
+    return stack[0]["children"][0]
+
+
+def random_instance(rng: random.Random, depth: int = 0) -> Dict[str, Any]:
+    """Makes a random instance, with its keys in any order and extra keys."""
+    fields: List[tuple] = [
+        ("name", "".join(rng.choices(CHARACTERS, k=rng.randint(0, 12)))),
+        ("class", "".join(rng.choices(CHARACTERS, k=rng.randint(1, 8)))),
+    ]
+    if depth < 4 and rng.random() < 0.7:
+        fields.append(("children", [
+            random_instance(rng, depth + 1)
+            for _ in range(rng.randint(0, 4))
+        ]))
+    if rng.random() < 0.3:
+        fields.append(("properties", {
+            "list": [1, -2.5e3, None, True, {"text": "]}\\\","}],
+            "empty": {},
+        }))
+    if rng.random() < 0.5:
+        rng.shuffle(fields)
+    return dict(fields)
+
+
+class StreamTest(unittest.TestCase):
+    """The reader gives the same tree as `json.load`."""
+
+    def assert_same(self, document: Dict[str, Any], data: bytes,
+                    chunk_sizes: List[int]) -> None:
+        expected = reference(document)
+        for chunk_size in chunk_sizes:
+            with self.subTest(chunk_size=chunk_size):
+                self.assertEqual(read(data, chunk_size), expected)
+
+    def test_random_documents(self):
+        rng = random.Random(0)
+        for seed in range(200):
+            document = random_instance(random.Random(seed))
+            data = json.dumps(document,
+                              ensure_ascii=rng.random() < 0.5,
+                              indent=rng.choice([None, 1, 4]),
+                              separators=rng.choice([None, (",", ":")
+                                                     ])).encode("utf-8")
+            self.assert_same(document, data, [1, 2, 3, 7, 64, 1 << 16])
+
+    def test_dumper_layout(self):
+        document = {
+            "name": "Game",
+            "class": "DataModel",
+            "children": [{
+                "name": "a\"b\\cé😀",
+                "class": "Part"
+            }, {
+                "name": "Empty",
+                "class": "Folder",
+                "children": []
+            }]
+        }
+        for ensure_ascii in (True, False):
+            data = json.dumps(document,
+                              ensure_ascii=ensure_ascii,
+                              separators=(",", ":")).encode("utf-8")
+            self.assert_same(document, data, [1, 5, 4096])
+
+    def test_dataset(self):
+        path = next(iter(sorted(DATASET.glob("*.json"))), None)
+        if path is None:
+            self.skipTest("No data set.")
+        data = path.read_bytes()
+        self.assert_same(json.loads(data), data, [1000, 1 << 16])
+
+    def test_invalid(self):
+        for data in (b'[1]', b'{"name": "a", "class": "b", "children": [1]}'):
+            with self.subTest(data=data):
+                with self.assertRaises(ValueError):
+                    read(data, 16)
+
+    def test_progress(self):
+        data = json.dumps(random_instance(random.Random(1))).encode("utf-8")
+        reported: List[int] = []
+        for _ in iter_events(io.BytesIO(data), 16, reported.append):
+            pass
+        self.assertEqual(reported, sorted(reported))
+        self.assertEqual(reported[-1], len(data))
+
+
+if __name__ == "__main__":
+    unittest.main()
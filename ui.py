@@ -1,50 +1,102 @@
 """This file implements the UI.
 """
-from typing import Callable
+from typing import Callable, Dict, Hashable, List, Tuple
 from pathlib import Path
-from itertools import chain
 from enum import Enum
+from functools import partial
 from collections import Counter
-from statistics import mean, mode, quantiles, stdev, correlation
 import tkinter as tk
 from tkinter import ttk
 import numpy as np
-import networkx as nwx
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
 from matplotlib.figure import Figure
+from matplotlib.collections import LineCollection
+from matplotlib.colors import LogNorm
 import customtkinter
 from chart import SimpleChartWidget, ChartType, ChartKey
-from data import Database, CompiledData
-from graph import make_edges
+from data import Database, CompiledData, CompiledDataCache, DataSource, StringPool
+from graph import SparseGraph, build_graph, level_of_detail
+from layout import LayoutEngine, compute_layout
+from cache import SnapshotCache
+from query import Aggregation, Filter, combine_filters, filters_key
+from tasks import Task, TaskRunner
+from sketch import QuantileSketch
 import predictor
 
+# Above this many instances, quartiles come from quantile sketches instead of
+# every value, with this rank error.
+SKETCH_INSTANCES = 5_000_000
+SKETCH_ACCURACY = 0.001
+
 
 class MainForm(customtkinter.CTk):
     """The main form of the application."""
     loading_overlay: customtkinter.CTkFrame
+    progress_bar: customtkinter.CTkProgressBar
+    loading_label: customtkinter.CTkLabel
+    tasks: TaskRunner
+    loaders: Dict[Hashable, float | None]
 
     def __init__(self) -> None:
         super().__init__()
         self.title("Project")
+        self.loaders = {}
+        self.tasks = TaskRunner(self)
         self.init_components()
 
-    def load_all_dataset(self) -> Database:
-        """Loads all data sets into memory."""
-        db = Database()
-        for file in Path("./dataset/").iterdir():
-            if not file.is_file():
-                continue
-            db.add_source(file)
-            self.update()
-            # break  # Remove when done debugging
+    @staticmethod
+    def load_all_dataset(progress: Callable[[float], None]) -> Database:
+        """Loads all data sets into memory, this runs off the Tk thread.
+
+        Args:
+            progress (Callable[[float], None]): Reports the fraction loaded.
+        """
+        db = Database(SnapshotCache())
+        files = [file for file in Path("./dataset/").iterdir() if file.is_file()]
+        total = sum(file.stat().st_size for file in files) or 1
+        db.add_sources(files,
+                       progress=lambda bytes_read: progress(bytes_read / total))
         return db
 
-    def loading(self, is_loading: bool) -> None:
-        """Shows/Hides loading overlay."""
+    def loading(self,
+                is_loading: bool,
+                progress: float | None = None,
+                owner: Hashable = None) -> None:
+        """Shows/Hides loading overlay.
+
+        The overlay stays until every owner has finished loading.
+
+        Args:
+            is_loading (bool): Whether the owner is loading.
+            progress (float | None, optional): The fraction of work done,
+                the progress bar is indeterminate when no owner gives one.
+            owner (Hashable, optional): Who is loading, each tab reports
+                its own work.
+        """
         if is_loading:
-            self.loading_overlay.grid(row=0, column=0, sticky=tk.NSEW)
+            self.loaders[owner] = progress
+        else:
+            self.loaders.pop(owner, None)
+        if not self.loaders:
+            self.progress_bar.stop()
+            self.loading_overlay.grid_forget()
+            return
+        self.loading_overlay.grid(row=0, column=0, sticky=tk.NSEW)
+        fractions = [
+            fraction for fraction in self.loaders.values()
+            if fraction is not None
+        ]
+        if not fractions:
+            self.progress_bar.configure(mode="indeterminate")
+            self.progress_bar.start()
+            self.loading_label.configure(text="Please wait...")
             return
-        self.loading_overlay.grid_forget()
+        # Owners that have not reported progress yet count as not started.
+        progress = sum(fractions) / len(self.loaders)
+        self.progress_bar.stop()
+        self.progress_bar.configure(mode="determinate")
+        self.progress_bar.set(progress)
+        self.loading_label.configure(text=f"Loading... {progress:.0%}")
 
     def init_components(self) -> None:
         """Initialize each componenents."""
@@ -64,24 +116,32 @@ class MainForm(customtkinter.CTk):
         loading_overlay.rowconfigure(1, weight=100)
         loading_overlay.columnconfigure("all", weight=1)
         self.loading_overlay = loading_overlay
+        self.progress_bar = progress_bar
+        self.loading_label = loading_label
         for tab_name in ("Chart", "Storytelling", "Graph", "Tree"):
             tab_view.add(tab_name)
         tab_view.set("Chart")
-        self.after(250, self.delayed_load, tab_view)
+        self.tasks.submit(self.load_all_dataset,
+                          lambda database: self.on_loaded(tab_view, database),
+                          lambda fraction: self.loading(True, fraction))
         self.rowconfigure("all", weight=1)
         self.columnconfigure("all", weight=1)
 
-    def delayed_load(self, tab_view: customtkinter.CTkTabview) -> None:
-        """Delayed load so something shows up first."""
-        database = self.load_all_dataset()
-        chart_tab = ChartTab(self.loading, tab_view.tab("Chart"), database)
+    def on_loaded(self, tab_view: customtkinter.CTkTabview,
+                  database: Database) -> None:
+        """Creates the tabs once the data sets are loaded."""
+        self.loading(True)
+        chart_tab = ChartTab(partial(self.loading, owner=ChartTab),
+                             tab_view.tab("Chart"), database)
         chart_tab.pack(expand=True, fill=tk.BOTH)
-        storytelling_tab = StoryTellingTab(self.loading,
-                                           tab_view.tab("Storytelling"),
-                                           database)
+        storytelling_tab = StoryTellingTab(
+            partial(self.loading, owner=StoryTellingTab),
+            tab_view.tab("Storytelling"), database)
         storytelling_tab.pack(expand=True, fill=tk.BOTH)
-        GraphTab(tab_view.tab("Graph"), database)
+        GraphTab(partial(self.loading, owner=GraphTab), tab_view.tab("Graph"),
+                 database)
         TreeTab(tab_view.tab("Tree"), database)
+        # The tabs have started their own work, which keeps the overlay.
         self.loading(False)
 
     def show(self) -> None:
@@ -93,14 +153,14 @@ class TreeTab(customtkinter.CTkFrame):
     """Tree tab
     """
     db: Database
-    k_graph: predictor.Vertex
-    table: predictor.LTable
+    tree_predictor: predictor.TreePredictor | None
+    tasks: TaskRunner
     popup_menu: tk.Menu
     tree: ttk.Treeview
 
     def __init__(self, parent, database, **kwargs) -> None:
         self.db = database
-        self.k_graph, self.table = predictor.initialize(database)
+        self.tree_predictor = None
         style = ttk.Style()
         style.configure("Treeview.Heading", font=(None, 16))
         style.configure("Treeview",
@@ -108,7 +168,31 @@ class TreeTab(customtkinter.CTkFrame):
                         bd=0,
                         font=(None, 16))  # Modify the font of the body
         super().__init__(parent, **kwargs)
+        self.tasks = TaskRunner(self)
         self.init_components()
+        self.tasks.submit(
+            lambda _: predictor.load_or_initialize(database),
+            self.on_model_loaded)
+
+    def on_model_loaded(self, model) -> None:
+        """Predicts the nodes added while the model was loading."""
+        self.tree_predictor = predictor.TreePredictor(*model)
+        items: list[str] = []
+        parents: list[str | None] = []
+        walk: list[tuple[str, str | None]] = [(self.tree.get_children()[0],
+                                                None)]
+        while walk:
+            item, parent = walk.pop()
+            items.append(item)
+            parents.append(parent)
+            walk.extend((child, item)
+                        for child in reversed(self.tree.get_children(item)))
+        predictions = self.tree_predictor.add_many(
+            items, parents,
+            (str(self.tree.item(item, "text")) for item in items))
+        # The root is the DataModel itself.
+        for item, prediction in zip(items[1:], predictions[1:]):
+            self.tree.set(item, "class", prediction)
 
     def init_components(self) -> None:
         """Initializes the components."""
@@ -130,13 +214,19 @@ class TreeTab(customtkinter.CTkFrame):
         self.tree = tree
 
     def add_node(self):
-        """Add a node."""
-        self.tree.insert(parent=self.tree.selection()[0],
-                         index=tk.END,
-                         text=tk.simpledialog.askstring(
-                             "Input Name", "Input the name of the new node: "),
-                         values=("!PREDICTME", ))
-        predictor.predict_tree(self.k_graph, self.table, self.tree)
+        """Add a node, predicting only the new node."""
+        parent = self.tree.selection()[0]
+        name = tk.simpledialog.askstring("Input Name",
+                                         "Input the name of the new node: ")
+        if name is None:
+            return
+        item = self.tree.insert(parent=parent,
+                                index=tk.END,
+                                text=name,
+                                values=("!PREDICTME", ))
+        if self.tree_predictor is not None:
+            self.tree.set(item, "class",
+                          self.tree_predictor.add(item, parent, name))
 
     def remove_node(self):
         """Removes a node."""
@@ -146,7 +236,15 @@ class TreeTab(customtkinter.CTkFrame):
             tk.messagebox.showerror("Attempt to delete root",
                                     "You cannot delete root!")
             return
+        removed: list[str] = []
+        walk = list(self.tree.selection())
+        while walk:
+            item = walk.pop()
+            removed.append(item)
+            walk.extend(self.tree.get_children(item))
         self.tree.delete(self.tree.selection())
+        if self.tree_predictor is not None:
+            self.tree_predictor.remove(removed)
 
     def popup(self, event):
         """On right-click."""
@@ -168,84 +266,272 @@ class GraphType(Enum):
     MERGED = "Merged Tree"
 
 
+class NodeRank(Enum):
+    """How the graph tab picks the nodes to draw."""
+    FREQUENCY = "Most Frequent"
+    DEGREE = "Most Connected"
+
+
 class GraphTab(customtkinter.CTkFrame):
     """Graph tab
     """
     db: Database
+    loading: Callable
+    tasks: TaskRunner
+    task: Task | None
+    graph: SparseGraph | None
+    positions: np.ndarray | None
+    view: Tuple[float, float, float, float] | None
+    # Built graphs and their layouts, by graph type, layout and the
+    # generation of the database they were built from.
+    layouts: Dict[Tuple[GraphType, LayoutEngine, int], Tuple[SparseGraph,
+                                                              np.ndarray]]
     figure: Figure
     graph_widget: FigureCanvasTkAgg
     graph_type_combobox: customtkinter.CTkComboBox
+    layout_combobox: customtkinter.CTkComboBox
+    rank_combobox: customtkinter.CTkComboBox
+    # Seconds the iterative layouts may take before drawing what they have.
+    LAYOUT_BUDGET = 10.0
+    # The most nodes drawn, the rest are collapsed by class name.
+    DETAIL_LIMIT = 500
+    LABEL_LIMIT = 20
 
-    def __init__(self, parent, database, **kwargs):
+    def __init__(self, loading, parent, database, **kwargs):
         self.db = database
+        self.loading = loading
+        self.task = None
+        self.graph = None
+        self.positions = None
+        self.view = None
+        self.layouts = {}
         super().__init__(parent, **kwargs)
+        self.tasks = TaskRunner(self)
         self.init_components()
 
     def render(self, *_):
         """Renders the graph."""
         graph_type = GraphType(self.graph_type_combobox.get())
-        if graph_type != GraphType.CLASSNAMECLASSNAME:
+        engine = LayoutEngine(self.layout_combobox.get())
+        key = (graph_type, engine, self.db.generation)
+        # Only Kamada-Kawai stores every pairwise distance. A running build
+        # is kept until the user accepts, it still owns the loading overlay.
+        if (key not in self.layouts and engine == LayoutEngine.KAMADA_KAWAI
+                and graph_type != GraphType.CLASSNAMECLASSNAME):
             if not tk.messagebox.askokcancel(
                     "Warning",
                     "The following operation requires a lot of system memory.\n"
                     "Are you sure you want to continue?"):
-                self.graph_type_combobox.set(GraphType.CLASSNAMECLASSNAME.value)
+                self.layout_combobox.set(LayoutEngine.AUTOMATIC.value)
+                self.render()
                 return
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+        if key in self.layouts:
+            self.draw_graph(self.layouts[key])
+            return
+        self.loading(True)
+        self.task = self.tasks.submit(
+            lambda progress: self.load_or_build_graph(graph_type, engine,
+                                                      progress),
+            lambda result: self.on_built(key, result),
+            lambda fraction: self.loading(True, fraction),
+            on_error=self.on_error)
+
+    def on_built(self, key: Tuple[GraphType, LayoutEngine, int],
+                 result: Tuple[SparseGraph, np.ndarray]) -> None:
+        """Fired when a graph and its layout are ready."""
+        self.layouts[key] = result
+        self.draw_graph(result)
+
+    def on_error(self, error: Exception) -> None:
+        """Fired when building the graph fails."""
+        self.loading(False)
+        tk.messagebox.showerror("Error", str(error))
+
+    def sparse_graph(self, graph_type: GraphType) -> SparseGraph:
+        """Builds a graph with integer node ids, nodes are grouped by their
+        most common class name.
+
+        Args:
+            graph_type (GraphType): The graph to build.
+
+        Returns:
+            SparseGraph: The graph.
+        """
+        class_pool, name_pool = self.db.class_pool, self.db.name_pool
+        classes = lambda source: source.class_ids
+        names = lambda source: source.name_ids
+
+        def build(edges, label: Callable[[int], str]) -> SparseGraph:
+            return build_graph(self.db.sources, edges, label, classes,
+                               class_pool.__getitem__)
+
+        if graph_type == GraphType.CLASSNAMECLASSNAME:
+            return build([(classes, classes)], class_pool.__getitem__)
+        if graph_type == GraphType.NAMENAME:
+            return build([(names, names)], name_pool.__getitem__)
+        if graph_type == GraphType.CLASSNAMENAME:
+            # A name and a class name that are equal are the same node.
+            labels = StringPool()
+            class_map = np.fromiter(map(labels.intern, class_pool),
+                                    dtype=np.int64,
+                                    count=len(class_pool))
+            name_map = np.fromiter(map(labels.intern, name_pool),
+                                   dtype=np.int64,
+                                   count=len(name_pool))
+            class_labels = lambda source: class_map[source.class_ids]
+            name_labels = lambda source: name_map[source.name_ids]
+            return build([(class_labels, name_labels),
+                          (name_labels, class_labels)], labels.__getitem__)
+        # Merged keys pair the ids, labels are only made for unique pairs.
+        pairs = lambda source: (source.class_ids.astype(np.int64) * len(
+            name_pool) + source.name_ids)
+
+        def pair_label(key: int) -> str:
+            class_id, name_id = divmod(key, len(name_pool))
+            return f"{class_pool[class_id]}:{name_pool[name_id]}"
+
+        return build([(pairs, pairs)], pair_label)
+
+    def build_graph(
+            self, graph_type: GraphType, engine: LayoutEngine,
+            progress: Callable[[float],
+                               None]) -> Tuple[SparseGraph, np.ndarray]:
+        """Builds the graph and its layout, this runs off the Tk thread.
+
+        Args:
+            graph_type (GraphType): The graph to build.
+            engine (LayoutEngine): The layout to use.
+            progress (Callable[[float], None]): Reports the fraction done.
+
+        Returns:
+            Tuple[SparseGraph, np.ndarray]: The graph and the node positions.
+        """
+        sparse_graph = self.sparse_graph(graph_type)
+        positions = compute_layout(engine,
+                                   sparse_graph.adjacency(),
+                                   budget=self.LAYOUT_BUDGET,
+                                   progress=progress)
+        return sparse_graph, positions
+
+    def load_or_build_graph(
+            self, graph_type: GraphType, engine: LayoutEngine,
+            progress: Callable[[float],
+                               None]) -> Tuple[SparseGraph, np.ndarray]:
+        """Same as `build_graph`, but reuses the result cached for the same
+        source files if the database has a cache.
+
+        Args:
+            graph_type (GraphType): The graph to build.
+            engine (LayoutEngine): The layout to use.
+            progress (Callable[[float], None]): Reports the fraction done.
+
+        Returns:
+            Tuple[SparseGraph, np.ndarray]: The graph and the node positions.
+        """
+        snapshots = self.db.cache
+        if snapshots is None:
+            return self.build_graph(graph_type, engine, progress)
+        kind = f"graph-{graph_type.name.lower()}-{engine.name.lower()}"
+        paths = [source.source_path for source in self.db.sources]
+        entry = snapshots.load(kind, paths)
+        if entry is not None:
+            return SparseGraph.from_arrays(entry), entry["positions"]
+        sparse_graph, positions = self.build_graph(graph_type, engine,
+                                                   progress)
+        snapshots.save(kind, paths, {
+            **sparse_graph.to_arrays(), "positions": positions
+        })
+        return sparse_graph, positions
+
+    def draw_graph(self, result: Tuple[SparseGraph, np.ndarray]) -> None:
+        """Draws a built graph."""
+        self.graph, self.positions = result
+        self.view = None
+        self.draw_detail()
+        self.loading(False)
+
+    def draw_detail(self, *_) -> None:
+        """Draws the most important nodes within the view, the others are
+        collapsed into a node per class name."""
+        if self.graph is None:
+            return
+        rank = (self.graph.counts
+                if NodeRank(self.rank_combobox.get()) == NodeRank.FREQUENCY
+                else self.graph.degrees())
+        detail = level_of_detail(self.graph,
+                                 self.positions,
+                                 rank,
+                                 limit=self.DETAIL_LIMIT,
+                                 view=self.view)
+        graph, positions = detail.graph, detail.positions
         self.figure.clear()
         ax = self.figure.add_subplot(111)
-        graph = nwx.DiGraph()
-        if graph_type == GraphType.CLASSNAMECLASSNAME:
-            graph.add_nodes_from(
-                set(
-                    map(
-                        lambda val: val.class_name,
-                        chain(*map(lambda source: source.everything(),
-                                   self.db.sources)))))
-            make_edges(graph, self.db.sources, lambda u, v:
-                       (u.class_name, v.class_name))
-        elif graph_type == GraphType.NAMENAME:
-            graph.add_nodes_from(
-                set(
-                    map(
-                        lambda val: val.name,
-                        chain(*map(lambda source: source.everything(),
-                                   self.db.sources)))))
-            make_edges(graph, self.db.sources, lambda u, v: (u.name, v.name))
-        elif graph_type == GraphType.CLASSNAMENAME:
-            graph.add_nodes_from(
-                set(
-                    map(
-                        lambda val: val.name,
-                        chain(*map(lambda source: source.everything(),
-                                   self.db.sources)))))
-            graph.add_nodes_from(
-                set(
-                    map(
-                        lambda val: val.class_name,
-                        chain(*map(lambda source: source.everything(),
-                                   self.db.sources)))))
-            make_edges(graph, self.db.sources, lambda u, v:
-                       (u.class_name, v.name))
-            make_edges(graph, self.db.sources, lambda u, v:
-                       (u.name, v.class_name))
-        elif graph_type == GraphType.MERGED:
-            graph.add_nodes_from(
-                set(
-                    map(
-                        lambda val: val.class_name + ':' + val.name,
-                        chain(*map(lambda source: source.everything(),
-                                   self.db.sources)))))
-            make_edges(
-                graph, self.db.sources, lambda u, v:
-                (u.class_name + ':' + u.name, v.class_name + ':' + v.name))
-        layout = nwx.kamada_kawai_layout(graph, scale=2)
-        nwx.draw_networkx_nodes(graph,
-                                layout,
-                                node_color='steelblue',
-                                node_size=300,
-                                ax=ax)
-        nwx.draw_networkx_edges(graph, layout, edge_color='gray', ax=ax)
-        self.graph_widget.draw()
+        ax.tick_params(bottom=False,
+                       left=False,
+                       labelbottom=False,
+                       labelleft=False)
+        # One collection for every edge, heavier edges are thicker.
+        loops = graph.tails == graph.heads
+        ax.add_collection(
+            LineCollection(positions[np.column_stack(
+                [graph.tails[~loops], graph.heads[~loops]])],
+                           colors="gray",
+                           linewidths=0.3 +
+                           0.5 * np.log1p(graph.weights[~loops]),
+                           alpha=0.5,
+                           zorder=1))
+        sizes = 300 * np.sqrt(graph.counts / max(graph.counts.max(
+            initial=0), 1)) + 10
+        # A node with a loop gets a ring around it.
+        ax.scatter(positions[graph.tails[loops], 0],
+                   positions[graph.tails[loops], 1],
+                   s=sizes[graph.tails[loops]] * 2,
+                   facecolors="none",
+                   edgecolors="gray",
+                   linewidths=0.3 + 0.5 * np.log1p(graph.weights[loops]),
+                   alpha=0.5,
+                   zorder=1)
+        ax.scatter(positions[:, 0],
+                   positions[:, 1],
+                   s=sizes,
+                   c=np.where(detail.collapsed, "darkorange", "steelblue"),
+                   zorder=2)
+        for node in np.argsort(-graph.counts,
+                               kind="stable")[:self.LABEL_LIMIT].tolist():
+            ax.annotate(graph.labels[node],
+                        positions[node],
+                        fontsize=7,
+                        ha="center",
+                        zorder=3)
+        if self.view is None:
+            ax.autoscale()
+        else:
+            left, right, bottom, top = self.view
+            ax.set_xlim(left, right)
+            ax.set_ylim(bottom, top)
+        self.graph_widget.draw_idle()
+
+    def on_scroll(self, event) -> None:
+        """Zooms around the cursor and draws the nodes that are now visible.
+        """
+        if self.graph is None or event.inaxes is None:
+            return
+        scale = 0.8 if event.button == "up" else 1.25
+        left, right = event.inaxes.get_xlim()
+        bottom, top = event.inaxes.get_ylim()
+        x, y = event.xdata, event.ydata
+        view = (x - (x - left) * scale, x + (right - x) * scale,
+                y - (y - bottom) * scale, y + (top - y) * scale)
+        low, high = self.positions.min(axis=0), self.positions.max(axis=0)
+        # Zoomed out past the whole graph.
+        if (view[0] <= low[0] and view[1] >= high[0] and view[2] <= low[1]
+                and view[3] >= high[1]):
+            view = None
+        self.view = view
+        self.draw_detail()
 
     def init_components(self):
         """Initializes the components."""
@@ -253,6 +539,7 @@ class GraphTab(customtkinter.CTkFrame):
         self.figure = figure
         graph_widget = FigureCanvasTkAgg(figure, master=self)
         graph_widget.get_tk_widget().grid(column=0, row=0, sticky="nsew")
+        graph_widget.mpl_connect("scroll_event", self.on_scroll)
         self.graph_widget = graph_widget
         label = customtkinter.CTkLabel(self)
         label.configure(text='Graph Type')
@@ -264,10 +551,34 @@ class GraphTab(customtkinter.CTkFrame):
         graph_type_combobox.set("ClassName-ClassName")
         graph_type_combobox.grid(column=0, row=2, sticky="ew")
         self.graph_type_combobox = graph_type_combobox
+        label = customtkinter.CTkLabel(self)
+        label.configure(text='Layout')
+        label.grid(column=0, row=3, sticky="ew")
+        layout_combobox = customtkinter.CTkComboBox(
+            self,
+            values=[enum.value for enum in LayoutEngine],
+            command=self.render)
+        layout_combobox.set(LayoutEngine.AUTOMATIC.value)
+        layout_combobox.grid(column=0, row=4, sticky="ew")
+        self.layout_combobox = layout_combobox
+        label = customtkinter.CTkLabel(self)
+        label.configure(text='Show Nodes')
+        label.grid(column=0, row=5, sticky="ew")
+        rank_combobox = customtkinter.CTkComboBox(
+            self,
+            values=[enum.value for enum in NodeRank],
+            command=self.draw_detail)
+        rank_combobox.set(NodeRank.FREQUENCY.value)
+        rank_combobox.grid(column=0, row=6, sticky="ew")
+        self.rank_combobox = rank_combobox
         self.pack(side="top", expand=True, fill=tk.BOTH)
         self.rowconfigure(0, weight=100)
         self.rowconfigure(1, weight=1)
         self.rowconfigure(2, minsize=20, weight=1)
+        self.rowconfigure(3, weight=1)
+        self.rowconfigure(4, minsize=20, weight=1)
+        self.rowconfigure(5, weight=1)
+        self.rowconfigure(6, minsize=20, weight=1)
         self.columnconfigure(0, minsize=20, weight=1)
         self.render()
 
@@ -278,6 +589,8 @@ class StoryingTellingChartType(Enum):
     PIE = "Same Name and Class Name Pie Chart"
     BOXPLOT = "Box plot of name lengths"
     SCATTER = "Scatter Plot"
+    DENSITY = "Density Plot"
+    WEIGHTED_SCATTER = "Weighted Scatter Plot"
 
 
 class StoryTellingTab(customtkinter.CTkFrame):
@@ -285,6 +598,8 @@ class StoryTellingTab(customtkinter.CTkFrame):
     """
     db: Database
     loading: Callable
+    tasks: TaskRunner
+    task: Task | None
     figure: Figure
     chart_widget: FigureCanvasTkAgg
     chart_combobox: customtkinter.CTkComboBox
@@ -293,89 +608,113 @@ class StoryTellingTab(customtkinter.CTkFrame):
     left_mean_label: customtkinter.CTkLabel
     right_mean_label: customtkinter.CTkLabel
     coor_label: customtkinter.CTkLabel
+    # The most points the scatter plot draws, more are sampled down.
+    SCATTER_LIMIT = 20000
 
     def __init__(self, loading, parent, database, **kwargs):
         self.db = database
         self.loading = loading
+        self.task = None
         super().__init__(parent, **kwargs)
+        self.tasks = TaskRunner(self)
         self.init_components()
 
     def render(self, *_):
         """Render everything."""
         self.loading(True)
-        self.update()
-        counter = tk.IntVar(value=0)
-
-        # GIL messing the shit up freezing it anyways, gotta do this dirty shit.
-        def pre_up(counter=counter):
-            val = counter.get()
-            counter.set(counter.get() + 1)
-            if val % 20000 == 0:
-                self.update()
-
-        proc_map = {
-            "Name Length":
-            lambda val: pre_up() or len(val.name),
-            "Class Name Length":
-            lambda val: pre_up() or len(val.class_name),
-            "Depth":
-            lambda val: pre_up() or val.depth(),
-            "Number of Children":
-            lambda val: pre_up() or (len(val.children) if val.children else 0),
+        attributes = {
+            "Name Length": DataSource.name_lengths,
+            "Class Name Length": DataSource.class_name_lengths,
+            "Depth": lambda source: source.depths,
+            "Number of Children": lambda source: source.child_counts,
+        }
+        chart_type = StoryingTellingChartType(self.chart_combobox.get())
+        aggregation = Aggregation(self.db.sources)
+        aggregation.column("left", attributes[self.left_desc.get()])
+        aggregation.column("right", attributes[self.right_desc.get()])
+        aggregation.column("class", lambda source: source.class_ids)
+        aggregation.column("depth", lambda source: source.depths)
+        aggregation.column("same_name", DataSource.same_names)
+        aggregation.column("name_length", DataSource.name_lengths)
+        if sum(map(len, self.db.sources)) > SKETCH_INSTANCES:
+            left_key = aggregation.sketch("left", SKETCH_ACCURACY)
+            right_key = aggregation.sketch("right", SKETCH_ACCURACY)
+        else:
+            left_key = aggregation.summary("left")
+            right_key = aggregation.summary("right")
+        correlation_key = aggregation.correlation("left", "right")
+        chart_keys = {
+            StoryingTellingChartType.STACKED:
+            lambda: aggregation.group_counts("class", "depth"),
+            StoryingTellingChartType.SCATTER:
+            lambda: aggregation.sample("left", "right",
+                                       size=self.SCATTER_LIMIT),
+            StoryingTellingChartType.DENSITY:
+            lambda: aggregation.histogram2d("left", "right"),
+            StoryingTellingChartType.WEIGHTED_SCATTER:
+            lambda: aggregation.weighted_values("left", "right"),
+            StoryingTellingChartType.PIE:
+            lambda: aggregation.group_counts("same_name"),
+            StoryingTellingChartType.BOXPLOT:
+            lambda: aggregation.values("name_length"),
         }
-        left_proc = proc_map[self.left_desc.get()]
-        right_proc = proc_map[self.right_desc.get()]
-        # Convert to list so we can use it multiple times.
-        # idc if we use more memory, let the os handle that shit.
-        # It's better than having to process all the data again.
-        left_data = list(
-            map(
-                left_proc,
-                chain(*map(lambda source: source.everything(),
-                           self.db.sources))))
-        right_data = list(
-            map(
-                right_proc,
-                chain(*map(lambda source: source.everything(),
-                           self.db.sources))))
-        quantile = quantiles(left_data)
-        self.left_mean_label.configure(
-            text=f"Mean: {mean(left_data)}\n"
-            f"Median: {quantile[1]}\n"
-            f"Mode: {mode(left_data)}\n"
-            f"First quantile: {quantile[0]}\n"
-            f"Third quantile: {quantile[2]}\n"
-            f"Standard Deviation: {stdev(left_data)}")
-        quantile = quantiles(right_data)
-        self.right_mean_label.configure(
-            text=f"Mean: {mean(right_data)}\n"
-            f"Median: {quantile[1]}\n"
-            f"Mode: {mode(right_data)}\n"
-            f"First quantile: {quantile[0]}\n"
-            f"Third quantile: {quantile[2]}\n"
-            f"Standard Deviation: {stdev(right_data)}")
+        chart_key = chart_keys[chart_type]()
+        if self.task is not None:
+            self.task.cancel()
+        self.task = self.tasks.submit(
+            aggregation.run,
+            lambda results: self.show_results(chart_type, results, left_key,
+                                              right_key, correlation_key,
+                                              chart_key),
+            lambda fraction: self.loading(True, fraction), self.on_error)
+
+    def on_error(self, error: Exception) -> None:
+        """Fired when the aggregation fails."""
+        self.loading(False)
+        tk.messagebox.showerror("Error", str(error))
+
+    def show_results(self, chart_type: StoryingTellingChartType, results,
+                     left_key, right_key, correlation_key, chart_key) -> None:
+        """Shows the computed aggregates."""
+        for label, summary in ((self.left_mean_label, results[left_key]),
+                               (self.right_mean_label, results[right_key])):
+            if isinstance(summary, QuantileSketch):
+                first, median, third = summary.quantiles((0.25, 0.5, 0.75))
+                label.configure(
+                    text=f"Mean: {summary.mean}\n"
+                    f"Median: {median}\n"
+                    f"First quantile: {first}\n"
+                    f"Third quantile: {third}\n"
+                    f"Standard Deviation: {summary.stdev}\n"
+                    f"Quantile rank error: "
+                    f"±{summary.probable_rank_error():.2%}")
+                continue
+            label.configure(text=f"Mean: {summary.mean}\n"
+                            f"Median: {summary.median}\n"
+                            f"Mode: {summary.mode}\n"
+                            f"First quantile: {summary.first_quartile}\n"
+                            f"Third quantile: {summary.third_quartile}\n"
+                            f"Standard Deviation: {summary.stdev}")
         self.corr_label.configure(
-            text=f"Correlation: {correlation(left_data, right_data)}")
+            text=f"Correlation: {results[correlation_key]}")
         self.loading(False)
-        chart_type = StoryingTellingChartType(self.chart_combobox.get())
         self.figure.clear()
         ax = self.figure.add_subplot(111)
         if chart_type == StoryingTellingChartType.STACKED:
+            class_depth_counter = results[chart_key]
+            depths = sorted({depth for _, depth in class_depth_counter})
             counter = Counter()
-            for v in chain(
-                    *map(lambda source: source.everything(), self.db.sources)):
-                counter[v.depth()] += 1
-            depths = counter.keys()
-            counter = Counter()
-            for v in chain(
-                    *map(lambda source: source.everything(), self.db.sources)):
-                counter[v.class_name] += 1
-            common_classnames = [val[0] for val in counter.most_common(9)]
+            for (class_id, _), count in class_depth_counter.items():
+                counter[class_id] += count
+            common_classes = [val[0] for val in counter.most_common(9)]
             counter = Counter()
-            for v in chain(
-                    *map(lambda source: source.everything(), self.db.sources)):
-                counter[(v.class_name if v.class_name in common_classnames else
-                         "Other", v.depth())] += 1
+            for (class_id, depth), count in class_depth_counter.items():
+                counter[(self.db.class_pool[class_id]
+                         if class_id in common_classes else "Other",
+                         depth)] += count
+            common_classnames = [
+                self.db.class_pool[class_id] for class_id in common_classes
+            ]
 
             color_arr = ("#FF0000", "#0000FF", "#F58231", "#FFFF00", "#BFEF45",
                          "#3CB44B", "#00FFFF", "#911EB4", "#F032E6", "#A9A9A9")
@@ -402,29 +741,44 @@ class StoryTellingTab(customtkinter.CTkFrame):
             self.chart_widget.draw()
             return
         if chart_type == StoryingTellingChartType.SCATTER:
-            ax.scatter(left_data, right_data)
+            ax.scatter(*results[chart_key])
+            ax.set_xlabel(self.left_desc.get())
+            ax.set_ylabel(self.right_desc.get())
+            self.chart_widget.draw()
+            return
+        if chart_type == StoryingTellingChartType.DENSITY:
+            counts, left_edges, right_edges = results[chart_key]
+            mesh = ax.pcolormesh(left_edges,
+                                 right_edges,
+                                 np.ma.masked_equal(counts.T, 0),
+                                 norm=LogNorm() if counts.any() else None)
+            self.figure.colorbar(mesh, ax=ax, label="Number of Instances")
+            ax.set_xlabel(self.left_desc.get())
+            ax.set_ylabel(self.right_desc.get())
+            self.chart_widget.draw()
+            return
+        if chart_type == StoryingTellingChartType.WEIGHTED_SCATTER:
+            pairs, counts = results[chart_key]
+            points = ax.scatter(pairs[:, 0],
+                                pairs[:, 1],
+                                s=4 + 100 * np.sqrt(counts / max(
+                                    counts.max(initial=0), 1)),
+                                c=counts,
+                                norm=LogNorm() if len(counts) else None)
+            self.figure.colorbar(points, ax=ax, label="Number of Instances")
             ax.set_xlabel(self.left_desc.get())
             ax.set_ylabel(self.right_desc.get())
             self.chart_widget.draw()
             return
         if chart_type == StoryingTellingChartType.PIE:
-            same_name = 0
-            diff_name = 0
-            for v in chain(
-                    *map(lambda source: source.everything(), self.db.sources)):
-                if v.class_name == v.name:
-                    same_name += 1
-                else:
-                    diff_name += 1
-            ax.pie([same_name, diff_name], labels=["Same", "Different"])
+            same_name_counter = results[chart_key]
+            ax.pie([same_name_counter[(True, )], same_name_counter[(False, )]],
+                   labels=["Same", "Different"])
             ax.set_title("Same Name and Class Name Pie Chart")
             self.chart_widget.draw()
             return
         if chart_type == StoryingTellingChartType.BOXPLOT:
-            ax.boxplot([
-                len(v.name) for v in chain(
-                    *map(lambda source: source.everything(), self.db.sources))
-            ])
+            ax.boxplot(results[chart_key])
             ax.set_title(chart_type.value)
             self.chart_widget.draw()
             return
@@ -499,7 +853,10 @@ class ChartTab(customtkinter.CTkFrame):
     """The chart tab."""
     db: Database
     loading: Callable
+    tasks: TaskRunner
+    task: Task | None
     compiled_data: CompiledData
+    compile_cache: CompiledDataCache
     chart_widget: SimpleChartWidget
     chart_type_combobox: customtkinter.CTkComboBox
     show_others_checkbox: customtkinter.CTkCheckBox
@@ -519,8 +876,11 @@ class ChartTab(customtkinter.CTkFrame):
         self.data_dirty = False
         self.filters = []
         self.filtered_sources = set()
+        self.task = None
         super().__init__(parent, **kwargs)
+        self.tasks = TaskRunner(self)
         self.compiled_data = CompiledData()
+        self.compile_cache = CompiledDataCache(database)
         self.init_components()
 
     def on_chart_type_selected(self, choice) -> None:
@@ -549,16 +909,19 @@ class ChartTab(customtkinter.CTkFrame):
     def on_chart_title_changed(self, *_):
         """Fired when chart title is changed."""
         self.chart_widget.options.chart_title = self.chart_title_string.get()
+        self.chart_widget.render_titles()
 
     def on_chart_x_axis_title_changed(self, *_):
         """Fired when chart title is changed."""
         self.chart_widget.options.chart_x_axis_title = self.chart_x_axis_title_string.get(
         )
+        self.chart_widget.render_titles()
 
     def on_chart_y_axis_title_changed(self, *_):
         """Fired when chart title is changed."""
         self.chart_widget.options.chart_y_axis_title = self.chart_y_axis_title_string.get(
         )
+        self.chart_widget.render_titles()
 
     def on_chart_key_type_selected(self, choice):
         """Fired when chart key type is changed."""
@@ -573,34 +936,77 @@ class ChartTab(customtkinter.CTkFrame):
             self.filtered_sources.add(path)
         self.data_dirty = True
 
+    def query(self) -> Tuple[Tuple, List[DataSource], List[Filter]]:
+        """Reads the chart key, sources and filters.
+
+        Raises:
+            ValueError: A filter is invalid.
+
+        Returns:
+            Tuple[Tuple, List[DataSource], List[Filter]]: A key equal for
+                queries with the same data, the sources and the filters.
+        """
+        filters = [Filter(fil.get()) for fil in self.filters]
+        sources = [
+            source for source in self.db.sources
+            if source.source_path not in self.filtered_sources
+        ]
+        query = (self.db.generation,
+                 frozenset(source.source_path for source in sources),
+                 self.key_type, filters_key(filters))
+        return query, sources, filters
+
     def on_draw(self):
         """Fires when the draw button is pressed."""
+        if not self.data_dirty:
+            self.chart_widget.render()
+            return
+        try:
+            query, sources, filters = self.query()
+        except ValueError as error:
+            tk.messagebox.showerror("Error", str(error))
+            return
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+        cached = self.compile_cache.get(query)
+        if cached is not None:
+            self.on_compiled(query, cached)
+            return
+        key = self.key_type.value
+        mask = combine_filters(filters) if filters else None
+        accuracy = (SKETCH_ACCURACY if sum(map(len, sources)) > SKETCH_INSTANCES
+                    else None)
+
+        def compile_data(progress: Callable[[float], None]) -> CompiledData:
+            compiled_data = CompiledData()
+            compiled_data.compile(sources, key, mask, progress, accuracy)
+            return compiled_data
+
         self.loading(True)
-        if self.data_dirty:
-            counter = tk.IntVar(value=0)
-
-            # GIL messing the shit up freezing it anyways, gotta do this dirty shit.
-            def pre_up(counter=counter):
-                val = counter.get()
-                counter.set(counter.get() + 1)
-                if val % 20000 == 0:
-                    self.update()
-
-            try:
-                self.compiled_data.compile(
-                    (source for source in self.db.sources
-                     if source.source_path not in self.filtered_sources),
-                    self.key_type.value,
-                    lambda val, eval_text=(
-                        (' and '.join('(' + fil.get() + ')'
-                                      for fil in self.filters))
-                        if self.filters else None): pre_up() or
-                    (eval(eval_text) if eval_text else True))
-            except Exception as error:
-                tk.messagebox.showerror("Error", error)
+        self.task = self.tasks.submit(
+            compile_data, lambda compiled_data: self.on_compiled(
+                query, compiled_data),
+            lambda fraction: self.loading(True, fraction), self.on_error)
+
+    def on_compiled(self, query, compiled_data: CompiledData) -> None:
+        """Fired when the chart data has been compiled."""
+        self.compile_cache.put(query, compiled_data)
+        self.compiled_data = compiled_data
+        self.chart_widget.compiled_data = compiled_data
+        # The key, sources or filters may have changed while compiling.
+        try:
+            self.data_dirty = self.query()[0] != query
+        except ValueError:
+            self.data_dirty = True
         self.chart_widget.render()
         self.loading(False)
 
+    def on_error(self, error: Exception) -> None:
+        """Fired when compiling the chart data fails."""
+        self.loading(False)
+        tk.messagebox.showerror("Error", str(error))
+
     def on_add_filter(self):
         """Fires when the add filter button is pressed."""
         entry_text = tk.StringVar(value="True")
@@ -608,12 +1014,14 @@ class ChartTab(customtkinter.CTkFrame):
                                        textvariable=entry_text)
 
         def value_changed(*_, text=entry_text, widget=entry):
+            self.data_dirty = True
             code = text.get()
             if code == '-':
                 self.filters.remove(text)
                 self.after(0, widget.destroy)
 
         self.filters.append(entry_text)
+        self.data_dirty = True
         entry_text.trace('w', value_changed)
         entry.pack(anchor=tk.N, expand=True, fill=tk.X)
 